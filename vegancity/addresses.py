@@ -0,0 +1,152 @@
+"""
+reduces the ways people write an address to one canonical form.
+
+"123 South St.", "123 south street" and "123 S St, Philadelphia, PA"
+all become "123 s st": the text is casefolded, street suffixes and
+directionals are abbreviated the way USPS Publication 28 does, units
+like "Apt 4" or "#4" are dropped, and so are trailing zip codes, the
+country and city of LOCATION_COMPONENTS and the state of DEFAULT_PLACES,
+which every address is assumed to be in.
+
+The canonical form is a key, for telling that two addresses are the
+same place; it is not sent to the geocoder.
+"""
+
+import re
+
+from django.conf import settings
+
+# commas are kept until the place names after them are dropped.
+TOKEN_RE = re.compile(r"#|,|[\w']+", re.UNICODE)
+ZIP_RE = re.compile(r'^\d{5}(\d{4})?$')
+
+SUFFIXES = {
+    'alley': 'aly', 'aly': 'aly',
+    'av': 'ave', 'ave': 'ave', 'aven': 'ave', 'avenue': 'ave',
+    'avn': 'ave',
+    'blvd': 'blvd', 'boul': 'blvd', 'boulevard': 'blvd',
+    'cir': 'cir', 'circ': 'cir', 'circle': 'cir',
+    'court': 'ct', 'ct': 'ct',
+    'dr': 'dr', 'drive': 'dr', 'drv': 'dr',
+    'expressway': 'expy', 'expy': 'expy',
+    'highway': 'hwy', 'hwy': 'hwy',
+    'lane': 'ln', 'ln': 'ln',
+    'parkway': 'pkwy', 'pkwy': 'pkwy', 'pky': 'pkwy',
+    'pike': 'pike', 'pk': 'pike',
+    'pl': 'pl', 'place': 'pl',
+    'plaza': 'plz', 'plz': 'plz',
+    'rd': 'rd', 'road': 'rd',
+    'sq': 'sq', 'square': 'sq',
+    'st': 'st', 'str': 'st', 'street': 'st',
+    'ter': 'ter', 'terr': 'ter', 'terrace': 'ter',
+    'way': 'way', 'wy': 'way',
+}
+
+DIRECTIONALS = {
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw',
+    'southeast': 'se', 'southwest': 'sw',
+}
+
+# each is followed by the unit's number or letter.
+UNIT_DESIGNATORS = frozenset([
+    '#', 'apartment', 'apt', 'bldg', 'building', 'dept', 'fl', 'floor',
+    'lot', 'rm', 'room', 'ste', 'suite', 'unit',
+])
+
+# places every address is in that LOCATION_COMPONENTS doesn't name,
+# because google isn't asked to narrow its results down to them.
+DEFAULT_PLACES = ('pa',)
+
+# other ways of writing the values LOCATION_COMPONENTS and
+# DEFAULT_PLACES may have.
+ALIASES = {
+    'us': ['usa', 'united states', 'united states of america'],
+    'pa': ['pennsylvania'],
+    'nj': ['new jersey'],
+    'de': ['delaware'],
+    'ny': ['new york'],
+}
+
+_defaults = {}
+
+
+def defaults():
+    """
+    returns the place names LOCATION_COMPONENTS and DEFAULT_PLACES
+    imply, as tuples of words, longest first.
+    """
+    components = settings.LOCATION_COMPONENTS
+    if components not in _defaults:
+        values = [component.partition(':')[2].lower()
+                  for component in components.split('|')]
+        names = set()
+        for value in values + list(DEFAULT_PLACES):
+            for name in [value] + ALIASES.get(value, []):
+                names.add(tuple(TOKEN_RE.findall(name)))
+        _defaults[components] = sorted(names, key=len, reverse=True)
+    return _defaults[components]
+
+
+def _follows_street(words):
+    """
+    whether a place name after `words` is where the address is, rather
+    than part of a street or neighborhood name like "West Philadelphia":
+    it is when a comma sets it off, or when it comes after a street
+    number and street.
+    """
+    if words[-1] == ',':
+        return True
+    return (len(words) > 1 and words[0][0].isdigit() and
+            words[-1] not in DIRECTIONALS)
+
+
+def _strip_defaults(words):
+    """
+    drops zip codes and implied place names from the end of `words`,
+    and then the commas between them.
+    """
+    place_names = defaults()
+    end = len(words)
+    while True:
+        while end and words[end - 1] == ',':
+            end -= 1
+        if end > 1 and ZIP_RE.match(words[end - 1]):
+            end -= 1
+            continue
+        for name in place_names:
+            start = end - len(name)
+            if (start > 0 and tuple(words[start:end]) == name and
+                    _follows_street(words[:start])):
+                end = start
+                break
+        else:
+            return [word for word in words[:end] if word != ',']
+
+
+def normalize(address):
+    "returns the canonical form of `address`, which may be empty."
+    words = []
+    tokens = iter(TOKEN_RE.findall(address.lower()))
+    for token in tokens:
+        if token in UNIT_DESIGNATORS and words:
+            next(tokens, None)
+        else:
+            words.append(token)
+
+    words = _strip_defaults(words)
+
+    # the first word of the street is left alone, even when it looks
+    # like a suffix, as in "Avenue of the Arts", unless it is a
+    # direction with more of the street after it.
+    start = 1 if words and words[0][0].isdigit() else 0
+    for i, word in enumerate(words):
+        if i <= start:
+            continue
+        if word in SUFFIXES:
+            words[i] = SUFFIXES[word]
+        elif word in DIRECTIONALS:
+            words[i] = DIRECTIONALS[word]
+    if len(words) > start + 1 and words[start] in DIRECTIONALS:
+        words[start] = DIRECTIONALS[words[start]]
+    return " ".join(words)
@@ -38,6 +38,12 @@ class VendorAdmin(GeoModelAdmin):
     form = AdminVendorForm
 
 
+class GeocodeJobAdmin(admin.ModelAdmin):
+    list_display = ('vendor', 'address', 'attempts', 'next_attempt',
+                    'last_error')
+    ordering = ('next_attempt',)
+
+
 class UserProfileInline(admin.StackedInline):
     model = models.UserProfile
 
@@ -59,3 +65,5 @@ admin.site.register(models.Review, ReviewAdmin)
 admin.site.register(models.CuisineTag)
 admin.site.register(models.FeatureTag)
 admin.site.register(models.Neighborhood)
+admin.site.register(models.GeocodeCacheEntry)
+admin.site.register(models.GeocodeJob, GeocodeJobAdmin)
@@ -1,10 +1,22 @@
+import calendar
+import hashlib
+import json
+
+from django.conf import settings
 from django.conf.urls import url
 from django.contrib.auth.models import User
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotModified
+from django.template.defaultfilters import slugify
+from django.utils.http import http_date
 from tastypie import fields
+from tastypie.http import HttpBadRequest
 from tastypie.resources import ModelResource
 from tastypie.utils import trailing_slash
-from vegancity import models
-from .search import master_search
+from vegancity import autocomplete, clusters, models, search_cache
+from .search import (master_search, paginate, estimate_count,
+                     filter_vendor_ids, get_bbox_param, get_int_param,
+                     get_near_params, nearest)
 
 from tastypie.api import Api
 
@@ -51,22 +63,204 @@ class VendorResource(ModelResource):
         response_url = url(url_body, self.wrap_view('get_search'),
                            name='api_get_search')
 
-        return [response_url]
+        autocomplete_body = r'^(?P<resource_name>%s)/autocomplete%s$' % (
+            self._meta.resource_name, trailing_slash())
 
-    def get_search(self, request, **kwargs):
-        raw_results = master_search(request.GET.get('q', ''))
-        vendors = []
+        autocomplete_url = url(autocomplete_body,
+                               self.wrap_view('get_autocomplete'),
+                               name='api_get_autocomplete')
+
+        geojson_body = r'^(?P<resource_name>%s)/geojson%s$' % (
+            self._meta.resource_name, trailing_slash())
+
+        geojson_url = url(geojson_body,
+                          self.wrap_view('get_geojson'),
+                          name='api_get_geojson')
+
+        nearby_body = r'^(?P<resource_name>%s)/nearby%s$' % (
+            self._meta.resource_name, trailing_slash())
 
-        results, status_code = raw_results
+        nearby_url = url(nearby_body,
+                         self.wrap_view('get_nearby'),
+                         name='api_get_nearby')
+
+        return [response_url, autocomplete_url, geojson_url, nearby_url]
+
+    def get_nearby(self, request, **kwargs):
+        """
+        The vendors nearest to a lat and lng, or to where a near
+        parameter geocodes to, nearest first, each with its distance in
+        meters. Takes limit and distance (in meters) parameters too.
+        """
+        point, limit, max_distance = get_near_params(request.GET)
+        if point is None:
+            return self.create_response(
+                request, {'error': "Pass lat and lng, or near."},
+                response_class=HttpBadRequest)
+
+        results = nearest(point, limit, max_distance,
+                          queryset=models.Vendor.objects.approved()
+                          .select_related('neighborhood', 'veg_level')
+                          .prefetch_related('cuisine_tags', 'feature_tags',
+                                            'review_set'))
+
+        vendors = []
         for result in results:
             bundle = self.build_bundle(obj=result, request=request)
             bundle = self.full_dehydrate(bundle)
+            bundle.data['distance'] = result.distance
             vendors.append(bundle)
 
-        ctx = {'vendors': vendors}
+        return self.create_response(request, {'vendors': vendors})
+
+    def get_geojson(self, request, **kwargs):
+        """
+        The located vendors the vendors page would list for the same
+        GET parameters, as a GeoJSON FeatureCollection for its map. Its
+        `more` member says whether a bbox viewport had more vendors
+        than it returns.
+
+        The ETag is derived from the search cache generation, which any
+        change to a vendor bumps, so a revalidation is answered without
+        touching the database.
+        """
+        etag = '"%s"' % hashlib.sha1("%s:%s" % (
+            search_cache.generation(), request.GET.urlencode())).hexdigest()
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        zoom = get_int_param(request.GET, 'zoom')
+        bbox = get_bbox_param(request.GET)
+        if (zoom is not None and bbox is not None and
+                zoom < settings.MAP_CLUSTER_MAX_ZOOM):
+            response = self.get_geojson_clusters(request, bbox, zoom)
+            response['ETag'] = etag
+            return response
+
+        vendor_ids, filters = filter_vendor_ids(request.GET)
+
+        qn = connection.ops.quote_name
+        location = "%s.%s" % (qn(models.Vendor._meta.db_table),
+                              qn('location'))
+        rows = (models.Vendor.objects
+                .filter(pk__in=vendor_ids, location__isnull=False)
+                .extra(select={'longitude': "ST_X(%s)" % location,
+                               'latitude': "ST_Y(%s)" % location})
+                .values('id', 'name', 'address', 'phone', 'veg_level_id',
+                        'modified', 'longitude', 'latitude'))
+        rows = dict((row['id'], row) for row in rows)
+
+        features = []
+        for pk in vendor_ids:
+            if pk not in rows:
+                continue
+            row = rows[pk]
+            features.append({
+                'type': 'Feature',
+                'id': pk,
+                'geometry': {'type': 'Point',
+                             'coordinates': [row['longitude'],
+                                             row['latitude']]},
+                'properties': {
+                    'name': row['name'],
+                    'address': row['address'],
+                    'phone': row['phone'],
+                    'url': "/vendors/%d-%s/" % (pk, slugify(row['name'])),
+                    'vegLevel': row['veg_level_id'] or 0,
+                },
+            })
+
+        response = HttpResponse(
+            json.dumps({'type': 'FeatureCollection', 'features': features,
+                        'more': filters['more'], 'clustered': False}),
+            content_type='application/json')
+        response['ETag'] = etag
+        modified = [values['modified'] for values in rows.values()
+                    if values['modified'] is not None]
+        if modified:
+            response['Last-Modified'] = http_date(
+                calendar.timegm(max(modified).utctimetuple()))
+        return response
+
+    def get_autocomplete(self, request, **kwargs):
+        completions = autocomplete.index.complete(request.GET.get('q', ''))
+        ctx = {
+            'completions': [{'type': kind, 'id': pk, 'name': label}
+                            for kind, pk, label in completions],
+        }
+        return self.create_response(request, ctx)
+
+    def get_search(self, request, **kwargs):
+        vendors = models.Vendor.objects.approved()
+        bbox = get_bbox_param(request.GET)
+        if bbox is not None:
+            vendors = vendors.filter(location__within=bbox)
+
+        results = master_search(request.GET.get('q', ''), vendors)
+        total_count, total_count_exact = estimate_count(results)
+
+        try:
+            after = int(request.GET['after'])
+        except (KeyError, ValueError):
+            after = None
+
+        # everything full_dehydrate reads is fetched for the whole page
+        # up front, so a page costs the same few queries at any size.
+        results = (results
+                   .select_related('neighborhood', 'veg_level')
+                   .prefetch_related('cuisine_tags', 'feature_tags',
+                                     'review_set'))
+        page, next_after = paginate(results, after=after)
+
+        vendors = []
+        for result in page:
+            bundle = self.build_bundle(obj=result, request=request)
+            bundle = self.full_dehydrate(bundle)
+            vendors.append(bundle)
+
+        if next_after is None:
+            next_url = None
+        else:
+            params = request.GET.copy()
+            params['after'] = next_after
+            next_url = "%s?%s" % (request.path, params.urlencode())
+
+        ctx = {
+            'meta': {
+                'total_count': total_count,
+                'total_count_exact': total_count_exact,
+                'next': next_url,
+            },
+            'vendors': vendors,
+        }
 
         return self.create_response(request, ctx)
 
+    def get_geojson_clusters(self, request, bbox, zoom):
+        # clusters are cached per tile rather than per viewport, so
+        # the vendors are filtered without the bbox.
+        params = request.GET.copy()
+        del params['bbox']
+        vendor_ids, filters = filter_vendor_ids(params)
+
+        features = [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point',
+                         'coordinates': [cluster['longitude'],
+                                         cluster['latitude']]},
+            'properties': {'count': cluster['count'],
+                           'vegLevels': cluster['vegLevels']},
+        } for cluster in clusters.get_clusters(vendor_ids,
+                                               filters['cache_key'],
+                                               bbox.extent, zoom)]
+
+        return HttpResponse(
+            json.dumps({'type': 'FeatureCollection', 'features': features,
+                        'more': False, 'clustered': True}),
+            content_type='application/json')
+
     def dehydrate_food_rating(self, bundle):
         return bundle.obj.food_rating()
 
@@ -0,0 +1,103 @@
+""" an in-memory prefix index of the names people type into the search box """
+
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+from vegancity.fields import StatusField as SF
+from vegancity.query_classifier import normalize
+
+# the order completions of each kind are listed in
+KINDS = ('vendor', 'cuisine_tag', 'feature_tag', 'neighborhood')
+
+
+class PrefixIndex(object):
+    """
+    The names of approved vendors, tags and neighborhoods, kept sorted
+    in memory so completing a prefix is a binary search.
+
+    The index is rebuilt lazily: change signals call invalidate(), and
+    the next lookup reloads it. It is also reloaded every
+    AUTOCOMPLETE_INDEX_TTL seconds, to pick up changes made by other
+    processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = 0
+        self._tables = (((), ()), ((), ()))
+
+    def refresh(self):
+        with self._lock:
+            if self._expires > time.time():
+                return self
+            self._load()
+            self._expires = time.time() + settings.AUTOCOMPLETE_INDEX_TTL
+        return self
+
+    def invalidate(self):
+        self._expires = 0
+
+    def _load(self):
+        from vegancity.models import (Vendor, Neighborhood,
+                                      CuisineTag, FeatureTag)
+
+        sources = (
+            ('vendor', Vendor.objects.filter(approval_status=SF.APPROVED)
+             .values_list('id', 'name')),
+            ('cuisine_tag', CuisineTag.objects.values_list('id',
+                                                           'description')),
+            ('feature_tag', FeatureTag.objects.values_list('id',
+                                                           'description')),
+            ('neighborhood', Neighborhood.objects.values_list('id', 'name')),
+        )
+
+        # whole names are matched before later words in them, so
+        # "green" completes "Green Line" before "Mean Green Cafe".
+        names, words = [], []
+        for kind, rows in sources:
+            for pk, label in rows:
+                entry = (kind, pk, label)
+                text = normalize(label)
+                names.append((text, entry))
+                split = text.split()
+                for i in range(1, len(split)):
+                    words.append((" ".join(split[i:]), entry))
+
+        # swapped in with a single assignment, so lookups running while
+        # the index reloads always see a consistent one.
+        self._tables = (self._split(names), self._split(words))
+
+    def _split(self, pairs):
+        pairs.sort(key=lambda pair: (pair[0], KINDS.index(pair[1][0])))
+        return (tuple(key for key, entry in pairs),
+                tuple(entry for key, entry in pairs))
+
+    def complete(self, prefix, limit=None):
+        """
+        returns up to `limit` (kind, pk, label) tuples whose names, or a
+        word in them, start with `prefix`.
+        """
+        if limit is None:
+            limit = settings.AUTOCOMPLETE_LIMIT
+
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        self.refresh()
+        results, seen = [], set()
+        for keys, entries in self._tables:
+            i = bisect.bisect_left(keys, prefix)
+            while (len(results) < limit and i < len(keys) and
+                   keys[i].startswith(prefix)):
+                if entries[i] not in seen:
+                    seen.add(entries[i])
+                    results.append(entries[i])
+                i += 1
+        return results
+
+
+index = PrefixIndex()
@@ -0,0 +1,128 @@
+""" benchmarks run against the configured database with `manage.py benchmark` """
+
+import random
+import time
+
+from django.db import connection, transaction
+
+from vegancity import addresses, search
+from vegancity.models import Vendor, Review
+from vegancity.fields import StatusField as SF
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timed(func, repeat):
+    "calls `func` `repeat` times, returns (mean milliseconds, last result)."
+    start = time.time()
+    for i in range(repeat):
+        result = func()
+    return (time.time() - start) * 1000 / repeat, result
+
+
+@benchmark
+def search_trigram(repeat=10):
+    """
+    Compares Vendor.objects.search with the trigram matcher for whole
+    vendor names and for the first few letters of each, which is what
+    people type before giving up.
+
+    Like every benchmark, returns a tuple of (column names, rows).
+    """
+    names = (Vendor.objects.filter(approval_status=SF.APPROVED)
+             .values_list('name', flat=True)[:50])
+    whole = [name for name in names if name.strip()]
+    partial = [word[:max(3, len(word) // 2)]
+               for name in whole for word in name.split()[:1]]
+
+    def fulltext(query):
+        return lambda: list(Vendor.objects.approved().search(query)
+                            .values_list('id', flat=True))
+
+    def trigram(query):
+        where, params = search.trigram_match_sql(query)
+        return lambda: list(Vendor.objects.approved()
+                            .extra(where=[where], params=params)
+                            .values_list('id', flat=True))
+
+    rows = []
+    for label, queries in (('whole names', whole),
+                           ('partial words', partial)):
+        for engine, build in (('fulltext', fulltext),
+                              ('trigram', trigram)):
+            total_ms, hits = 0, 0
+            for query in queries:
+                ms, result = timed(build(query), repeat)
+                total_ms += ms
+                hits += bool(result)
+            rows.append((label, engine, len(queries),
+                         total_ms / max(len(queries), 1), hits))
+    return ('queries', 'matcher', 'count', 'mean', 'with hits'), rows
+
+
+@benchmark
+def random_unreviewed(repeat=10, sizes=(1000, 10000, 100000)):
+    """
+    Compares picking a random unreviewed vendor by loading them all, as
+    get_random_unreviewed used to, with its indexed pick. Each catalog
+    size is made of throwaway unreviewed vendors that are rolled back
+    afterwards.
+    """
+
+    def choose_from_all():
+        reviewed = (Review.objects.approved()
+                    .values_list('vendor_id', flat=True))
+        return random.choice(Vendor.objects.approved()
+                             .exclude(pk__in=reviewed))
+
+    def indexed_pick():
+        return Vendor.objects.approved().get_random_unreviewed()
+
+    rows = []
+    with transaction.atomic():
+        for size in sizes:
+            savepoint = transaction.savepoint()
+            Vendor.objects.bulk_create(
+                [Vendor(name="benchmark vendor %d" % i,
+                        approval_status=SF.APPROVED)
+                 for i in range(size)], batch_size=1000)
+            # so the planner knows the table has grown
+            connection.cursor().execute("ANALYZE %s"
+                                        % Vendor._meta.db_table)
+            for strategy, pick in (('load all', choose_from_all),
+                                   ('indexed pick', indexed_pick)):
+                ms, _ = timed(pick, repeat)
+                rows.append((size, strategy, ms))
+            transaction.savepoint_rollback(savepoint)
+    return ('vendors', 'strategy', 'mean'), rows
+
+
+@benchmark
+def address_normalization(repeat=10):
+    """
+    Times addresses.normalize over every vendor address, against the
+    casefolding the geocode cache used to be keyed on, and counts the
+    distinct keys each leaves, which is how many geocoder calls the
+    whole catalog would cost.
+    """
+    vendor_addresses = list(Vendor.objects.exclude(address__isnull=True)
+                            .exclude(address='')
+                            .values_list('address', flat=True))
+
+    def casefold(address):
+        return " ".join(address.lower().replace(",", " ").split())
+
+    rows = []
+    for label, key in (('casefold', casefold),
+                       ('normalize', addresses.normalize)):
+        ms, keys = timed(lambda: [key(address)
+                                  for address in vendor_addresses], repeat)
+        per_second = int(len(vendor_addresses) * 1000 / ms) if ms else None
+        rows.append((label, len(vendor_addresses), ms, per_second,
+                     len(set(keys))))
+    return ('key', 'addresses', 'mean', 'per second', 'distinct'), rows
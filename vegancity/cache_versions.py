@@ -0,0 +1,42 @@
+"""
+named version counters, kept in the cache, for building keys that a
+change can invalidate all at once by bumping the version.
+"""
+
+import time
+
+from django.core.cache import cache
+
+KEY_FORMAT = 'vegancity:version:%s'
+
+
+def _initial():
+    # start from the clock, in milliseconds, rather than 1, so that if
+    # a counter is evicted it does not come back at a number that was
+    # already used.
+    return int(time.time() * 1000)
+
+
+def get_versions(names):
+    "returns a dict of each name to its current version, in one read."
+    keys = dict((KEY_FORMAT % name, name) for name in names)
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, name in keys.items():
+        if key not in found:
+            cache.add(key, _initial(), None)
+            found[key] = cache.get(key)
+        versions[name] = found[key]
+    return versions
+
+
+def get_version(name):
+    return get_versions([name])[name]
+
+
+def bump(*names):
+    for name in names:
+        try:
+            cache.incr(KEY_FORMAT % name)
+        except ValueError:
+            cache.add(KEY_FORMAT % name, _initial(), None)
@@ -0,0 +1,120 @@
+"""
+groups the vendors on the map into clusters when it is zoomed out.
+
+Each map tile is divided into a MAP_CLUSTER_GRID by MAP_CLUSTER_GRID
+grid, and PostGIS counts the vendors in each cell, by veg level. A cell
+never straddles two tiles, so the clusters of each tile are cached on
+their own, under the search cache key of the filters they were computed
+for, and panning only computes the tiles that come into view.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from vegancity import tiles
+
+CELL_SQL = """
+    SELECT floor((ST_X(point) + %%s) / %%s) AS cell_x,
+           floor((%%s - ST_Y(point)) / %%s) AS cell_y,
+           veg_level_id, count(*), sum(longitude), sum(latitude)
+    FROM (SELECT ST_Transform(%(location)s, 3857) AS point,
+                 COALESCE(%(veg_level_id)s, 0) AS veg_level_id,
+                 ST_X(%(location)s) AS longitude,
+                 ST_Y(%(location)s) AS latitude
+          FROM %(table)s
+          WHERE %(id)s = ANY(%%s)
+          AND %(location)s && ST_MakeEnvelope(%%s, %%s, %%s, %%s, 4326)
+         ) AS vendors
+    GROUP BY 1, 2, 3
+"""
+
+
+def _cell_sql():
+    from vegancity.models import Vendor
+
+    qn = connection.ops.quote_name
+    table = qn(Vendor._meta.db_table)
+    return CELL_SQL % {
+        'table': table,
+        'id': "%s.%s" % (table, qn('id')),
+        'location': "%s.%s" % (table, qn('location')),
+        'veg_level_id': "%s.%s" % (table, qn('veg_level_id')),
+    }
+
+
+def _tile_key(search_key, zoom, x, y):
+    return '%s:clusters:%d/%d/%d' % (search_key, zoom, x, y)
+
+
+def _compute(vendor_ids, zoom, tile_list):
+    "returns a dict of each tile in `tile_list` to its clusters."
+    bounds = [tiles.tile_bounds(zoom, x, y) for x, y in tile_list]
+    envelope = [min(b[0] for b in bounds), min(b[1] for b in bounds),
+                max(b[2] for b in bounds), max(b[3] for b in bounds)]
+    cell = tiles.tile_size(zoom) / settings.MAP_CLUSTER_GRID
+
+    cursor = connection.cursor()
+    cursor.execute(_cell_sql(),
+                   [tiles.ORIGIN, cell, tiles.ORIGIN, cell,
+                    list(vendor_ids)] + envelope)
+
+    cells = {}
+    for cell_x, cell_y, veg_level_id, count, lng, lat in cursor.fetchall():
+        totals = cells.setdefault((int(cell_x), int(cell_y)),
+                                  {'count': 0, 'lng': 0, 'lat': 0,
+                                   'vegLevels': {}})
+        totals['count'] += count
+        totals['lng'] += lng
+        totals['lat'] += lat
+        totals['vegLevels'][veg_level_id] = count
+
+    clusters = dict((tile, []) for tile in tile_list)
+    for (cell_x, cell_y), totals in sorted(cells.items()):
+        tile = (cell_x // settings.MAP_CLUSTER_GRID,
+                cell_y // settings.MAP_CLUSTER_GRID)
+        if tile in clusters:
+            clusters[tile].append({
+                'count': totals['count'],
+                'longitude': totals['lng'] / totals['count'],
+                'latitude': totals['lat'] / totals['count'],
+                'vegLevels': totals['vegLevels'],
+            })
+    return clusters
+
+
+def get_clusters(vendor_ids, search_key, extent, zoom):
+    """
+    returns the clusters of the vendors with `vendor_ids` in the tiles
+    that cover `extent`, a (min_lng, min_lat, max_lng, max_lat) tuple,
+    at `zoom`. `search_key` is the search cache key the ids came from;
+    if it is None, as for nearest vendor searches, nothing is cached.
+
+    Each cluster is a dict of its vendor count, the average longitude
+    and latitude of its vendors, and a dict of veg level ids, with 0
+    for none, to how many of its vendors have them.
+
+    An extent that would take more than MAP_CLUSTER_MAX_TILES tiles is
+    clustered at a lower zoom instead.
+    """
+    tile_list = tiles.tiles_covering(extent, zoom)
+    while len(tile_list) > settings.MAP_CLUSTER_MAX_TILES and zoom > 0:
+        zoom -= 1
+        tile_list = tiles.tiles_covering(extent, zoom)
+
+    if search_key is None:
+        clusters = _compute(vendor_ids, zoom, tile_list)
+        return [cluster for tile in tile_list for cluster in clusters[tile]]
+
+    keys = dict((tile, _tile_key(search_key, zoom, *tile))
+                for tile in tile_list)
+    found = cache.get_many(keys.values())
+    missing = [tile for tile in tile_list if keys[tile] not in found]
+    if missing:
+        computed = _compute(vendor_ids, zoom, missing)
+        cache.set_many(dict((keys[tile], computed[tile])
+                            for tile in missing),
+                       settings.SEARCH_CACHE_TTL)
+        found.update((keys[tile], computed[tile]) for tile in missing)
+
+    return [cluster for tile in tile_list for cluster in found[keys[tile]]]
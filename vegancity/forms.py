@@ -1,6 +1,7 @@
 from django import forms
 
 import models
+from query_classifier import normalize
 
 from django.contrib.auth.forms import UserCreationForm
 
@@ -93,6 +94,21 @@ class NewVendorForm(forms.ModelForm):
             'feature_tags': forms.CheckboxSelectMultiple,
         }
 
+    def clean(self):
+        cleaned_data = super(NewVendorForm, self).clean()
+        name = cleaned_data.get('name')
+        address = cleaned_data.get('address')
+
+        # several vendors can share an address, as in a market, so a
+        # vendor is only a duplicate if its name matches too.
+        if name and address:
+            for vendor in models.Vendor.objects.at_address(address):
+                if normalize(vendor.name) == normalize(name):
+                    raise forms.ValidationError(
+                        "%s is already listed at this address."
+                        % vendor.name)
+        return cleaned_data
+
 ##############################
 ### Review Forms
 ##############################
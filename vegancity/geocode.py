@@ -1,9 +1,282 @@
 """ module for performing various sorts of geocoding related tasks """
 
-import urllib
+import collections
+import hashlib
+import httplib
 import json
+import logging
+import Queue
+import socket
+import threading
+import time
+import urllib
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_by_path
+
+from vegancity import addresses
+from settings import (LOCATION_BOUNDS, LOCATION_COMPONENTS,
+                      GEOCODE_CACHE_TTL, GEOCODE_CACHE_NEGATIVE_TTL,
+                      GEOCODE_CACHE_LRU_SIZE, GEOCODE_TIMEOUT,
+                      GEOCODE_POOL_SIZE, GEOCODE_BREAKER_THRESHOLD,
+                      GEOCODE_BREAKER_RESET)
+
+logger = logging.getLogger(__name__)
+
+# google statuses that mean "this address has no answer", as opposed
+# to transient failures like OVER_QUERY_LIMIT that are worth retrying.
+NEGATIVE_STATUSES = ('ZERO_RESULTS', 'INVALID_REQUEST')
+
+
+class LRUCache(object):
+    """
+    A small thread-safe, in-process LRU cache with per-entry expiry.
+
+    Sits in front of the database cache so that repeated lookups
+    within a worker never leave the process.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return None
+            if expires < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to `size` idle keep-alive connections to one host, so that
+    lookups reuse a connection instead of opening one each time. Every
+    connection has a `timeout` in seconds, for connecting and for each
+    read.
+    """
+
+    def __init__(self, host, size, timeout):
+        self.host = host
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue(size)
+
+    def _connect(self):
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _fetch(self, connection, path):
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            return response, response.read()
+        except (httplib.HTTPException, IOError):
+            connection.close()
+            raise
+
+    def get(self, path):
+        "returns the status and body of a GET of `path`."
+        try:
+            connection = self._idle.get_nowait()
+        except Queue.Empty:
+            connection = None
+
+        if connection is not None:
+            try:
+                response, body = self._fetch(connection, path)
+            except socket.timeout:
+                raise
+            except (httplib.HTTPException, IOError):
+                # the host may have closed the idle connection, so try
+                # once more on a new one.
+                connection = None
+
+        if connection is None:
+            connection = self._connect()
+            response, body = self._fetch(connection, path)
+
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except Queue.Full:
+                connection.close()
+        return response.status, body
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling the geocoder once `threshold` calls in a row have
+    failed, so that lookups fail at once instead of each waiting out a
+    timeout. After `reset_after` seconds one call is let through to try it
+    again, and closes the breaker if it succeeds.
+
+    A breaker with a `name` publishes, in the cache, where every process
+    can read them, the state it last changed to and when, how many times
+    it has opened and how many calls it has refused; see metrics().
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+    METRIC_KEY_FORMAT = 'vegancity:breaker:%s:%s'
+
+    def __init__(self, threshold, reset_after, name=None):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return self.CLOSED
+        if time.time() - self.opened < self.reset_after:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        "returns whether a call may be made now."
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trying:
+                self._trying = True
+                return True
+        self._count('refused')
+        return False
+
+    def succeeded(self):
+        if self.opened is not None:
+            logger.info("The geocoder is answering again.")
+            self._changed(self.CLOSED)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self._trying = False
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self._trying or self.failures >= self.threshold:
+                opening = self.opened is None
+                if opening:
+                    logger.warn("The geocoder failed %d times in a row; "
+                                "not calling it for %d seconds."
+                                % (self.failures, self.reset_after))
+                self.opened = time.time()
+                self._trying = False
+            else:
+                opening = False
+        if opening:
+            self._changed(self.OPEN)
+            self._count('opened')
+
+    def _key(self, metric):
+        return self.METRIC_KEY_FORMAT % (self.name, metric)
+
+    def _changed(self, state):
+        if self.name is not None:
+            cache.set_many({self._key('state'): state,
+                            self._key('changed'): time.time()}, None)
+
+    def _count(self, metric):
+        if self.name is None:
+            return
+        try:
+            cache.incr(self._key(metric))
+        except ValueError:
+            cache.add(self._key(metric), 1, None)
+
+    def metrics(self):
+        """
+        returns a dict of what this breaker has published: the 'state'
+        any process last changed it to, when, as 'changed', and the
+        'opened' and 'refused' counts, each None until it happens.
+        """
+        metrics = ('state', 'changed', 'opened', 'refused')
+        found = cache.get_many([self._key(metric) for metric in metrics])
+        return dict((metric, found.get(self._key(metric)))
+                    for metric in metrics)
+
+
+class GeocodeTimer(object):
+    """
+    Keeps a moving average of how long calls to the geocoder take, so
+    that skipped lookups can report roughly how much time they saved.
+    Cache hits are not calls, and are not timed.
+    """
+
+    def __init__(self, weight=0.2):
+        self.weight = weight
+        self.average = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            if self.average is None:
+                self.average = seconds
+            else:
+                self.average += self.weight * (seconds - self.average)
+
+
+_memory_cache = LRUCache(GEOCODE_CACHE_LRU_SIZE)
+breaker = CircuitBreaker(GEOCODE_BREAKER_THRESHOLD, GEOCODE_BREAKER_RESET,
+                         name='geocoder')
+timer = GeocodeTimer()
+
 
-from settings import LOCATION_BOUNDS, LOCATION_COMPONENTS
+def location_bounds():
+    "returns LOCATION_BOUNDS as a (min_lng, min_lat, max_lng, max_lat) tuple."
+    (sw_lat, sw_lng), (ne_lat, ne_lng) = [
+        map(float, corner.split(',')) for corner in LOCATION_BOUNDS.split('|')]
+    return sw_lng, sw_lat, ne_lng, ne_lat
+
+
+def cache_key(address):
+    """
+    returns the key an address is cached under, which is the same for
+    every way of writing the same address. The location settings
+    and the geocoder backend are part of the key so that changing them
+    invalidates old results.
+    """
+    raw_key = "|".join([addresses.normalize(address),
+                        LOCATION_BOUNDS, LOCATION_COMPONENTS,
+                        settings.GEOCODER_BACKEND])
+    return hashlib.sha1(force_bytes(raw_key)).hexdigest()
+
+
+class GeocodeError(Exception):
+    "the geocoder could not answer this time, but may if asked again."
 
 
 def geocode_address(address):
@@ -14,28 +287,199 @@ def geocode_address(address):
     if geocoding fails, silently returns a 3-tuple of None values.
     logging should be performed on the other end where more context
     is available.
+
+    results are cached in process and in the database. Failed lookups
+    are cached too, for GEOCODE_CACHE_NEGATIVE_TTL seconds.
     """
+    try:
+        return lookup(address)
+    except GeocodeError:
+        return None, None, None
 
-    base_url = "http://maps.googleapis.com/maps/api/geocode/json?"
-    address_param = "address=" + urllib.quote_plus(address)
-    sensor_param = "sensor=false"
-    bounds_param = "bounds=" + LOCATION_BOUNDS
-    components_param = "components=" + LOCATION_COMPONENTS
 
-    full_url = base_url + "&".join([address_param, sensor_param,
-                                    bounds_param, components_param])
-    raw_response = urllib.urlopen(full_url).read()
-    json_response = json.loads(raw_response)
-    if not json_response['status'] == 'OK':
-        latitude = longitude = neighborhood = None
+def lookup(address, refresh=False):
+    """
+    like geocode_address, but raises GeocodeError when the geocoder is
+    unreachable or over its quota, rather than reporting no result, so
+    that the caller can try again later. While the circuit breaker is
+    open, it raises without calling the geocoder at all.
+
+    With `refresh`, the caches are not read: the geocoder is always
+    asked, and its answer replaces whatever they held for `address`.
+    """
+    key = cache_key(address)
+
+    entry = None
+    if not refresh:
+        result = _memory_cache.get(key)
+        if result is not None:
+            return result
+        entry = _read_cache(key)
+
+    if entry is not None:
+        result, ttl = entry
     else:
-        latitude = json_response['results'][0]['geometry']['location']['lat']
-        longitude = json_response['results'][0]['geometry']['location']['lng']
-        neighborhd_hashes = [hash for hash in
-                             json_response['results'][0]['address_components']
-                             if 'neighborhood' in hash['types']]
-        if neighborhd_hashes:
-            neighborhood = neighborhd_hashes[0]['long_name']
+        if not breaker.allow():
+            raise GeocodeError("the geocoder is unavailable")
+        start = time.time()
+        try:
+            status, result = get_backend().geocode(address)
+        except (httplib.HTTPException, IOError, ValueError) as e:
+            breaker.failed()
+            raise GeocodeError(str(e) or e.__class__.__name__)
+        except Exception:
+            breaker.failed()
+            raise
+        finally:
+            timer.record(time.time() - start)
+
+        # a quota error counts as a failure as much as a timeout does.
+        if status == 'OK' or status in NEGATIVE_STATUSES:
+            breaker.succeeded()
         else:
-            neighborhood = None
-    return latitude, longitude, neighborhood
+            breaker.failed()
+
+        ttl = _write_cache(key, address, status, result)
+        if ttl is None:
+            raise GeocodeError(status)
+
+    _memory_cache.set(key, result, time.time() + ttl)
+
+    return result
+
+
+def _read_cache(key):
+    """
+    returns a (result, seconds until expiry) tuple for a live cache
+    entry, or None.
+    """
+    from vegancity.models import GeocodeCacheEntry
+    now = timezone.now()
+    try:
+        entry = GeocodeCacheEntry.objects.live(now).get(key=key)
+    except GeocodeCacheEntry.DoesNotExist:
+        return None
+    return entry.as_result(), (entry.expires - now).total_seconds()
+
+
+def _write_cache(key, address, status, result):
+    """
+    stores a geocoder response and returns its ttl in seconds.
+    Transient failures are not stored, and None is returned.
+    """
+    from vegancity.models import GeocodeCacheEntry
+
+    if status == 'OK':
+        ttl = GEOCODE_CACHE_TTL
+    elif status in NEGATIVE_STATUSES:
+        ttl = GEOCODE_CACHE_NEGATIVE_TTL
+    else:
+        return None
+
+    latitude, longitude, neighborhood = result
+    values = {
+        'address': address,
+        'latitude': latitude,
+        'longitude': longitude,
+        'neighborhood': neighborhood,
+        'expires': timezone.now() + timedelta(seconds=ttl),
+    }
+
+    updated = GeocodeCacheEntry.objects.filter(key=key).update(**values)
+    if not updated:
+        try:
+            with transaction.atomic():
+                GeocodeCacheEntry.objects.create(key=key, **values)
+        except IntegrityError:
+            # another process cached the same address first, which is fine.
+            pass
+
+    return ttl
+
+
+_backends = {}
+
+
+def get_backend():
+    "returns an instance of the GEOCODER_BACKEND class."
+    path = settings.GEOCODER_BACKEND
+    if path not in _backends:
+        _backends[path] = import_by_path(path)()
+    return _backends[path]
+
+
+class GoogleGeocoder(object):
+    """
+    Geocodes with the Google Maps geocoding API, within LOCATION_BOUNDS
+    and LOCATION_COMPONENTS.
+
+    Like every backend, its geocode method returns a status, which is
+    'OK', one of NEGATIVE_STATUSES for addresses that have no answer, or
+    anything else for failures worth trying again, along with the usual
+    3-tuple.
+    """
+
+    def __init__(self):
+        self.connections = ConnectionPool('maps.googleapis.com',
+                                          GEOCODE_POOL_SIZE, GEOCODE_TIMEOUT)
+
+    def geocode(self, address):
+        base_path = "/maps/api/geocode/json?"
+        address_param = "address=" + urllib.quote_plus(address)
+        sensor_param = "sensor=false"
+        bounds_param = "bounds=" + LOCATION_BOUNDS
+        components_param = "components=" + LOCATION_COMPONENTS
+
+        path = base_path + "&".join([address_param, sensor_param,
+                                     bounds_param, components_param])
+        http_status, raw_response = self.connections.get(path)
+        if http_status != httplib.OK:
+            raise GeocodeError("HTTP %d" % http_status)
+        json_response = json.loads(raw_response)
+        if not json_response['status'] == 'OK':
+            latitude = longitude = neighborhood = None
+        else:
+            result = json_response['results'][0]
+            latitude = result['geometry']['location']['lat']
+            longitude = result['geometry']['location']['lng']
+            neighborhd_hashes = [hash for hash in
+                                 result['address_components']
+                                 if 'neighborhood' in hash['types']]
+            if neighborhd_hashes:
+                neighborhood = neighborhd_hashes[0]['long_name']
+            else:
+                neighborhood = None
+        return json_response['status'], (latitude, longitude, neighborhood)
+
+
+class LocalGeocoder(object):
+    """
+    Geocodes offline, from the address points loaded into the database
+    by the load_address_points command, so that the catalog can be
+    geocoded and search load tested without the network or a quota.
+
+    A house number with no point of its own is placed between the
+    nearest numbers either side of it on the street, and a street with
+    no number at the middle point of the street. It never knows the
+    neighborhood; that comes from the neighborhood boundaries.
+    """
+
+    def geocode(self, address):
+        from vegancity.models import AddressPoint
+
+        point = AddressPoint.objects.locate(*split_address(address))
+        if point is None:
+            return 'ZERO_RESULTS', (None, None, None)
+        return 'OK', (point.y, point.x, None)
+
+
+def split_address(address):
+    """
+    returns the house number, or None, and the normalized street of an
+    address, leaving out anything after its first comma, like the city.
+    """
+    street = addresses.normalize(address.split(',')[0])
+    number, _, rest = street.partition(' ')
+    if number.isdigit() and rest:
+        return int(number), rest
+    return None, street
@@ -0,0 +1,137 @@
+"""
+geocodes the vendors queued by Vendor.save, outside of any request.
+
+The geocode_vendors command claims due GeocodeJobs in batches and looks
+their addresses up no faster than GEOCODE_QUEUE_RATE a second. A lookup
+that fails for a reason that may pass, like the geocoder being
+unreachable or over its quota, is tried again later, each time waiting
+twice as long, up to GEOCODE_QUEUE_MAX_ATTEMPTS attempts.
+
+Writing a result is idempotent: the vendor is only saved if it still
+has the address that was looked up and its location or neighborhood
+actually changes, so a job that runs twice, or after the vendor has
+moved on, does no harm.
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from vegancity import geocode, leaderboards
+
+logger = logging.getLogger(__name__)
+
+
+class Throttle(object):
+    "waits, when called, so that it is called at most `rate` times a second."
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.last = None
+
+    def __call__(self):
+        if self.last is not None:
+            wait = self.last + self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        self.last = time.time()
+
+
+def retry_delay(attempts):
+    "how long to wait before trying a job again, after `attempts` attempts."
+    return timedelta(seconds=settings.GEOCODE_QUEUE_RETRY_DELAY
+                     * 2 ** (attempts - 1))
+
+
+def save_result(job, result):
+    """
+    writes a geocoder result to the job's vendor, unless its address has
+    changed since the job was claimed, and finishes the job. Returns
+    whether the vendor was saved.
+    """
+    from vegancity.models import GeocodeJob, Vendor
+
+    with transaction.atomic():
+        try:
+            vendor = Vendor.objects.select_for_update().get(
+                pk=job.vendor_id)
+        except Vendor.DoesNotExist:
+            return False
+
+        saved = False
+        if vendor.address == job.address:
+            previous = (vendor.location, vendor.neighborhood_id)
+            vendor.apply_geocode_result(result)
+            if (vendor.location, vendor.neighborhood_id) != previous:
+                vendor.save(update_fields=['location', 'neighborhood'])
+                saved = True
+
+        # a vendor saved with a new address in the meantime has had
+        # this job queued again for it, which must be left to run.
+        GeocodeJob.objects.filter(pk=job.pk, address=job.address).delete()
+    leaderboards.invalidate_pending()
+    return saved
+
+
+def retry(job, error):
+    from vegancity.models import GeocodeJob
+
+    attempts = job.attempts + 1
+    if attempts >= settings.GEOCODE_QUEUE_MAX_ATTEMPTS:
+        logger.warn("Giving up geocoding '%s' for vendor %d: %s"
+                    % (job.address, job.vendor_id, error))
+    GeocodeJob.objects.filter(pk=job.pk, address=job.address).update(
+        attempts=attempts,
+        next_attempt=timezone.now() + retry_delay(attempts),
+        last_error=error)
+
+
+def purge_cache():
+    """
+    deletes the expired geocoder responses, which are otherwise only
+    ever replaced by a lookup of the same address. Returns how many
+    were deleted.
+    """
+    from vegancity.models import GeocodeCacheEntry
+
+    expired = GeocodeCacheEntry.objects.expired()
+    count = expired.count()
+    expired.delete()
+    return count
+
+
+def run_batch(batch_size=None, throttle=None):
+    """
+    geocodes up to `batch_size` due jobs, calling `throttle` before
+    each lookup, unless the geocoder's circuit breaker is open. Returns
+    the number of jobs claimed.
+    """
+    from vegancity.models import GeocodeJob
+
+    if batch_size is None:
+        batch_size = settings.GEOCODE_QUEUE_BATCH_SIZE
+
+    # while the geocoder is not being called, every lookup would fail
+    # and use up an attempt.
+    if geocode.breaker.state == geocode.breaker.OPEN:
+        return 0
+
+    jobs = GeocodeJob.objects.claim(batch_size)
+    for job in jobs:
+        if geocode.breaker.state == geocode.breaker.OPEN:
+            # leave the rest to be claimed again when their lease runs
+            # out.
+            break
+        if throttle is not None:
+            throttle()
+        try:
+            result = geocode.lookup(job.address)
+        except geocode.GeocodeError as e:
+            retry(job, str(e))
+        else:
+            save_result(job, result)
+    return len(jobs)
@@ -0,0 +1,241 @@
+"""
+the lists of vendors, neighborhoods and tags shown on the home page.
+
+Each board is computed ahead of time and stored as LeaderboardEntry
+rows, so the home page reads them all in one query. The handlers at
+the end of models.py refresh the boards a change can affect.
+
+The home page also caches the html of each board, keyed on a version
+that refreshing the board bumps.
+"""
+
+import threading
+
+from django.db import connection, transaction
+
+from vegancity import cache_versions, page_cache
+from vegancity.fields import StatusField as SF
+
+# boards are refreshed under this postgres advisory lock, so that two
+# refreshes never interleave their deletes and inserts.
+REFRESH_LOCK_ID = 7215001
+
+BOARDS = {}
+
+# where an entry on each board links to
+URL_FORMATS = {
+    'neighborhoods': "/vendors/?neighborhood=%(id)d",
+    'cuisine_tags': "/vendors/?cuisine_tag=%(id)d",
+    'feature_tags': "/vendors/?feature_tag=%(id)d",
+}
+VENDOR_URL_FORMAT = "/vendors/%(id)d-%(slug)s/"
+
+
+def board(func):
+    BOARDS[func.__name__] = func
+    return func
+
+
+def _approved_vendors():
+    from vegancity.models import Vendor
+    return Vendor.objects.filter(approval_status=SF.APPROVED)
+
+
+def _top(queryset, count_field=None, size=5):
+    fields = ['id', 'name'] + ([count_field] if count_field else [])
+    return [(row[0], row[1], row[2] if count_field else None)
+            for row in queryset.values_list(*fields)[:size]]
+
+
+@board
+def top_rated():
+    return _top(_approved_vendors()
+                .filter(food_rating_count__gt=0,
+                        atmosphere_rating_count__gt=0)
+                .order_by('-average_food_rating',
+                          '-average_atmosphere_rating',
+                          '-approved_review_count', 'name'),
+                'approved_review_count')
+
+
+@board
+def most_reviewed():
+    return _top(_approved_vendors()
+                .filter(approved_review_count__gt=0)
+                .order_by('-approved_review_count', 'name'),
+                'approved_review_count')
+
+
+@board
+def recently_active():
+    return _top(_approved_vendors()
+                .exclude(last_reviewed=None)
+                .order_by('-last_reviewed', 'name'))
+
+
+@board
+def recently_added():
+    return _top(_approved_vendors()
+                .exclude(created=None)
+                .order_by('-created', 'name'))
+
+
+def _with_vendors(model, name_field):
+    return [(pk, name, count) for pk, name, count in
+            model.objects.with_vendors()
+            .order_by('-vendor_count', name_field)
+            .values_list('id', name_field, 'vendor_count')[:21]]
+
+
+@board
+def neighborhoods():
+    from vegancity.models import Neighborhood
+    return _with_vendors(Neighborhood, 'name')
+
+
+@board
+def cuisine_tags():
+    from vegancity.models import CuisineTag
+    return _with_vendors(CuisineTag, 'description')
+
+
+@board
+def feature_tags():
+    from vegancity.models import FeatureTag
+    return _with_vendors(FeatureTag, 'description')
+
+
+# the boards that depend on each kind of change
+REVIEW_BOARDS = ('top_rated', 'most_reviewed', 'recently_active')
+VENDOR_BOARDS = REVIEW_BOARDS + ('recently_added', 'neighborhoods',
+                                 'cuisine_tags', 'feature_tags')
+
+# what each board shows of an approved vendor, or ranks it by, besides
+# its reviews and tags; see Vendor.leaderboard_state.
+VENDOR_BOARD_FIELDS = {
+    'top_rated': ('name',),
+    'most_reviewed': ('name',),
+    'recently_active': ('name',),
+    'recently_added': ('name', 'created'),
+    'neighborhoods': ('neighborhood',),
+    'cuisine_tags': (),
+    'feature_tags': (),
+}
+
+# the boards refreshed inside transactions that have not yet ended.
+_pending = threading.local()
+
+
+def vendor_boards(previous, current):
+    """
+    returns the boards a vendor going from the `previous` to the
+    `current` of its leaderboard states affects. A vendor being
+    approved, unapproved or deleted affects every vendor board.
+    """
+    if previous == current:
+        return ()
+    if previous is None or current is None:
+        return VENDOR_BOARDS
+    return tuple(name for name in VENDOR_BOARDS
+                 if any(previous[field] != current[field]
+                        for field in VENDOR_BOARD_FIELDS[name]))
+
+
+def refresh(names=None):
+    "recomputes the named boards, or all of them, in one transaction."
+    from vegancity.models import LeaderboardEntry
+
+    if names is None:
+        names = sorted(BOARDS)
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [REFRESH_LOCK_ID])
+        for name in names:
+            entries = [LeaderboardEntry(board=name, rank=rank,
+                                        object_id=pk, name=label,
+                                        count=count)
+                       for rank, (pk, label, count)
+                       in enumerate(BOARDS[name]())]
+            LeaderboardEntry.objects.filter(board=name).delete()
+            LeaderboardEntry.objects.bulk_create(entries)
+
+    _invalidate(names)
+    if connection.in_atomic_block:
+        # until the outer transaction commits, a home page rendered
+        # meanwhile reads the old entries and caches them under the new
+        # versions, so the boards are invalidated again once it ends.
+        _pending.names = getattr(_pending, 'names', set()) | set(names)
+
+
+def invalidate_pending():
+    """
+    invalidates the boards refreshed inside a transaction again, once
+    it has ended; inside one, it does nothing. It is called at the end
+    of every request, and outside of requests after each transaction
+    that may refresh boards.
+    """
+    if connection.in_atomic_block:
+        return
+    names = getattr(_pending, 'names', None)
+    if names:
+        del _pending.names
+        _invalidate(sorted(names))
+
+
+def _invalidate(names):
+    cache_versions.bump(*[_version_name(name) for name in names])
+    # the home page is built from the boards.
+    page_cache.purge('home')
+
+
+def _version_name(name):
+    return 'leaderboard:%s' % name
+
+
+def get_versions():
+    "returns a dict of every board's name to its current version."
+    versions = cache_versions.get_versions(
+        [_version_name(name) for name in BOARDS])
+    return dict((name, versions[_version_name(name)]) for name in BOARDS)
+
+
+def get_boards():
+    "returns a dict of every board's name to its entries, in order."
+    from vegancity.models import LeaderboardEntry
+
+    boards = dict((name, []) for name in BOARDS)
+    for entry in LeaderboardEntry.objects.filter(board__in=list(BOARDS)):
+        boards[entry.board].append(entry)
+    return boards
+
+
+def get_lazy_boards():
+    """
+    Like get_boards, but nothing is read until an entry is used, so a
+    page whose boards are all cached needs no query.
+    """
+    loaded = {}
+
+    def load(name):
+        if not loaded:
+            loaded.update(get_boards())
+        return loaded[name]
+
+    return dict((name, LazyEntries(load, name)) for name in BOARDS)
+
+
+class LazyEntries(object):
+
+    def __init__(self, load, name):
+        self._load = load
+        self._name = name
+
+    def __iter__(self):
+        return iter(self._load(self._name))
+
+    def __len__(self):
+        return len(self._load(self._name))
+
+    def __getitem__(self, index):
+        return self._load(self._name)[index]
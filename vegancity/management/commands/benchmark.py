@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vegancity.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    args = '<benchmark benchmark ...>'
+    help = ("Runs benchmarks against the configured database. "
+            "Available: %s" % ", ".join(sorted(BENCHMARKS)))
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', type='int', default=10,
+                    help='How many times each measurement is repeated.'),
+    )
+
+    def handle(self, *names, **options):
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError("Unknown benchmark: %s" % name)
+
+        for name in names or sorted(BENCHMARKS):
+            columns, rows = BENCHMARKS[name](repeat=options['repeat'])
+            self.stdout.write("%s\n" % name)
+            self.write_table(columns, rows)
+
+    def write_table(self, columns, rows):
+        rows = [columns] + [
+            ["%.2fms" % col if isinstance(col, float) else unicode(col)
+             for col in row] for row in rows]
+        widths = [max(len(row[i]) for row in rows)
+                  for i in range(len(columns))]
+        for row in rows:
+            self.stdout.write("  " + "  ".join(
+                col.ljust(width) for col, width in zip(row, widths)))
@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vegancity import geocode_queue
+
+
+class Command(BaseCommand):
+    help = ("Geocodes the vendors queued when they were saved, in "
+            "batches, until stopped. Run it under supervisor alongside "
+            "gunicorn. While idle, it deletes expired geocoder responses "
+            "every GEOCODE_CACHE_PURGE_INTERVAL seconds.")
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', default=False,
+                    help='Stop once no jobs are due, rather than '
+                         'waiting for more.'),
+        make_option('--batch-size', type='int', default=None,
+                    help='How many jobs to claim at a time. '
+                         'Defaults to GEOCODE_QUEUE_BATCH_SIZE.'),
+    )
+
+    def handle(self, *args, **options):
+        throttle = geocode_queue.Throttle(settings.GEOCODE_QUEUE_RATE)
+
+        count = 0
+        purged = None
+        while True:
+            claimed = geocode_queue.run_batch(options['batch_size'],
+                                              throttle)
+            count += claimed
+            if not claimed:
+                if (purged is None or time.time() - purged >=
+                        settings.GEOCODE_CACHE_PURGE_INTERVAL):
+                    geocode_queue.purge_cache()
+                    purged = time.time()
+                if options['once']:
+                    break
+                time.sleep(settings.GEOCODE_QUEUE_POLL_INTERVAL)
+
+        self.stdout.write("Processed %d geocoding jobs." % count)
@@ -0,0 +1,78 @@
+from optparse import make_option
+
+from django.contrib.gis import gdal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from vegancity import geocode
+from vegancity.models import AddressPoint
+
+
+class Command(BaseCommand):
+    args = '<shapefile or geojson>'
+    help = ("Replaces the address points geocode.LocalGeocoder answers "
+            "from with the points of a shapefile or GeoJSON file.")
+    option_list = BaseCommand.option_list + (
+        make_option('--number-field', default='house_number',
+                    help='The feature attribute holding the house number.'),
+        make_option('--street-field', default='street',
+                    help='The feature attribute holding the street, or '
+                         'several, separated by commas, that together '
+                         'make it up, like a direction, name and suffix.'),
+        make_option('--batch-size', type='int', default=1000,
+                    help='How many points to insert at a time.'),
+    )
+
+    def handle(self, path=None, **options):
+        if path is None:
+            raise CommandError("Pass the file to load.")
+        if not gdal.HAS_GDAL:
+            raise CommandError("Reading address points needs GDAL.")
+
+        layer = gdal.DataSource(path)[0]
+        street_fields = options['street_field'].split(',')
+        for field in [options['number_field']] + street_fields:
+            if field not in layer.fields:
+                raise CommandError("No %s field; the fields are %s."
+                                   % (field, ", ".join(layer.fields)))
+
+        count = skipped = 0
+        batch = []
+        with transaction.atomic():
+            AddressPoint.objects.all().delete()
+            for feature in layer:
+                point = self.read(feature, options['number_field'],
+                                  street_fields)
+                if point is None:
+                    skipped += 1
+                    continue
+                batch.append(point)
+                if len(batch) == options['batch_size']:
+                    AddressPoint.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+            AddressPoint.objects.bulk_create(batch)
+            count += len(batch)
+
+        self.stdout.write("Loaded %d address points, and skipped %d "
+                          "without a number, street or point."
+                          % (count, skipped))
+
+    def read(self, feature, number_field, street_fields):
+        "returns an unsaved AddressPoint for `feature`, or None."
+        geometry = feature.geom
+        if geometry.geom_type != 'Point':
+            return None
+        if geometry.srs is not None:
+            geometry.transform(4326)
+
+        number = feature.get(number_field)
+        if isinstance(number, float):
+            number = int(number)
+        street = " ".join(unicode(feature.get(field) or '')
+                          for field in street_fields)
+        number, street = geocode.split_address("%s %s" % (number, street))
+        if number is None or not street:
+            return None
+        return AddressPoint(number=number, street=street,
+                            location=geometry.geos)
@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.contrib.gis import gdal
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from vegancity import leaderboards
+from vegancity.models import Neighborhood, Vendor
+
+
+class Command(BaseCommand):
+    args = '<shapefile or geojson>'
+    help = ("Loads neighborhood boundaries from a shapefile or GeoJSON "
+            "file, creating neighborhoods that don't exist yet, then "
+            "assigns every located vendor to the neighborhood that "
+            "contains it.")
+    option_list = BaseCommand.option_list + (
+        make_option('--name-field', default='name',
+                    help='The feature attribute holding the '
+                         'neighborhood name.'),
+    )
+
+    def handle(self, path=None, **options):
+        if path is None:
+            raise CommandError("Pass the file to load.")
+        if not gdal.HAS_GDAL:
+            raise CommandError("Reading boundaries needs GDAL.")
+
+        boundaries = self.read(path, options['name_field'])
+
+        with transaction.atomic():
+            for name, polygons in sorted(boundaries.items()):
+                neighborhood, _ = Neighborhood.objects.get_or_create(
+                    name=name)
+                neighborhood.boundary = MultiPolygon(polygons, srid=4326)
+                neighborhood.save()
+            changed = Vendor.objects.assign_neighborhoods()
+        leaderboards.invalidate_pending()
+
+        self.stdout.write("Loaded %d neighborhood boundaries, and moved "
+                          "%d vendors." % (len(boundaries), len(changed)))
+
+    def read(self, path, name_field):
+        "returns a dict of each neighborhood name to its polygons."
+        boundaries = {}
+        layer = gdal.DataSource(path)[0]
+        if name_field not in layer.fields:
+            raise CommandError("No %s field; the fields are %s."
+                               % (name_field, ", ".join(layer.fields)))
+
+        for feature in layer:
+            geometry = feature.geom
+            if geometry.srs is not None:
+                geometry.transform(4326)
+            geometry = geometry.geos
+            if isinstance(geometry, Polygon):
+                geometry = [geometry]
+            name = feature.get(name_field).strip()
+            boundaries.setdefault(name, []).extend(geometry)
+        return boundaries
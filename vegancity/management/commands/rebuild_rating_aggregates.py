@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from vegancity import leaderboards
+from vegancity.managers import RATING_AGGREGATE_FIELDS
+from vegancity.models import Vendor
+
+
+class Command(BaseCommand):
+    help = ("Recounts the review and rating aggregates stored on every "
+            "vendor, and reports how many had drifted.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            before = dict(
+                (row[0], dict(zip(RATING_AGGREGATE_FIELDS, row[1:])))
+                for row in Vendor.objects.select_for_update()
+                .values_list('pk', *RATING_AGGREGATE_FIELDS))
+            after = Vendor.objects.update_rating_aggregates()
+        leaderboards.invalidate_pending()
+
+        drifted = [pk for pk, aggregates in after.items()
+                   if before.get(pk) != aggregates]
+        self.stdout.write("Rebuilt rating aggregates for %d vendors, "
+                          "%d had drifted." % (len(after), len(drifted)))
+        if drifted and int(options['verbosity']) > 1:
+            self.stdout.write("Drifted vendors: %s"
+                              % ", ".join(map(str, sorted(drifted))))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from vegancity import leaderboards
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the home page leaderboards. They are kept current "
+            "as vendors and reviews change; this fills them in after a "
+            "migration or an import that bypassed the model signals.")
+
+    def handle(self, *args, **options):
+        leaderboards.refresh()
+        self.stdout.write("Refreshed %d leaderboards."
+                          % len(leaderboards.BOARDS))
@@ -0,0 +1,189 @@
+import json
+import os
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from vegancity import geocode
+from vegancity.models import Neighborhood, Vendor
+
+FILTERS = ('missing_location', 'outside_bounds', 'no_neighborhood')
+
+
+def lookup(address):
+    """
+    geocodes `address` in a pool thread, returning the GeocodeError
+    instead of raising it. The geocoder is always asked, since cached
+    answers are what a run means to replace.
+    """
+    try:
+        return geocode.lookup(address, refresh=True)
+    except geocode.GeocodeError as e:
+        return e
+    finally:
+        # each pool thread has a database connection of its own, which
+        # nothing else would close.
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ("Geocodes vendors again, many at once, and saves their new "
+            "locations a batch at a time. Without filters every vendor "
+            "with an address is geocoded; with them, those that match any "
+            "of them. Progress is kept in a checkpoint file, so a run "
+            "that is stopped carries on where it left off. While the "
+            "geocoder is unavailable or over its quota the run waits, "
+            "longer each time, and gives up after --max-retries waits.")
+    option_list = BaseCommand.option_list + (
+        make_option('--missing-location', action='store_true',
+                    default=False,
+                    help='Vendors with an address but no location.'),
+        make_option('--outside-bounds', action='store_true', default=False,
+                    help='Vendors located outside LOCATION_BOUNDS.'),
+        make_option('--no-neighborhood', action='store_true',
+                    default=False,
+                    help='Vendors without a neighborhood.'),
+        make_option('--threads', type='int', default=4,
+                    help='How many addresses to look up at once.'),
+        make_option('--batch-size', type='int', default=50,
+                    help='How many vendors to save in each update.'),
+        make_option('--checkpoint', default='regeocode.checkpoint',
+                    help='The file progress is kept in.'),
+        make_option('--restart', action='store_true', default=False,
+                    help='Start over, ignoring the checkpoint file.'),
+        make_option('--max-retries', type='int', default=5,
+                    help='How many times in a row to wait for the '
+                    'geocoder before giving up.'),
+        make_option('--retry-delay', type='int',
+                    default=settings.GEOCODE_BREAKER_RESET,
+                    help='Seconds to wait for the geocoder the first '
+                    'time; each wait after that is twice as long.'),
+    )
+
+    def handle(self, *args, **options):
+        filters = [name for name in FILTERS if options[name]]
+        checkpoint = options['checkpoint']
+        last_pk = self.read_checkpoint(checkpoint, filters,
+                                       options['restart'])
+
+        vendors = self.select(filters).order_by('pk')
+        pool = ThreadPool(options['threads'])
+        neighborhood_ids = {}
+        looked_up = failed = retries = 0
+        updated = []
+
+        try:
+            while True:
+                batch = list(vendors.filter(pk__gt=last_pk)
+                             .values_list('pk', 'address')
+                             [:options['batch_size']])
+                if not batch:
+                    break
+
+                results = pool.map(lookup, [address
+                                            for pk, address in batch])
+                # only the vendors before the first one the geocoder
+                # could not answer are done; the rest are looked up
+                # again once it is back.
+                error = None
+                for i, result in enumerate(results):
+                    if isinstance(result, geocode.GeocodeError):
+                        error = result
+                        batch, results = batch[:i], results[:i]
+                        break
+
+                locations = []
+                for (pk, address), result in zip(batch, results):
+                    if not (result[0] and result[1]):
+                        failed += 1
+                        continue
+                    latitude, longitude, name = result
+                    locations.append((pk, address, longitude, latitude,
+                                      self.neighborhood_id(
+                                          name, neighborhood_ids)))
+
+                updated.extend(Vendor.objects.update_locations(locations))
+                if batch:
+                    looked_up += len(batch)
+                    last_pk = batch[-1][0]
+                    self.write_checkpoint(checkpoint, filters, last_pk)
+                    retries = 0
+
+                if error is None:
+                    continue
+                if retries >= options['max_retries']:
+                    raise CommandError(
+                        "Gave up after %d vendors, the geocoder is still "
+                        "failing: %s. Run this again to carry on."
+                        % (looked_up, error))
+                delay = options['retry_delay'] * 2 ** retries
+                retries += 1
+                self.stderr.write("The geocoder failed: %s. Trying again "
+                                  "in %d seconds." % (error, delay))
+                time.sleep(delay)
+        finally:
+            pool.close()
+            pool.join()
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write("Geocoded %d vendors: %d updated, %d failed."
+                          % (looked_up, len(updated), failed))
+
+    def select(self, filters):
+        vendors = Vendor.objects.exclude(address__isnull=True)\
+                                .exclude(address='')
+        if not filters:
+            return vendors
+
+        bounds = Polygon.from_bbox(geocode.location_bounds())
+        bounds.srid = 4326
+        conditions = {
+            'missing_location': Q(location__isnull=True),
+            'outside_bounds': (Q(location__isnull=False)
+                               & ~Q(location__within=bounds)),
+            'no_neighborhood': Q(neighborhood__isnull=True),
+        }
+        return vendors.filter(reduce(lambda a, b: a | b,
+                                     [conditions[name] for name in filters]))
+
+    def neighborhood_id(self, name, neighborhood_ids):
+        """
+        the pk of the neighborhood the geocoder named, which is only
+        used until neighborhoods have boundaries.
+        """
+        if not name:
+            return None
+        if name not in neighborhood_ids:
+            neighborhood, _ = Neighborhood.objects.get_or_create(name=name)
+            neighborhood_ids[name] = neighborhood.pk
+        return neighborhood_ids[name]
+
+    def read_checkpoint(self, path, filters, restart):
+        "returns the pk of the last vendor done, or 0."
+        if restart or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['filters'] != filters:
+            raise CommandError("%s was written for the filters %s. Pass "
+                               "those, or --restart."
+                               % (path, ", ".join(checkpoint['filters'])
+                                  or "none"))
+        return checkpoint['last_pk']
+
+    def write_checkpoint(self, path, filters, last_pk):
+        # renamed into place, so a stopped run never leaves it half
+        # written.
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'filters': filters, 'last_pk': last_pk}, f)
+        os.rename(temp_path, path)
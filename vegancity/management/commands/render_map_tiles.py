@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vegancity import geocode, tiles, vector_tiles
+
+
+class Command(BaseCommand):
+    help = ("Renders the vendor map tiles covering LOCATION_BOUNDS to "
+            "MAP_TILE_DIR, so they are on disk before they are asked for.")
+    option_list = BaseCommand.option_list + (
+        make_option('--max-zoom', type='int', default=None,
+                    help='The deepest zoom to render. '
+                         'Defaults to MAP_TILE_MAX_ZOOM.'),
+    )
+
+    def handle(self, *args, **options):
+        max_zoom = options['max_zoom'] or settings.MAP_TILE_MAX_ZOOM
+        extent = geocode.location_bounds()
+
+        count = 0
+        for zoom in vector_tiles.zooms():
+            if zoom > max_zoom:
+                break
+            for x, y in tiles.tiles_covering(extent, zoom):
+                vector_tiles.write(zoom, x, y,
+                                   vector_tiles.render(zoom, x, y))
+                count += 1
+        self.stdout.write("Rendered %d tiles." % count)
@@ -1,11 +1,21 @@
 import random
+from datetime import timedelta
+from itertools import repeat
 
+from django.conf import settings
 from django.contrib.gis.db import models
-from django.db.models import Count
+from django.contrib.gis.geos import Point
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
 
 from djorm_pgfulltext.models import SearchManagerMixIn, SearchQuerySet
 from django.contrib.gis.db.models.query import GeoQuerySet
+from vegancity import addresses
 from vegancity.fields import StatusField as SF
+from vegancity.signals import (rating_aggregates_changed,
+                               vendor_locations_changed,
+                               vendor_neighborhoods_changed)
 
 
 ##########################################################>
@@ -51,6 +61,25 @@ class SearchByVendorManager(SearchManagerMixIn, models.Manager):
         return self.get_queryset().with_vendors(*args, **kwargs)
 
 
+class NeighborhoodManager(SearchByVendorManager):
+
+    def has_boundaries(self):
+        return self.filter(boundary__isnull=False).exists()
+
+    def containing(self, point):
+        """
+        The neighborhood whose boundary contains `point`, or None. Where
+        boundaries overlap, the smallest one wins.
+        """
+        qn = connections[self.db].ops.quote_name
+        area = "ST_Area(%s.%s)" % (qn(self.model._meta.db_table),
+                                   qn('boundary'))
+        neighborhoods = (self.filter(boundary__contains=point)
+                         .extra(select={'boundary_area': area})
+                         .order_by('boundary_area')[:1])
+        return neighborhoods[0] if neighborhoods else None
+
+
 class ReviewManager(SearchByVendorManager):
     def approved(self):
         return self.get_queryset().filter(approval_status=SF.APPROVED)
@@ -73,11 +102,7 @@ class VendorQuerySet(GeoQuerySet, SearchQuerySet):
         return self.filter(approval_status=SF.APPROVED)
 
     def without_reviews(self):
-        from models import Review
-        review_vendors = (Review
-                          .objects.approved()
-                          .values_list('vendor_id', flat=True))
-        return self.all().exclude(pk__in=review_vendors)
+        return self.filter(approved_review_count=0)
 
     def with_reviews(self):
         return self.filter(review__approval_status=SF.APPROVED)\
@@ -86,16 +111,382 @@ class VendorQuerySet(GeoQuerySet, SearchQuerySet):
                    .order_by('-review_count')
 
     def get_random_unreviewed(self):
-        try:
-            return random.choice(self.without_reviews())
-        except IndexError:
+        """
+        Picks an unreviewed vendor in two index lookups, however many
+        there are: a random id between the lowest and highest
+        unreviewed ids, then the first unreviewed vendor at or after
+        it. Vendors that follow gaps in the ids are picked a little
+        more often.
+        """
+        unreviewed = self.without_reviews().order_by()
+        bounds = unreviewed.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
             return None
 
+        pick = random.randint(bounds['low'], bounds['high'])
+        # wrap around, in case vendors were reviewed in the meantime.
+        for candidates in (unreviewed.filter(pk__gte=pick),
+                           unreviewed):
+            for vendor in candidates.order_by('pk')[:1]:
+                return vendor
+        return None
+
+
+# the weight each source of text gets in a vendor's search_document,
+# from most ('A') to least ('D') important.
+SEARCH_DOCUMENT_WEIGHTS = {
+    'name': 'A',
+    'tags': 'B',
+    'details': 'C',
+    'reviews': 'D',
+}
+
+
+# the columns on Vendor that summarize its approved reviews, kept
+# current by VendorManager.update_rating_aggregates.
+RATING_AGGREGATE_FIELDS = (
+    'approved_review_count',
+    'food_rating_count',
+    'food_rating_total',
+    'average_food_rating',
+    'atmosphere_rating_count',
+    'atmosphere_rating_total',
+    'average_atmosphere_rating',
+    'last_reviewed',
+)
+
+
+def _pk_in_sql(pk, column):
+    """
+    returns a (sql, params) tuple restricting `column` to one key, a
+    list of keys or, when pk is None, nothing. The sql is None when pk
+    is an empty list, because then nothing should be touched.
+    """
+    if pk is None:
+        return "TRUE", []
+    if isinstance(pk, (list, tuple, set, frozenset)):
+        params = list(pk)
+    else:
+        params = [pk]
+    if not params:
+        return None, []
+    return "%s IN (%s)" % (column, ','.join(repeat("%s", len(params)))), params
+
 
 class VendorManager(SearchManagerMixIn, models.GeoManager):
     def get_queryset(self):
         return VendorQuerySet(model=self.model, using=self._db)
 
+    def update_search_document(self, pk=None, using=None):
+        """
+        Rebuild the combined search_document of one vendor, a list of
+        vendors, or every vendor (pk is one key, a list of keys or None).
+
+        The document holds the vendor's own fields, the names and
+        descriptions of its tags and the text of its approved reviews,
+        each weighted according to SEARCH_DOCUMENT_WEIGHTS.
+        """
+        from models import Review
+
+        if using is None:
+            using = self.db
+
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        vendor_table = qn(meta.db_table)
+
+        def vector(text_sql, source):
+            return "setweight(to_tsvector('%s', coalesce(%s, '')), '%s')" % (
+                self.config, text_sql, SEARCH_DOCUMENT_WEIGHTS[source])
+
+        def columns(*names):
+            return " || ' ' || ".join("coalesce(%s.%s, '')"
+                                      % (vendor_table, qn(name))
+                                      for name in names)
+
+        vectors = [vector(columns('name'), 'name'),
+                   vector(columns('notes', 'website', 'address'),
+                          'details')]
+
+        for tag_field in ('cuisine_tags', 'feature_tags'):
+            m2m = meta.get_field(tag_field)
+            tag_table = qn(m2m.rel.to._meta.db_table)
+            through_table = qn(m2m.m2m_db_table())
+            vectors.append(vector(
+                "(SELECT string_agg(replace(%(tag)s.%(name)s, '_', ' ') "
+                "|| ' ' || %(tag)s.%(description)s, ' ') "
+                "FROM %(tag)s INNER JOIN %(through)s "
+                "ON %(tag)s.%(pk)s = %(through)s.%(tag_fk)s "
+                "WHERE %(through)s.%(vendor_fk)s = %(vendor)s.%(pk)s)" % {
+                    'tag': tag_table,
+                    'through': through_table,
+                    'name': qn('name'),
+                    'description': qn('description'),
+                    'pk': qn('id'),
+                    'tag_fk': qn(m2m.m2m_reverse_name()),
+                    'vendor_fk': qn(m2m.m2m_column_name()),
+                    'vendor': vendor_table,
+                }, 'tags'))
+
+        review_table = qn(Review._meta.db_table)
+        vectors.append(vector(
+            "(SELECT string_agg(coalesce(%(review)s.%(title)s, '') "
+            "|| ' ' || %(review)s.%(content)s, ' ') "
+            "FROM %(review)s "
+            "WHERE %(review)s.%(vendor_fk)s = %(vendor)s.%(pk)s "
+            "AND %(review)s.%(status)s = '%(approved)s')" % {
+                'review': review_table,
+                'title': qn('title'),
+                'content': qn('content'),
+                'vendor_fk': qn('vendor_id'),
+                'vendor': vendor_table,
+                'pk': qn('id'),
+                'status': qn('approval_status'),
+                'approved': SF.APPROVED,
+            }, 'reviews'))
+
+        pk_sql, params = _pk_in_sql(pk, "%s.%s" % (vendor_table,
+                                                   qn(meta.pk.column)))
+        if pk_sql is None:
+            return
+
+        sql = "UPDATE %s SET %s = %s WHERE %s" % (
+            vendor_table, qn('search_document'),
+            " || ".join(vectors), pk_sql)
+
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+
+    def update_rating_aggregates(self, pk=None, using=None):
+        """
+        Recount the approved reviews and ratings stored on one vendor,
+        a list of vendors, or every vendor (pk is one key, a list of
+        keys or None), in one statement.
+
+        Returns a dict mapping each updated vendor's pk to a dict of
+        its new RATING_AGGREGATE_FIELDS.
+        """
+        from models import Review
+
+        if using is None:
+            using = self.db
+
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        vendor_table = qn(meta.db_table)
+        review_table = qn(Review._meta.db_table)
+
+        pk_sql, params = _pk_in_sql(pk, "v.%s" % qn(meta.pk.column))
+        if pk_sql is None:
+            return {}
+
+        # ratings of 0 or NULL mean the reviewer didn't give one.
+        aggregates = {
+            'approved_review_count': "count(r.%s)" % qn('id'),
+            'food_rating_count': "count(nullif(r.%s, 0))" % qn('food_rating'),
+            'food_rating_total': "coalesce(sum(r.%s), 0)" % qn('food_rating'),
+            'average_food_rating': "avg(nullif(r.%s, 0))::float8"
+            % qn('food_rating'),
+            'atmosphere_rating_count': "count(nullif(r.%s, 0))"
+            % qn('atmosphere_rating'),
+            'atmosphere_rating_total': "coalesce(sum(r.%s), 0)"
+            % qn('atmosphere_rating'),
+            'average_atmosphere_rating': "avg(nullif(r.%s, 0))::float8"
+            % qn('atmosphere_rating'),
+            'last_reviewed': "max(r.%s)" % qn('created'),
+        }
+
+        sql = (
+            "UPDATE %(vendor)s SET %(assignments)s FROM ("
+            "SELECT v.%(pk)s, %(aggregates)s FROM %(vendor)s v "
+            "LEFT OUTER JOIN %(review)s r ON r.%(vendor_fk)s = v.%(pk)s "
+            "AND r.%(status)s = %%s "
+            "WHERE %(pk_sql)s GROUP BY v.%(pk)s) agg "
+            "WHERE %(vendor)s.%(pk)s = agg.%(pk)s "
+            "RETURNING %(vendor)s.%(pk)s, %(returning)s" % {
+                'vendor': vendor_table,
+                'review': review_table,
+                'pk': qn(meta.pk.column),
+                'vendor_fk': qn('vendor_id'),
+                'status': qn('approval_status'),
+                'pk_sql': pk_sql,
+                'assignments': ", ".join(
+                    "%s = agg.%s" % (qn(name), qn(name))
+                    for name in RATING_AGGREGATE_FIELDS),
+                'aggregates': ", ".join(
+                    "%s AS %s" % (aggregates[name], qn(name))
+                    for name in RATING_AGGREGATE_FIELDS),
+                'returning': ", ".join(
+                    "%s.%s" % (vendor_table, qn(name))
+                    for name in RATING_AGGREGATE_FIELDS),
+            })
+
+        cursor = connection.cursor()
+        cursor.execute(sql, [SF.APPROVED] + params)
+        aggregates = dict(
+            (row[0], dict(zip(RATING_AGGREGATE_FIELDS, row[1:])))
+            for row in cursor.fetchall())
+
+        rating_aggregates_changed.send(sender=self.model,
+                                       vendor_ids=list(aggregates))
+        return aggregates
+
+    def assign_neighborhoods(self, pk=None, using=None):
+        """
+        Set the neighborhood of one vendor, a list of vendors, or every
+        vendor (pk is one key, a list of keys or None) to the one whose
+        boundary contains its location, or to none, in one statement.
+        Vendors without a location are left alone, as is everything
+        until some neighborhood has a boundary.
+
+        Returns a list of the pks of the vendors whose neighborhood
+        changed.
+        """
+        from models import Neighborhood
+
+        if using is None:
+            using = self.db
+
+        if not Neighborhood.objects.db_manager(using).has_boundaries():
+            return []
+
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        vendor_table = qn(meta.db_table)
+
+        pk_sql, params = _pk_in_sql(pk, "v.%s" % qn(meta.pk.column))
+        if pk_sql is None:
+            return []
+
+        # the boundary && location test in ST_Contains is answered by
+        # the boundary's GiST index.
+        sql = (
+            "WITH assignment AS ("
+            "SELECT v.%(pk)s AS vendor_id, "
+            "(SELECT n.%(pk)s FROM %(neighborhood)s n "
+            "WHERE ST_Contains(n.%(boundary)s, v.%(location)s) "
+            "ORDER BY ST_Area(n.%(boundary)s) LIMIT 1) AS neighborhood_id "
+            "FROM %(vendor)s v "
+            "WHERE v.%(location)s IS NOT NULL AND %(pk_sql)s) "
+            "UPDATE %(vendor)s SET %(fk)s = assignment.neighborhood_id "
+            "FROM assignment "
+            "WHERE %(vendor)s.%(pk)s = assignment.vendor_id "
+            "AND %(vendor)s.%(fk)s IS DISTINCT FROM "
+            "assignment.neighborhood_id "
+            "RETURNING %(vendor)s.%(pk)s" % {
+                'vendor': vendor_table,
+                'neighborhood': qn(Neighborhood._meta.db_table),
+                'pk': qn(meta.pk.column),
+                'fk': qn('neighborhood_id'),
+                'boundary': qn('boundary'),
+                'location': qn('location'),
+                'pk_sql': pk_sql,
+            })
+
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        vendor_ids = [row[0] for row in cursor.fetchall()]
+
+        if vendor_ids:
+            vendor_neighborhoods_changed.send(sender=self.model,
+                                              vendor_ids=vendor_ids)
+        return vendor_ids
+
+    def at_address(self, address):
+        """
+        The vendors at `address`, however it and their addresses are
+        written.
+        """
+        key = addresses.normalize(address)
+        if not key:
+            return self.none()
+        return self.filter(address_key=key)
+
+    def update_locations(self, locations, using=None):
+        """
+        Set the locations of many vendors in one statement. `locations`
+        is a list of (pk, address, longitude, latitude, neighborhood pk)
+        tuples, and a vendor is only updated if it still has the address
+        its location was found for, and its location or neighborhood
+        changes. Once neighborhoods have boundaries, a vendor's is the
+        one containing its new location; until then it is the given one,
+        unless that is None.
+
+        Returns a list of the pks of the vendors updated.
+        """
+        from models import Neighborhood
+
+        if not locations:
+            return []
+        if using is None:
+            using = self.db
+
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        names = {
+            'vendor': qn(meta.db_table),
+            'neighborhood': qn(Neighborhood._meta.db_table),
+            'pk': qn(meta.pk.column),
+            'fk': qn('neighborhood_id'),
+            'address': qn('address'),
+            'location': qn('location'),
+            'boundary': qn('boundary'),
+        }
+
+        if Neighborhood.objects.db_manager(using).has_boundaries():
+            names['neighborhood_sql'] = (
+                "(SELECT n.%(pk)s FROM %(neighborhood)s n "
+                "WHERE ST_Contains(n.%(boundary)s, new.point) "
+                "ORDER BY ST_Area(n.%(boundary)s) LIMIT 1)" % names)
+        else:
+            names['neighborhood_sql'] = (
+                "COALESCE(new.neighborhood_id, old.%(fk)s)" % names)
+
+        # the types are spelled out because a column of the VALUES list
+        # that is all NULLs would otherwise be taken for text.
+        names['values'] = ", ".join(repeat(
+            "(%s::integer, %s::text, %s::float8, %s::float8, %s::integer)",
+            len(locations)))
+
+        # old is a second reference to the row being updated, through
+        # which RETURNING sees its location before the update.
+        sql = (
+            "UPDATE %(vendor)s SET %(location)s = new.point, "
+            "%(fk)s = %(neighborhood_sql)s "
+            "FROM (SELECT id, address, neighborhood_id, "
+            "ST_SetSRID(ST_MakePoint(longitude, latitude), 4326) AS point "
+            "FROM (VALUES %(values)s) AS v(id, address, longitude, "
+            "latitude, neighborhood_id)) AS new, "
+            "%(vendor)s old "
+            "WHERE %(vendor)s.%(pk)s = new.id AND old.%(pk)s = new.id "
+            "AND old.%(address)s = new.address "
+            "AND (old.%(location)s IS NULL "
+            "OR NOT ST_Equals(old.%(location)s, new.point) "
+            "OR old.%(fk)s IS DISTINCT FROM %(neighborhood_sql)s) "
+            "RETURNING %(vendor)s.%(pk)s, "
+            "ST_X(old.%(location)s), ST_Y(old.%(location)s), "
+            "ST_X(new.point), ST_Y(new.point)" % names)
+
+        cursor = connection.cursor()
+        cursor.execute(sql, [value for row in locations for value in row])
+
+        vendor_ids, points = [], []
+        for pk, old_x, old_y, new_x, new_y in cursor.fetchall():
+            vendor_ids.append(pk)
+            if old_x is not None:
+                points.append(Point(old_x, old_y, srid=4326))
+            points.append(Point(new_x, new_y, srid=4326))
+
+        if vendor_ids:
+            vendor_locations_changed.send(sender=self.model,
+                                          vendor_ids=vendor_ids,
+                                          points=points)
+        return vendor_ids
+
     # TODO: use a better pass-thru mechanism to avoid
     # repeating these qs methods on the manager
     def search(self, *args, **kwargs):
@@ -106,3 +497,105 @@ class VendorManager(SearchManagerMixIn, models.GeoManager):
 
     def pending_approval(self):
         return self.get_queryset().pending_approval()
+
+
+##########################################################>
+# Managers for geocoding
+##########################################################>
+
+
+class GeocodeCacheManager(models.Manager):
+    def live(self, now=None):
+        "returns the cache entries that have not yet expired."
+        if now is None:
+            now = timezone.now()
+        return self.get_queryset().filter(expires__gt=now)
+
+    def expired(self, now=None):
+        "returns the cache entries that have expired, which purge deletes."
+        if now is None:
+            now = timezone.now()
+        return self.get_queryset().filter(expires__lte=now)
+
+
+class GeocodeJobManager(models.Manager):
+    def enqueue(self, vendor):
+        """
+        queues `vendor` to be geocoded from its current address, replacing
+        any job it already has, so that a vendor is only geocoded once
+        however often it is saved.
+        """
+        values = {
+            'address': vendor.address,
+            'attempts': 0,
+            'next_attempt': timezone.now(),
+            'last_error': '',
+        }
+        if self.filter(vendor=vendor).update(**values):
+            return
+        try:
+            with transaction.atomic():
+                self.create(vendor=vendor, **values)
+        except IntegrityError:
+            # queued by another process in the meantime.
+            self.filter(vendor=vendor).update(**values)
+
+    def due(self, now=None):
+        "returns the jobs waiting to be tried, that haven't been given up."
+        if now is None:
+            now = timezone.now()
+        return self.get_queryset().filter(
+            next_attempt__lte=now,
+            attempts__lt=settings.GEOCODE_QUEUE_MAX_ATTEMPTS)
+
+    def failed(self):
+        return self.get_queryset().filter(
+            attempts__gte=settings.GEOCODE_QUEUE_MAX_ATTEMPTS)
+
+    def claim(self, count):
+        """
+        returns up to `count` due jobs, oldest first, and holds them for
+        GEOCODE_QUEUE_LEASE seconds, so that other workers pass over them
+        until then. A worker that dies leaves its jobs to be claimed again
+        once the lease runs out.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(self.due(now).select_for_update()
+                        .order_by('next_attempt')[:count])
+            lease = timedelta(seconds=settings.GEOCODE_QUEUE_LEASE)
+            self.filter(pk__in=[job.pk for job in jobs]).update(
+                next_attempt=now + lease)
+        return jobs
+
+
+class AddressPointManager(models.GeoManager):
+    def locate(self, number, street):
+        """
+        returns the Point of a house `number` on `street`, or of the
+        middle of the street when number is None, or None if the street
+        isn't known. A number without a point of its own is placed
+        between the nearest numbers either side of it, in proportion,
+        or at the nearest one if it is past the end of the street.
+        """
+        points = self.filter(street=street)
+        if number is None:
+            count = points.count()
+            if not count:
+                return None
+            return points.order_by('number')[count // 2].location
+
+        below = points.filter(number__lte=number).order_by('-number').first()
+        above = points.filter(number__gte=number).order_by('number').first()
+        if below is None or above is None:
+            nearest = below or above
+            return nearest.location if nearest is not None else None
+        if below.number == above.number:
+            return below.location
+
+        fraction = float(number - below.number) / (above.number - below.number)
+        return Point(below.location.x
+                     + fraction * (above.location.x - below.location.x),
+                     below.location.y
+                     + fraction * (above.location.y - below.location.y),
+                     srid=4326)
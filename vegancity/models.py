@@ -2,7 +2,10 @@ from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point
 from django.contrib.auth.models import User
 
-from django.db.models.signals import m2m_changed
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_save, pre_delete,
+                                      post_delete)
 
 
 from django.template.defaultfilters import slugify
@@ -11,11 +14,18 @@ from django.core.exceptions import ValidationError, ObjectDoesNotExist
 import collections
 import logging
 
-from vegancity import geocode, validators
+from vegancity import (addresses, autocomplete, geocode, leaderboards,
+                       page_cache, query_classifier, search_cache,
+                       validators, vector_tiles)
 import email
 from vegancity.managers import (VendorManager, SearchByVendorManager,
-                                ReviewManager)
+                                NeighborhoodManager, ReviewManager,
+                                GeocodeCacheManager, GeocodeJobManager,
+                                AddressPointManager)
 from vegancity.fields import StatusField as SF
+from vegancity.signals import (rating_aggregates_changed,
+                               vendor_locations_changed,
+                               vendor_neighborhoods_changed)
 from vegancity.fields import StatusField
 
 from djorm_pgfulltext.fields import VectorField
@@ -67,7 +77,11 @@ class Neighborhood(models.Model):
     name = models.CharField(max_length=255, unique=True)
     created = models.DateTimeField(auto_now_add=True, null=True)
 
-    objects = SearchByVendorManager()
+    # loaded by the load_neighborhoods command
+    boundary = models.MultiPolygonField(srid=4326, null=True, blank=True,
+                                        editable=False)
+
+    objects = NeighborhoodManager()
 
     def __unicode__(self):
         return self.name
@@ -79,6 +93,112 @@ class Neighborhood(models.Model):
         ordering = ('name',)
 
 
+class GeocodeCacheEntry(models.Model):
+
+    """
+    A stored geocoder response. Entries with no latitude or longitude
+    are negative results, cached so that failed lookups are not
+    repeated until they expire.
+    """
+    key = models.CharField(max_length=40, unique=True)
+    address = models.TextField()
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    neighborhood = models.CharField(max_length=255, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True)
+
+    objects = GeocodeCacheManager()
+
+    def __unicode__(self):
+        return self.address
+
+    def as_result(self):
+        return self.latitude, self.longitude, self.neighborhood
+
+    class Meta:
+        verbose_name = "Geocode Cache Entry"
+        verbose_name_plural = "Geocode Cache Entries"
+        get_latest_by = "created"
+
+
+class AddressPoint(models.Model):
+
+    """
+    One address of a local address point dataset, loaded by the
+    load_address_points command, that geocode.LocalGeocoder answers
+    from. `street` is normalized the way geocode.split_address does it.
+    """
+    # indexed together with number, by migration 0033.
+    number = models.IntegerField()
+    street = models.CharField(max_length=255)
+    location = models.PointField(srid=4326)
+
+    objects = AddressPointManager()
+
+    def __unicode__(self):
+        return "%d %s" % (self.number, self.street)
+
+    class Meta:
+        verbose_name = "Address Point"
+        verbose_name_plural = "Address Points"
+
+
+class GeocodeJob(models.Model):
+
+    """
+    A vendor waiting for its address to be geocoded, by the
+    geocode_vendors command. Saving a vendor queues one rather than
+    geocoding it there and then, so a request never waits on the
+    geocoder. Jobs whose attempts reach GEOCODE_QUEUE_MAX_ATTEMPTS are
+    given up, and left for an admin to look at.
+    """
+    vendor = models.OneToOneField('Vendor', related_name='geocode_job')
+    address = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = GeocodeJobManager()
+
+    def __unicode__(self):
+        return self.address
+
+    class Meta:
+        verbose_name = "Geocode Job"
+        verbose_name_plural = "Geocode Jobs"
+        get_latest_by = "created"
+
+
+class LeaderboardEntry(models.Model):
+
+    """
+    One precomputed line of a home page list, such as the top rated
+    vendors. Maintained by vegancity.leaderboards.
+    """
+    board = models.CharField(max_length=50)
+    rank = models.PositiveIntegerField()
+    object_id = models.IntegerField()
+    name = models.CharField(max_length=255)
+    count = models.IntegerField(null=True, blank=True)
+
+    def __unicode__(self):
+        return "%s #%d: %s" % (self.board, self.rank + 1, self.name)
+
+    def get_absolute_url(self):
+        url_format = leaderboards.URL_FORMATS.get(
+            self.board, leaderboards.VENDOR_URL_FORMAT)
+        return url_format % {'id': self.object_id,
+                             'slug': slugify(self.name)}
+
+    class Meta:
+        ordering = ('board', 'rank')
+        unique_together = (('board', 'rank'),)
+        verbose_name = "Leaderboard Entry"
+        verbose_name_plural = "Leaderboard Entries"
+
+
 ##########################################
 # USER-RELATED MODELS
 ##########################################
@@ -132,6 +252,26 @@ class Review(models.Model):
     def __unicode__(self):
         return "%s -- %s" % (self.vendor.name, str(self.created))
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            vendor_ids = set([self.vendor_id])
+            if self.pk is not None:
+                # a review moved to another vendor leaves the old
+                # vendor's aggregates to fix up, too.
+                vendor_ids.update(Review.objects.filter(pk=self.pk)
+                                  .values_list('vendor_id', flat=True))
+            super(Review, self).save(*args, **kwargs)
+            self.update_vendor_rating_aggregates(vendor_ids)
+
+    def update_vendor_rating_aggregates(self, vendor_ids):
+        aggregates = Vendor.objects.update_rating_aggregates(list(vendor_ids))
+
+        # keep a vendor already loaded on this review current, too.
+        cache_name = Review._meta.get_field('vendor').get_cache_name()
+        vendor = getattr(self, cache_name, None)
+        if vendor is not None and vendor.pk in aggregates:
+            vendor.set_rating_aggregates(aggregates[vendor.pk])
+
     def get_absolute_url(self):
         return "/vendors/%d-%s/" % (self.vendor.id, slugify(self.vendor.name))
 
@@ -157,6 +297,9 @@ class Vendor(models.Model):
                               validators=[validators.validate_website])
     location = models.PointField(srid=4326, default=None,
                                  null=True, blank=True, editable=False)
+    # the canonical form of the address, from addresses.normalize
+    address_key = models.CharField(max_length=255, blank=True, default='',
+                                   db_index=True, editable=False)
 
     # ADMINISTRATIVE FIELDS
     created = models.DateTimeField(auto_now_add=True, null=True)
@@ -166,6 +309,11 @@ class Vendor(models.Model):
 
     search_index = VectorField()
 
+    # the vendor's own text combined with that of its tags and approved
+    # reviews. kept current by the signal handlers at the end of this
+    # module, and GIN indexed.
+    search_document = VectorField()
+
     objects = VendorManager(
         fields=('name', 'notes', 'website', 'address'),
         auto_update_search_field = True
@@ -186,6 +334,19 @@ class Vendor(models.Model):
     cuisine_tags = models.ManyToManyField('CuisineTag', null=True, blank=True)
     feature_tags = models.ManyToManyField('FeatureTag', null=True, blank=True)
 
+    # REVIEW AGGREGATES
+    # totals over approved reviews, kept current by Review.save and the
+    # review delete handler at the end of this module. repair them with
+    # `manage.py rebuild_rating_aggregates`.
+    approved_review_count = models.IntegerField(default=0, editable=False)
+    food_rating_count = models.IntegerField(default=0, editable=False)
+    food_rating_total = models.IntegerField(default=0, editable=False)
+    average_food_rating = models.FloatField(null=True, editable=False)
+    atmosphere_rating_count = models.IntegerField(default=0, editable=False)
+    atmosphere_rating_total = models.IntegerField(default=0, editable=False)
+    average_atmosphere_rating = models.FloatField(null=True, editable=False)
+    last_reviewed = models.DateTimeField(null=True, editable=False)
+
     def needs_geocoding(self, previous_state=None):
         """
         Determine if a vendor needs to be geocoded.
@@ -227,13 +388,19 @@ class Vendor(models.Model):
                 return needs_geocoding
 
     def apply_geocoding(self):
+        self.apply_geocode_result(geocode.geocode_address(self.address))
 
-        geocode_result = geocode.geocode_address(self.address)
+    def apply_geocode_result(self, geocode_result):
         latitude, longitude, neighborhood = geocode_result
 
         if latitude and longitude:
             self.location = Point(x=longitude, y=latitude, srid=4326)
-            if neighborhood:
+            if Neighborhood.objects.has_boundaries():
+                self.neighborhood = Neighborhood.objects.containing(
+                    self.location)
+            elif neighborhood:
+                # until boundaries are loaded, fall back on the name the
+                # geocoder gives.
                 try:
                     neighborhood_obj = Neighborhood.objects.get(
                         name=neighborhood)
@@ -248,15 +415,16 @@ class Vendor(models.Model):
                         "Not geocoding vendor %s!" % (self.address, self.name))
 
     def save(self, *args, **kwargs):
+        self.address_key = addresses.normalize(self.address or '')[:255]
         if self.pk is None:
             self.save_new(*args, **kwargs)
         else:
             self.save_existing(*args, **kwargs)
 
     def save_new(self, *args, **kwargs):
-        if self.address:
-            self.apply_geocoding()
         super(Vendor, self).save(*args, **kwargs)
+        if self.address:
+            GeocodeJob.objects.enqueue(self)
         email.send_new_vendor_alert(self)
 
     def save_existing(self, *args, **kwargs):
@@ -264,11 +432,18 @@ class Vendor(models.Model):
 
         self.validate_pending(previous_state)
 
-        if self.needs_geocoding(previous_state):
-            self.apply_geocoding()
+        needs_geocoding = self.needs_geocoding(previous_state)
+
+        # read by the post_save handlers below.
+        self._was_approved = previous_state.approval_status == SF.APPROVED
+        self._previous_map_state = previous_state.map_state()
+        self._previous_leaderboard_state = previous_state.leaderboard_state()
 
         super(Vendor, self).save(*args, **kwargs)
 
+        if needs_geocoding:
+            GeocodeJob.objects.enqueue(self)
+
         # if the approval_status just changed to SF.APPROVED from
         # SF.PENDING, email the user who submitted the vendor to
         # let them know their submission has succeeded.
@@ -280,6 +455,19 @@ class Vendor(models.Model):
         if should_send_email:
             email.send_new_vendor_approval(self)
 
+    def leaderboard_state(self):
+        "what the leaderboards show of this vendor, if anything."
+        if self.approval_status != SF.APPROVED:
+            return None
+        return {'name': self.name, 'created': self.created,
+                'neighborhood': self.neighborhood_id}
+
+    def map_state(self):
+        "what the vendor map tiles show of this vendor, if anything."
+        if self.approval_status != SF.APPROVED or self.location is None:
+            return None
+        return (self.location.coords, self.veg_level_id)
+
     def validate_pending(self, orig_vendor):
         """
         If the approval_status has just been changed to "StatusField.PENDING"
@@ -296,24 +484,23 @@ class Vendor(models.Model):
             raise ValidationError("Cannot change a vendor back to PENDING!")
 
     def food_rating(self):
-        reviews = Review.objects.approved().filter(vendor=self)
-        food_ratings = [review.food_rating for review in reviews
-                        if review.food_rating]
-        if food_ratings:
-            return sum(food_ratings) / len(food_ratings)
+        "the floored average food rating of the vendor's approved reviews"
+        if self.food_rating_count:
+            return self.food_rating_total / self.food_rating_count
         else:
             return None
 
     def atmosphere_rating(self):
         "calculates the average rating for a vendor"
-        reviews = Review.objects.approved().filter(vendor=self)
-        atmosphere_ratings = [review.atmosphere_rating for review in reviews
-                              if review.atmosphere_rating]
-        if atmosphere_ratings:
-            return sum(atmosphere_ratings) / len(atmosphere_ratings)
+        if self.atmosphere_rating_count:
+            return self.atmosphere_rating_total / self.atmosphere_rating_count
         else:
             return None
 
+    def set_rating_aggregates(self, aggregates):
+        for name, value in aggregates.items():
+            setattr(self, name, value)
+
     def get_absolute_url(self):
         return "/vendors/%d-%s/" % (self.id, slugify(self.name))
 
@@ -363,3 +550,259 @@ class FeatureTag(_TagModel):
     class Meta(_TagModel.Meta):
         verbose_name = "Feature Tag"
         verbose_name_plural = "Feature Tags"
+
+
+#######################################
+# SEARCH DOCUMENT MAINTENANCE
+#######################################
+
+def _update_vendor_search_document(sender, instance, **kwargs):
+    Vendor.objects.update_search_document(instance.pk)
+
+
+def _update_review_vendor_search_document(sender, instance, **kwargs):
+    Vendor.objects.update_search_document(instance.vendor_id)
+
+
+def _remember_tag_vendors(sender, instance, **kwargs):
+    # the link rows are gone by the time post_delete fires, so note
+    # which vendors need updating while they are still there.
+    instance._search_document_vendor_ids = list(
+        instance.vendor_set.values_list('pk', flat=True))
+
+
+def _update_tag_vendor_search_documents(sender, instance, **kwargs):
+    vendor_ids = getattr(instance, '_search_document_vendor_ids', None)
+    if vendor_ids is None:
+        vendor_ids = list(instance.vendor_set.values_list('pk', flat=True))
+    Vendor.objects.update_search_document(vendor_ids)
+
+
+def _update_tagged_vendor_search_documents(sender, instance, action,
+                                           reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        _remember_tag_vendors(sender, instance)
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        vendor_ids = [instance.pk]
+    elif action == 'post_clear':
+        vendor_ids = instance._search_document_vendor_ids
+    else:
+        vendor_ids = pk_set
+
+    Vendor.objects.update_search_document(list(vendor_ids))
+
+
+post_save.connect(_update_vendor_search_document, sender=Vendor)
+post_save.connect(_update_review_vendor_search_document, sender=Review)
+post_delete.connect(_update_review_vendor_search_document, sender=Review)
+
+for _tag_model in (CuisineTag, FeatureTag):
+    post_save.connect(_update_tag_vendor_search_documents, sender=_tag_model)
+    pre_delete.connect(_remember_tag_vendors, sender=_tag_model)
+    post_delete.connect(_update_tag_vendor_search_documents,
+                        sender=_tag_model)
+
+for _through in (Vendor.cuisine_tags.through, Vendor.feature_tags.through):
+    m2m_changed.connect(_update_tagged_vendor_search_documents,
+                        sender=_through)
+
+
+#######################################
+# RATING AGGREGATE MAINTENANCE
+#######################################
+
+def _update_deleted_review_rating_aggregates(sender, instance, **kwargs):
+    # post_delete is sent inside the deletion's transaction. saves are
+    # handled by Review.save, because post_save is not.
+    instance.update_vendor_rating_aggregates([instance.vendor_id])
+
+
+post_delete.connect(_update_deleted_review_rating_aggregates, sender=Review)
+
+
+#######################################
+# AUTOCOMPLETE INDEX AND SEARCH VOCABULARY MAINTENANCE
+#######################################
+
+def _invalidate_name_indexes(sender, **kwargs):
+    autocomplete.index.invalidate()
+    query_classifier.vocabulary.invalidate()
+
+
+for _model in (Vendor, CuisineTag, FeatureTag, Neighborhood):
+    post_save.connect(_invalidate_name_indexes, sender=_model)
+    post_delete.connect(_invalidate_name_indexes, sender=_model)
+
+
+#######################################
+# SEARCH CACHE INVALIDATION
+#######################################
+
+def _bump_search_cache_generation(sender, **kwargs):
+    search_cache.bump_generation()
+
+
+def _bump_search_cache_generation_on_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        search_cache.bump_generation()
+
+
+for _model in (Vendor, Review, CuisineTag, FeatureTag, Neighborhood):
+    post_save.connect(_bump_search_cache_generation, sender=_model)
+    post_delete.connect(_bump_search_cache_generation, sender=_model)
+
+for _through in (Vendor.cuisine_tags.through, Vendor.feature_tags.through):
+    m2m_changed.connect(_bump_search_cache_generation_on_m2m,
+                        sender=_through)
+
+vendor_neighborhoods_changed.connect(_bump_search_cache_generation,
+                                     sender=Vendor)
+vendor_locations_changed.connect(_bump_search_cache_generation,
+                                 sender=Vendor)
+
+
+#######################################
+# LEADERBOARD MAINTENANCE
+#######################################
+
+def _refresh_review_leaderboards(sender, **kwargs):
+    leaderboards.refresh(leaderboards.REVIEW_BOARDS)
+
+
+def _refresh_saved_vendor_leaderboards(sender, instance, **kwargs):
+    boards = leaderboards.vendor_boards(
+        getattr(instance, '_previous_leaderboard_state', None),
+        instance.leaderboard_state())
+    if boards:
+        leaderboards.refresh(boards)
+
+
+def _refresh_deleted_vendor_leaderboards(sender, instance, **kwargs):
+    boards = leaderboards.vendor_boards(instance.leaderboard_state(), None)
+    if boards:
+        leaderboards.refresh(boards)
+
+
+def _invalidate_pending_leaderboards(sender, **kwargs):
+    leaderboards.invalidate_pending()
+
+
+def _leaderboard_refresher(name):
+    def refresh(sender, action=None, **kwargs):
+        if action in (None, 'post_add', 'post_remove', 'post_clear'):
+            leaderboards.refresh([name])
+    return refresh
+
+
+rating_aggregates_changed.connect(_refresh_review_leaderboards,
+                                  sender=Vendor)
+post_save.connect(_refresh_saved_vendor_leaderboards, sender=Vendor)
+post_delete.connect(_refresh_deleted_vendor_leaderboards, sender=Vendor)
+# sent once the response is done, after any transaction of the view.
+request_finished.connect(_invalidate_pending_leaderboards)
+
+for _model, _board in ((Neighborhood, 'neighborhoods'),
+                       (CuisineTag, 'cuisine_tags'),
+                       (FeatureTag, 'feature_tags')):
+    _refresher = _leaderboard_refresher(_board)
+    # receivers are weakly referenced by default, and nothing else
+    # holds on to these.
+    post_save.connect(_refresher, sender=_model, weak=False)
+    post_delete.connect(_refresher, sender=_model, weak=False)
+
+vendor_neighborhoods_changed.connect(_leaderboard_refresher('neighborhoods'),
+                                     sender=Vendor, weak=False)
+vendor_locations_changed.connect(_leaderboard_refresher('neighborhoods'),
+                                 sender=Vendor, weak=False)
+m2m_changed.connect(_leaderboard_refresher('cuisine_tags'),
+                    sender=Vendor.cuisine_tags.through, weak=False)
+m2m_changed.connect(_leaderboard_refresher('feature_tags'),
+                    sender=Vendor.feature_tags.through, weak=False)
+
+
+#######################################
+# PAGE CACHE PURGING
+#######################################
+
+def _purge_saved_vendor_pages(sender, instance, **kwargs):
+    tags = [page_cache.vendor_tag(instance.pk)]
+    # a vendor being approved or unapproved joins or leaves listings
+    # that are not tagged with it.
+    is_approved = instance.approval_status == SF.APPROVED
+    if is_approved != getattr(instance, '_was_approved', False):
+        tags.append('listings')
+    page_cache.purge(*tags)
+
+
+def _purge_deleted_vendor_pages(sender, instance, **kwargs):
+    page_cache.purge(page_cache.vendor_tag(instance.pk), 'listings')
+
+
+def _purge_reviewed_vendor_pages(sender, vendor_ids, **kwargs):
+    page_cache.purge(*[page_cache.vendor_tag(pk) for pk in vendor_ids])
+
+
+def _purge_reassigned_vendor_pages(sender, vendor_ids, **kwargs):
+    # listings filtered by neighborhood gain or lose these vendors.
+    page_cache.purge('listings',
+                     *[page_cache.vendor_tag(pk) for pk in vendor_ids])
+
+
+def _purge_tagged_vendor_pages(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        vendor_ids = [instance.pk]
+    elif action == 'post_clear':
+        # noted by the search document handler on pre_clear.
+        vendor_ids = instance._search_document_vendor_ids
+    else:
+        vendor_ids = pk_set
+    page_cache.purge(*[page_cache.vendor_tag(pk) for pk in vendor_ids])
+
+
+post_save.connect(_purge_saved_vendor_pages, sender=Vendor)
+post_delete.connect(_purge_deleted_vendor_pages, sender=Vendor)
+rating_aggregates_changed.connect(_purge_reviewed_vendor_pages,
+                                  sender=Vendor)
+
+vendor_neighborhoods_changed.connect(_purge_reassigned_vendor_pages,
+                                     sender=Vendor)
+vendor_locations_changed.connect(_purge_reassigned_vendor_pages,
+                                 sender=Vendor)
+
+for _through in (Vendor.cuisine_tags.through, Vendor.feature_tags.through):
+    m2m_changed.connect(_purge_tagged_vendor_pages, sender=_through)
+
+
+#######################################
+# MAP TILE INVALIDATION
+#######################################
+
+def _invalidate_saved_vendor_tiles(sender, instance, **kwargs):
+    before = getattr(instance, '_previous_map_state', None)
+    after = instance.map_state()
+    if before != after:
+        vector_tiles.invalidate([Point(*state[0]) for state in (before, after)
+                                 if state is not None])
+
+
+def _invalidate_deleted_vendor_tiles(sender, instance, **kwargs):
+    if instance.location is not None:
+        vector_tiles.invalidate([instance.location])
+
+
+def _invalidate_moved_vendor_tiles(sender, points, **kwargs):
+    vector_tiles.invalidate(points)
+
+
+post_save.connect(_invalidate_saved_vendor_tiles, sender=Vendor)
+post_delete.connect(_invalidate_deleted_vendor_tiles, sender=Vendor)
+vendor_locations_changed.connect(_invalidate_moved_vendor_tiles,
+                                 sender=Vendor)
@@ -0,0 +1,115 @@
+"""
+caches whole pages for anonymous visitors.
+
+A page is cached under its full path, query string included, and the
+view can tag it with what it shows. Each tag has a version, see
+cache_versions, and a page is stored with the versions its tags had
+when it was built. When something changes, purge() bumps the versions
+of its tags, and the cached pages that carry one of them, and only
+those, are no longer served:
+
+  - 'vendor:<id>' for the detail page of a vendor and the listings it
+    appears on,
+  - 'listings' for every /vendors/ listing, for changes that can add
+    or remove a vendor from one,
+  - 'home' for the home page.
+
+Pages are also dropped after PAGE_CACHE_TTL seconds, which bounds how
+long anything the tags miss can stay stale.
+"""
+
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from vegancity import cache_versions
+
+PAGE_KEY_FORMAT = 'vegancity:versioned-page:%s'
+TAG_VERSION_FORMAT = 'page-tag:%s'
+
+
+def vendor_tag(vendor_id):
+    return 'vendor:%d' % vendor_id
+
+
+def page_key(path):
+    return PAGE_KEY_FORMAT % hashlib.sha1(path).hexdigest()
+
+
+def _tag_versions(tags):
+    return cache_versions.get_versions([TAG_VERSION_FORMAT % t
+                                        for t in tags])
+
+
+def tag(request, *tags):
+    """
+    notes that the page being built for `request` shows `tags`. Their
+    versions are read now, so that a purge while the page is still
+    being built keeps it from being served.
+    """
+    versions = getattr(request, '_page_cache_versions', {})
+    versions.update(_tag_versions(tags))
+    request._page_cache_versions = versions
+
+
+def is_cacheable(request):
+    # no session cookie means no login, no messages and nothing else
+    # that makes the page differ between visitors.
+    return (settings.PAGE_CACHE_ENABLED and
+            request.method in ('GET', 'HEAD') and
+            settings.SESSION_COOKIE_NAME not in request.COOKIES and
+            'messages' not in request.COOKIES and
+            not request.user.is_authenticated())
+
+
+def _store(key, response, versions):
+    cache.set(key, (response.status_code, response['Content-Type'],
+                    response.content, versions), settings.PAGE_CACHE_TTL)
+
+
+def _is_current(versions):
+    "whether none of the tags of a page have been purged since it was built."
+    return (not versions or
+            cache_versions.get_versions(list(versions)) == versions)
+
+
+def purge(*tags):
+    "stops serving every cached page tagged with any of `tags`."
+    cache_versions.bump(*[TAG_VERSION_FORMAT % t for t in tags])
+
+
+def cache_anonymous(view):
+    """
+    serves the response of `view` from the cache to visitors without
+    a session, and caches successful responses for them.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view(request, *args, **kwargs)
+
+        key = page_key(request.get_full_path())
+        cached = cache.get(key)
+        if cached is not None and _is_current(cached[3]):
+            status_code, content_type, content, versions = cached
+            response = HttpResponse(content, content_type=content_type,
+                                    status=status_code)
+            response['X-Page-Cache'] = 'hit'
+            return response
+
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+
+        # a response that sets a cookie, like a csrf token, belongs to
+        # one visitor only.
+        if response.status_code == 200 and not response.cookies:
+            _store(key, response,
+                   getattr(request, '_page_cache_versions', {}))
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    return wrapper
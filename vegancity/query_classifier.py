@@ -0,0 +1,135 @@
+""" decides whether a search query is worth sending to the geocoder """
+
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from vegancity.fields import StatusField as SF
+
+# anything that looks like a house number, zip code, numbered street
+# or street suffix is almost certainly an address.
+STREET_PATTERNS = (
+    re.compile(r'^\d+[a-z]?\s+\w'),
+    re.compile(r'\b\d{5}(-\d{4})?\b'),
+    re.compile(r'\b\d+(st|nd|rd|th)\b'),
+)
+
+STREET_SUFFIXES = frozenset([
+    'aly', 'alley', 'ave', 'av', 'avenue', 'blvd', 'boulevard', 'ct',
+    'dr', 'drive', 'hwy', 'highway', 'ln', 'lane', 'pike', 'pk', 'pkwy',
+    'parkway', 'pl', 'rd', 'road', 'sq', 'square', 'st', 'street', 'ter',
+    'terrace', 'way',
+])
+
+# words people search with that never help locate an address
+NON_ADDRESS_WORDS = frozenset([
+    'a', 'an', 'and', 'the', 'of', 'for', 'with', 'in', 'near', 'best',
+    'cheap', 'good', 'food', 'foods', 'restaurant', 'restaurants', 'place',
+    'places', 'vegan', 'vegans', 'vegetarian', 'veg', 'veggie', 'options',
+    'friendly', 'free', 'eat', 'eats', 'breakfast', 'brunch', 'lunch',
+    'dinner', 'dessert', 'desserts', 'takeout', 'delivery',
+])
+
+WORD_RE = re.compile(r"[\w']+", re.UNICODE)
+
+
+def normalize(text):
+    return " ".join(WORD_RE.findall(text.lower()))
+
+
+def looks_like_address(text):
+    "whether `text`, already normalized, looks like a street address."
+    return (any(pattern.search(text) for pattern in STREET_PATTERNS) or
+            any(word in STREET_SUFFIXES for word in text.split()))
+
+
+class Vocabulary(object):
+    """
+    The names this site knows about, gathered from the database and
+    kept in memory for SEARCH_VOCABULARY_TTL seconds, or until a vendor,
+    tag or neighborhood saved in this process invalidates them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = 0
+        self.vendor_names = self.tag_names = frozenset()
+        self.neighborhood_names = self.words = frozenset()
+
+    def refresh(self):
+        with self._lock:
+            if self._expires > time.time():
+                return self
+            self._load()
+            self._expires = time.time() + settings.SEARCH_VOCABULARY_TTL
+        return self
+
+    def invalidate(self):
+        self._expires = 0
+
+    def _load(self):
+        from vegancity.models import (Vendor, Neighborhood,
+                                      CuisineTag, FeatureTag)
+
+        vendor_names = set(
+            normalize(name) for name in
+            Vendor.objects.filter(approval_status=SF.APPROVED)
+            .values_list('name', flat=True))
+
+        tag_names = set()
+        for model in (CuisineTag, FeatureTag):
+            for name, description in model.objects.values_list(
+                    'name', 'description'):
+                tag_names.add(normalize(name.replace('_', ' ')))
+                tag_names.add(normalize(description))
+
+        self.neighborhood_names = frozenset(
+            normalize(name) for name in
+            Neighborhood.objects.values_list('name', flat=True))
+        self.vendor_names = frozenset(vendor_names)
+        self.tag_names = frozenset(tag_names)
+        self.words = frozenset(word
+                               for name in vendor_names | tag_names
+                               for word in name.split())
+
+
+vocabulary = Vocabulary()
+
+
+def classify(query):
+    """
+    takes a search query and returns a tuple of (should_geocode, reason).
+
+    Queries that look like streets or name a neighborhood are geocoded.
+    Queries that are exactly a vendor or tag name, or that are made up
+    only of words from those names, are not. Anything else is geocoded,
+    because an unknown word may well be a place.
+    """
+    text = normalize(query)
+    if not text:
+        return False, 'empty'
+
+    words = text.split()
+
+    if looks_like_address(text):
+        return True, 'street_pattern'
+
+    vocab = vocabulary.refresh()
+
+    if text in vocab.vendor_names:
+        return False, 'vendor_name'
+
+    if text in vocab.tag_names:
+        return False, 'tag_name'
+
+    padded = " %s " % text
+    if any(" %s " % name in padded for name in vocab.neighborhood_names):
+        return True, 'neighborhood'
+
+    if all(word in vocab.words or word in NON_ADDRESS_WORDS
+           for word in words):
+        return False, 'known_words'
+
+    return True, 'unclassified'
@@ -2,35 +2,624 @@
 
 import geocode
 
-from vegancity.models import FeatureTag, CuisineTag, Vendor, Review
+from vegancity import query_classifier, search_cache
+from vegancity.models import (FeatureTag, CuisineTag, Vendor, Review,
+                              Neighborhood)
+from vegancity.fields import StatusField as SF
 
-from django.contrib.gis.geos import Point
+from django.conf import settings
+from django.contrib.gis.geos import Point, Polygon
+from django.db import connection
 
+# how close, in degrees, a vendor has to be to a geocoded query
+ADDRESS_SEARCH_DISTANCE = .004
 
-def master_search(query, initial_queryset=None):
 
-    master_results = (address_search(query) |
+def master_search(query, initial_queryset=None, stats=None):
+    """
+    Search approved vendors by name, tags, reviews and, when the query
+    could plausibly be one, by address.
+
+    If a `stats` dict is passed in, it is filled with the geocoding
+    decision, the estimated time saved by skipping it and the state of
+    the geocoder's circuit breaker, for logging.
+    """
+
+    should_geocode, reason = query_classifier.classify(query)
+
+    if should_geocode:
+        point = geocode_query(query)
+        time_saved = 0
+    else:
+        point = None
+        time_saved = geocode.timer.average
+
+    if stats is not None:
+        stats['address_lookup'] = "%s:%s" % (
+            'geocoded' if should_geocode else 'skipped', reason)
+        stats['geocode_time_saved'] = time_saved
+        stats['geocoder_breaker'] = geocode.breaker.state
+
+    engine = SEARCH_ENGINES[settings.SEARCH_ENGINE]
+    return engine(query, point, initial_queryset)
+
+
+def union_search(query, point, initial_queryset=None):
+    """
+    The original search engine. Runs each sub-search as its own
+    queryset and ORs them together.
+    """
+
+    if point is None:
+        address_results = Vendor.objects.none()
+    else:
+        address_results = Vendor.objects.approved().filter(
+            location__dwithin=(point, ADDRESS_SEARCH_DISTANCE))
+
+    master_results = (address_results |
                       Vendor.objects.approved().search(query) |
                       FeatureTag.objects.vendor_search(query) |
                       CuisineTag.objects.vendor_search(query) |
                       Review.objects.approved().vendor_search(query))
 
-    if initial_queryset:
+    if initial_queryset is not None:
         master_results = master_results & initial_queryset
 
     return master_results
 
 
-def address_search(query):
+def single_statement_search(query, point, initial_queryset=None):
+    """
+    Compiles every sub-search into EXISTS subqueries ORed together in
+    the WHERE clause of one statement, so that a search costs a single
+    round trip and any filters on `initial_queryset` still apply.
+    """
+
+    if initial_queryset is None:
+        initial_queryset = Vendor.objects.all()
+
+    where, params = vendor_match_sql(query, point)
+    return (initial_queryset
+            .filter(approval_status=SF.APPROVED)
+            .extra(where=[where], params=params))
+
+
+def vendor_match_sql(query, point=None):
+    """
+    returns a (sql, params) tuple for a WHERE clause that matches a
+    vendor row against the full text of the vendor, its tags and its
+    approved reviews, or against its distance from `point`.
+    """
+    qn = connection.ops.quote_name
+    config = Vendor._fts_manager.config
+    vendor_table = qn(Vendor._meta.db_table)
+    ts_query = "plainto_tsquery('%s', %%s)" % config
+
+    def vector_match(table, field='search_index'):
+        return "%s.%s @@ %s" % (table, qn(field), ts_query)
+
+    clauses = [vector_match(vendor_table)]
+    params = [query]
+
+    # subquery tables are aliased so they cannot be confused with
+    # joins the initial queryset may already have made to them.
+    for tag_field in ('feature_tags', 'cuisine_tags'):
+        m2m = Vendor._meta.get_field(tag_field)
+        through_alias = qn('search_%s_link' % tag_field)
+        tag_alias = qn('search_%s' % tag_field)
+        clauses.append(
+            "EXISTS (SELECT 1 FROM %(through)s %(through_alias)s "
+            "INNER JOIN %(tag)s %(tag_alias)s "
+            "ON %(tag_alias)s.%(pk)s = %(through_alias)s.%(tag_fk)s "
+            "WHERE %(through_alias)s.%(vendor_fk)s = %(vendor)s.%(pk)s "
+            "AND %(match)s)" % {
+                'through': qn(m2m.m2m_db_table()),
+                'through_alias': through_alias,
+                'tag': qn(m2m.rel.to._meta.db_table),
+                'tag_alias': tag_alias,
+                'tag_fk': qn(m2m.m2m_reverse_name()),
+                'vendor_fk': qn(m2m.m2m_column_name()),
+                'vendor': vendor_table,
+                'pk': qn('id'),
+                'match': vector_match(tag_alias),
+            })
+        params.append(query)
+
+    review_alias = qn('search_reviews')
+    clauses.append(
+        "EXISTS (SELECT 1 FROM %(review)s %(review_alias)s "
+        "WHERE %(review_alias)s.%(vendor_fk)s = %(vendor)s.%(pk)s "
+        "AND %(review_alias)s.%(status)s = %%s "
+        "AND %(match)s)" % {
+            'review': qn(Review._meta.db_table),
+            'review_alias': review_alias,
+            'vendor': vendor_table,
+            'vendor_fk': qn('vendor_id'),
+            'pk': qn('id'),
+            'status': qn('approval_status'),
+            'match': vector_match(review_alias),
+        })
+    params.extend([SF.APPROVED, query])
+
+    if point is not None:
+        clauses.append(distance_clause())
+        params.extend([point.ewkt, ADDRESS_SEARCH_DISTANCE])
+
+    return "(%s)" % " OR ".join(clauses), params
+
+
+def document_search(query, point, initial_queryset=None):
+    """
+    Matches against each vendor's combined search_document, so that
+    the text part of a search is a single GIN index scan.
+
+    Results are ranked: each vendor gets a `search_score`, its ts_rank
+    against the weighted document plus a bonus for being close to
+    `point`, and the queryset is ordered by it.
+
+    When SEARCH_TRIGRAM_ENABLED is set and nothing matches the query
+    exactly, vendors are matched fuzzily instead, and the similarity of
+    their names is added to their score. A query with no words, or
+    only stop words, matches nothing either way.
+    """
+
+    if initial_queryset is None:
+        initial_queryset = Vendor.objects.all()
+
+    # it would match every vendor fuzzily.
+    if not query_classifier.normalize(query):
+        return initial_queryset.none()
+
+    qn = connection.ops.quote_name
+    where, params = document_match_sql(query, point)
+    score, score_params = document_score_sql(query, point)
+
+    if settings.SEARCH_TRIGRAM_ENABLED:
+        # fuzzy matches are only wanted when the query has no exact
+        # ones, e.g. when it is a partial or misspelled word, and not
+        # when it has none because it is all stop words. The checks
+        # are uncorrelated, so postgres runs them once per statement.
+        trigram_where, trigram_params = trigram_match_sql(query)
+        where = ("(%s OR (%s AND numnode(plainto_tsquery('%s', %%s)) > 0 "
+                 "AND NOT EXISTS (SELECT 1 FROM %s %s "
+                 "WHERE %s.%s = %%s AND %s)))" % (
+                     where, trigram_where, Vendor._fts_manager.config,
+                     qn(Vendor._meta.db_table), qn('exact_match'),
+                     qn('exact_match'), qn('approval_status'),
+                     document_clause(qn('exact_match'))))
+        params = params + trigram_params + [query, SF.APPROVED, query]
+        trigram_score, trigram_score_params = trigram_score_sql(query)
+        score = "(%s + %s)" % (score, trigram_score)
+        score_params = score_params + trigram_score_params
+
+    return (initial_queryset
+            .filter(approval_status=SF.APPROVED)
+            .extra(select={'search_score': score},
+                   select_params=score_params,
+                   where=[where], params=params,
+                   order_by=['-search_score', 'id']))
+
+
+def document_match_sql(query, point=None):
+    """
+    returns a (sql, params) tuple for a WHERE clause that matches a
+    vendor's search_document, or its distance from `point`.
+    """
+    clauses = [document_clause()]
+    params = [query]
+
+    if point is not None:
+        clauses.append(distance_clause())
+        params.extend([point.ewkt, ADDRESS_SEARCH_DISTANCE])
+
+    return "(%s)" % " OR ".join(clauses), params
+
+
+def document_score_sql(query, point=None):
+    """
+    returns a (sql, params) tuple for a vendor's search score. The text
+    rank is normalized into [0, 1), and vendors within
+    ADDRESS_SEARCH_DISTANCE of `point` get up to 1 more the closer
+    they are.
+    """
+    qn = connection.ops.quote_name
+    rank = "ts_rank(%s.%s, plainto_tsquery('%s', %%s), 32)" % (
+        qn(Vendor._meta.db_table), qn('search_document'),
+        Vendor._fts_manager.config)
+    params = [query]
+
+    if point is None:
+        return rank, params
+
+    proximity = ("CASE WHEN %(within)s "
+                 "THEN 1 - ST_Distance(%(location)s, "
+                 "ST_GeomFromEWKT(%%s)) / %%s "
+                 "ELSE 0 END" % {
+                     'within': distance_clause(),
+                     'location': "%s.%s" % (qn(Vendor._meta.db_table),
+                                            qn('location')),
+                 })
+    params.extend([point.ewkt, ADDRESS_SEARCH_DISTANCE,
+                   point.ewkt, ADDRESS_SEARCH_DISTANCE])
+
+    return "(%s + %s)" % (rank, proximity), params
+
+
+def trigram_match_sql(query):
+    """
+    returns a (sql, params) tuple for a WHERE clause that fuzzily
+    matches `query` against a vendor's name, its neighborhood's name or
+    the descriptions of its tags, so that partial words like "hibis"
+    still find "Hibiscus". All of these columns have pg_trgm indexes.
+
+    A column matches if its trigram similarity to the query is at least
+    SEARCH_TRIGRAM_THRESHOLD, or if it contains the query.
+    """
+    qn = connection.ops.quote_name
+    vendor_table = qn(Vendor._meta.db_table)
+    threshold = settings.SEARCH_TRIGRAM_THRESHOLD
+    pattern = "%%%s%%" % escape_like(query)
+
+    def fuzzy(column):
+        # `%` is pg_trgm's indexable similarity operator; it is limited
+        # by pg_trgm's own threshold, 0.3 by default, so it is paired
+        # with an explicit check against ours.
+        return ("((%(col)s %%%% %%s AND similarity(%(col)s, %%s) >= %%s) "
+                "OR %(col)s ILIKE %%s)" % {'col': column})
+
+    def fuzzy_params():
+        return [query, query, threshold, pattern]
+
+    neighborhood_table = qn(Neighborhood._meta.db_table)
+    clauses = [
+        fuzzy("%s.%s" % (vendor_table, qn('name'))),
+        "%s.%s IN (SELECT %s FROM %s WHERE %s)" % (
+            vendor_table, qn('neighborhood_id'), qn('id'),
+            neighborhood_table,
+            fuzzy("%s.%s" % (neighborhood_table, qn('name')))),
+    ]
+    params = fuzzy_params() + fuzzy_params()
+
+    for tag_field in ('feature_tags', 'cuisine_tags'):
+        m2m = Vendor._meta.get_field(tag_field)
+        through_alias = qn('trigram_%s_link' % tag_field)
+        tag_alias = qn('trigram_%s' % tag_field)
+        clauses.append(
+            "EXISTS (SELECT 1 FROM %(through)s %(through_alias)s "
+            "INNER JOIN %(tag)s %(tag_alias)s "
+            "ON %(tag_alias)s.%(pk)s = %(through_alias)s.%(tag_fk)s "
+            "WHERE %(through_alias)s.%(vendor_fk)s = %(vendor)s.%(pk)s "
+            "AND %(match)s)" % {
+                'through': qn(m2m.m2m_db_table()),
+                'through_alias': through_alias,
+                'tag': qn(m2m.rel.to._meta.db_table),
+                'tag_alias': tag_alias,
+                'tag_fk': qn(m2m.m2m_reverse_name()),
+                'vendor_fk': qn(m2m.m2m_column_name()),
+                'vendor': vendor_table,
+                'pk': qn('id'),
+                'match': fuzzy("%s.%s" % (tag_alias, qn('description'))),
+            })
+        params.extend(fuzzy_params())
+
+    return "(%s)" % " OR ".join(clauses), params
+
+
+def trigram_score_sql(query):
+    "returns a (sql, params) tuple for how closely a vendor's name matches."
+    qn = connection.ops.quote_name
+    return "similarity(%s.%s, %%s)" % (qn(Vendor._meta.db_table),
+                                       qn('name')), [query]
+
+
+def escape_like(text):
+    return (text.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def document_clause(table=None):
+    qn = connection.ops.quote_name
+    if table is None:
+        table = qn(Vendor._meta.db_table)
+    return "%s.%s @@ plainto_tsquery('%s', %%s)" % (
+        table, qn('search_document'), Vendor._fts_manager.config)
+
+
+def distance_clause():
+    qn = connection.ops.quote_name
+    return "ST_DWithin(%s.%s, ST_GeomFromEWKT(%%s), %%s)" % (
+        qn(Vendor._meta.db_table), qn('location'))
+
+
+def paginate(vendors, after=None, page_size=None):
+    """
+    Keyset pagination over vendors. Ranked search results are paged
+    by descending `search_score`, everything else by name, with the
+    vendor id breaking ties.
+
+    `after` is the id of the last vendor on the previous page, so a
+    page never has to skip over the ones before it. Returns a tuple
+    of the page, as a list, and the `after` value for the next page,
+    which is None on the last page.
+    """
+    if page_size is None:
+        page_size = settings.SEARCH_PAGE_SIZE
+
+    qn = connection.ops.quote_name
+    vendor_table = qn(Vendor._meta.db_table)
+    vendor_id = "%s.%s" % (vendor_table, qn('id'))
+
+    if 'search_score' in vendors.query.extra_select:
+        score, score_params = vendors.query.extra_select['search_score']
+        keys = ["-(%s)" % score, vendor_id]
+        key_params = list(score_params)
+    else:
+        vendors = vendors.order_by('name', 'id')
+        keys = ["%s.%s" % (vendor_table, qn('name')), vendor_id]
+        key_params = []
+
+    if after is not None:
+        # compare against the keys of the `after` vendor, computed by a
+        # subquery, so the cursor only ever has to carry an id.
+        keys_sql = ", ".join(keys)
+        where = "(%s) > (SELECT %s FROM %s WHERE %s = %%s)" % (
+            keys_sql, keys_sql, vendor_table, vendor_id)
+        vendors = vendors.extra(where=[where],
+                                params=key_params + key_params + [after])
+
+    page = list(vendors[:page_size + 1])
+    if len(page) > page_size:
+        return page[:page_size], page[page_size - 1].pk
+    return page, None
+
+
+def paginate_ids(vendor_ids, after=None, page_size=None):
+    """
+    Like paginate, but over an already ordered list of vendor ids, such
+    as a cached search result. Returns a tuple of the ids on the page
+    and the `after` value for the next page.
+    """
+    if page_size is None:
+        page_size = settings.SEARCH_PAGE_SIZE
+
+    start = 0
+    if after is not None:
+        try:
+            start = vendor_ids.index(after) + 1
+        except ValueError:
+            # the vendor has since left the results; so has the page.
+            return [], None
+
+    page = vendor_ids[start:start + page_size]
+    if start + page_size < len(vendor_ids):
+        return page, page[-1]
+    return page, None
+
+
+def vendors_in_order(vendor_ids, queryset=None):
+    """
+    Fetches the vendors with the given ids in one query and returns
+    them as a list in the same order, skipping any that are gone.
+    """
+    if queryset is None:
+        queryset = Vendor.objects.approved()
+    vendors = queryset.in_bulk(vendor_ids)
+    return [vendors[pk] for pk in vendor_ids if pk in vendors]
+
+
+def get_int_param(params, name):
+    "returns a GET parameter as an int, or None if it is missing or bad."
+    try:
+        return int(params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_bbox_param(params, name='bbox'):
+    """
+    returns a "min_lng,min_lat,max_lng,max_lat" GET parameter as a
+    Polygon, or None if it is missing or bad.
+    """
+    try:
+        bbox = [float(n) for n in params[name].split(',')]
+    except (KeyError, ValueError):
+        return None
+    if len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        return None
+    polygon = Polygon.from_bbox(bbox)
+    polygon.srid = 4326
+    return polygon
+
+
+def get_near_params(params):
+    """
+    returns the point, limit and max distance of a nearest vendor
+    search in GET parameters, as a tuple. The point comes from lat and
+    lng parameters, or from geocoding a near parameter, and is None if
+    there is neither. The limit and distance are None when not given.
+    """
+    try:
+        point = Point(x=float(params['lng']), y=float(params['lat']),
+                      srid=4326)
+    except (KeyError, ValueError):
+        point = geocode_query(params['near']) if params.get('near') else None
+
+    limit = get_int_param(params, 'limit')
+    if limit is not None:
+        limit = max(1, min(limit, settings.NEAREST_MAX_LIMIT))
+    return point, limit, get_int_param(params, 'distance')
+
+
+def get_filters(params):
+    """
+    The query and filters in `params`, the GET parameters of the vendors
+    page, as filter_vendor_ids returns them, without running the search.
+    """
+    filters = {
+        'current_query': params.get('current_query', None),
+        'neighborhood_id': get_int_param(params, 'neighborhood'),
+        'cuisine_tag_id': get_int_param(params, 'cuisine_tag'),
+        'feature_tag_id': get_int_param(params, 'feature_tag'),
+        'bbox': get_bbox_param(params),
+        'near': get_near_params(params)[0],
+        'more': False,
+        'distances': {},
+    }
+    filters['feature_tags'] = [f for f in FeatureTag.objects.with_vendors()
+                               if params.get(f.name) or
+                               filters['feature_tag_id'] == f.id]
+    return filters
+
+
+def filter_vendor_ids(params, stats=None):
+    """
+    The ids, in the order they are listed, of the approved vendors that
+    the query and filters in `params`, the GET parameters of the vendors
+    page, select.
+
+    A bbox parameter limits them to a map viewport, and to at most
+    VIEWPORT_VENDOR_LIMIT of them. With the parameters of get_near_params
+    they are the nearest vendors instead, nearest first, and the filters
+    have a dict of their distances under 'distances'. Viewports and
+    points are rarely asked for twice, so those results are not cached;
+    others are, see search_cache.
+
+    Returns a tuple of the ids and a dict of the filters that applied,
+    which also says, under 'more', whether the limit cut the ids short,
+    and holds the search cache key of the filters under 'cache_key'.
+    That is None for nearest vendor searches, which the key does not
+    describe.
+    """
+    filters = get_filters(params)
+    near, near_limit, near_distance = get_near_params(params)
+
+    cache_key = search_cache.make_key(
+        filters['current_query'],
+        neighborhood_id=filters['neighborhood_id'],
+        cuisine_tag_id=filters['cuisine_tag_id'],
+        feature_tag_ids=[f.id for f in filters['feature_tags']] +
+        ([filters['feature_tag_id']] if filters['feature_tag_id'] else []))
+    filters['cache_key'] = cache_key if near is None else None
+    vendor_ids = (search_cache.get_ids(cache_key)
+                  if filters['bbox'] is None and near is None else None)
+
+    if vendor_ids is not None:
+        if stats is not None:
+            stats['address_lookup'] = 'cached'
+        return vendor_ids, filters
+
+    vendors = Vendor.objects.approved()
+    if filters['neighborhood_id']:
+        vendors = vendors.filter(neighborhood__id=filters['neighborhood_id'])
+    if filters['cuisine_tag_id']:
+        vendors = vendors.filter(cuisine_tags__id=filters['cuisine_tag_id'])
+    if filters['feature_tag_id']:
+        vendors = vendors.filter(feature_tags__id=filters['feature_tag_id'])
+    for f in filters['feature_tags']:
+        vendors = vendors.filter(feature_tags__id__exact=f.id)
+    if filters['bbox'] is not None:
+        vendors = vendors.filter(location__within=filters['bbox'])
+
+    if filters['current_query']:
+        vendors = master_search(filters['current_query'], vendors,
+                                stats=stats)
+
+    if near is not None:
+        rows = list(nearest(near, near_limit, near_distance,
+                            queryset=vendors).values_list('id', 'distance'))
+        filters['distances'] = dict(rows)
+        return [pk for pk, distance in rows], filters
+
+    if filters['bbox'] is not None:
+        limit = settings.VIEWPORT_VENDOR_LIMIT
+        vendor_ids = list(vendors.values_list('id', flat=True)[:limit + 1])
+        filters['more'] = len(vendor_ids) > limit
+        return vendor_ids[:limit], filters
+
+    vendor_ids = list(vendors.values_list('id', flat=True))
+    search_cache.set_ids(cache_key, vendor_ids)
+    return vendor_ids, filters
+
+
+def estimate_count(vendors, cap=None):
+    """
+    A cheap total for a result set: counts no more than `cap` rows.
+    Returns a tuple of the count and whether it is exact.
+    """
+    if cap is None:
+        cap = settings.SEARCH_COUNT_CAP
+
+    count = vendors.order_by()[:cap + 1].count()
+    return min(count, cap), count <= cap
+
+
+SEARCH_ENGINES = {
+    'union': union_search,
+    'single_statement': single_statement_search,
+    'document': document_search,
+}
+
+
+def geocode_query(query):
+    """
+    returns the Point a query geocodes to, or None. A query that is the
+    address of a located vendor, however it is written, is answered
+    with that vendor's location, without calling the geocoder.
+    """
+
+    locations = (Vendor.objects.at_address(query)
+                 .exclude(location__isnull=True)
+                 .values_list('location', flat=True)[:1])
+    if locations:
+        return locations[0]
+
+    geocode_result = geocode.geocode_address(query)
+
+    if geocode_result is None:
+        return None
+    latitude, longitude, neighborhood = geocode_result
+
+    if latitude is None or longitude is None:
+        return None
+
+    return Point(x=longitude, y=latitude, srid=4326)
+
+
+def nearest(point, limit=None, max_distance=None, queryset=None):
+    """
+    The approved vendors within `max_distance` meters of `point`,
+    nearest first, up to `limit` of them. Each has a `distance`
+    attribute, in meters along the earth's surface.
+
+    The distances are on the geography type, so the radius is filtered
+    by the expression index on location::geography rather than a box
+    of degrees.
+    """
+    if limit is None:
+        limit = settings.NEAREST_LIMIT
+    if max_distance is None:
+        max_distance = settings.NEAREST_MAX_DISTANCE
+    if queryset is None:
+        queryset = Vendor.objects.approved()
+
+    qn = connection.ops.quote_name
+    location = "%s.%s::geography" % (qn(Vendor._meta.db_table),
+                                     qn('location'))
+    return (queryset
+            .extra(select={'distance': "ST_Distance(%s, %%s::geography)"
+                                       % location},
+                   select_params=[point.ewkt],
+                   where=["ST_DWithin(%s, %%s::geography, %%s)" % location],
+                   params=[point.ewkt, max_distance])
+            .order_by('distance')[:limit])
 
-        geocode_result = geocode.geocode_address(query)
 
-        if geocode_result is None:
-            return Vendor.objects.none()
-        latitude, longitude, neighborhood = geocode_result
+def address_search(query, limit=None, max_distance=None):
+    "the vendors nearest to where `query` geocodes to, nearest first."
+    point = geocode_query(query)
 
-        point = Point(x=longitude, y=latitude, srid=4326)
-        vendors = Vendor.objects.approved().filter(
-            location__dwithin=(point, .004))
+    if point is None:
+        return Vendor.objects.none()
 
-        return vendors
+    return nearest(point, limit, max_distance)
@@ -0,0 +1,49 @@
+"""
+caches the ordered ids of the vendors a search finds.
+
+Keys include a generation number that is bumped whenever a vendor,
+review, tag or neighborhood changes, which orphans every cached result
+at once; orphans expire after SEARCH_CACHE_TTL seconds.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from vegancity import cache_versions
+from vegancity.query_classifier import normalize
+
+GENERATION = 'search'
+
+
+def generation():
+    return cache_versions.get_version(GENERATION)
+
+
+def bump_generation():
+    cache_versions.bump(GENERATION)
+
+
+def make_key(query, neighborhood_id=None, cuisine_tag_id=None,
+             feature_tag_ids=()):
+    """
+    returns the cache key for a search. Queries that only differ in
+    case, spacing or punctuation, and filters that only differ in
+    order, share a key.
+    """
+    search = [settings.SEARCH_ENGINE, normalize(query or ''),
+              neighborhood_id, cuisine_tag_id,
+              sorted(set(feature_tag_ids))]
+    digest = hashlib.sha1(json.dumps(search)).hexdigest()
+    return 'vegancity:search:%s:%s' % (generation(), digest)
+
+
+def get_ids(key):
+    "returns the cached list of vendor ids for `key`, or None."
+    return cache.get(key)
+
+
+def set_ids(key, vendor_ids):
+    cache.set(key, list(vendor_ids), settings.SEARCH_CACHE_TTL)
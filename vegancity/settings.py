@@ -24,6 +24,15 @@ DATABASES = {
     }
 }
 
+# Search results and the counters that invalidate them are cached
+# here. Deployments with more than one worker process need a cache
+# they all share; see ansible's settings_local.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 GOOGLE_ANALYTICS_TRACKING_ID = ''
 
 TIME_ZONE = None
@@ -149,7 +158,19 @@ LOGGING = {
 
                        "[%(asctime)s] %(levelname)s "
                        "%(message)s::checked_feature_filters::"
-                       "%(checked_feature_filters)s\n"),
+                       "%(checked_feature_filters)s\n"
+
+                       "[%(asctime)s] %(levelname)s "
+                       "%(message)s::address_lookup::"
+                       "%(address_lookup)s\n"
+
+                       "[%(asctime)s] %(levelname)s "
+                       "%(message)s::geocode_time_saved::"
+                       "%(geocode_time_saved)s\n"
+
+                       "[%(asctime)s] %(levelname)s "
+                       "%(message)s::geocoder_breaker::"
+                       "%(geocoder_breaker)s\n"),
             'datefmt': "%d/%b/%Y %H:%M:%S"
         },
     },
@@ -240,6 +261,116 @@ LOCATION_BOUNDS = "39.9269547,-75.2519587|39.988524,-75.106326"
 # the google maps javascript api v3 for more details.
 LOCATION_COMPONENTS = "country:US|locality:Philadelphia"
 
+# How long, in seconds, geocoder responses are cached. Failed lookups
+# are cached for a shorter time so that fixed addresses recover quickly.
+GEOCODE_CACHE_TTL = 60 * 60 * 24 * 30
+GEOCODE_CACHE_NEGATIVE_TTL = 60 * 60 * 24
+
+# How often, in seconds, the geocode_vendors worker deletes expired
+# responses, so that the cache table doesn't grow with every search.
+GEOCODE_CACHE_PURGE_INTERVAL = 60 * 60
+
+# The number of geocoder responses each process keeps in memory.
+GEOCODE_CACHE_LRU_SIZE = 1000
+
+# The class addresses are geocoded with. LocalGeocoder answers offline
+# from the address points loaded by the load_address_points command.
+GEOCODER_BACKEND = 'vegancity.geocode.GoogleGeocoder'
+
+# How long, in seconds, a geocoder request may take to connect and to
+# each read, and how many idle connections to it each process keeps.
+GEOCODE_TIMEOUT = 2
+GEOCODE_POOL_SIZE = 4
+
+# After GEOCODE_BREAKER_THRESHOLD geocoder requests in a row fail or are
+# refused for quota, it isn't called for GEOCODE_BREAKER_RESET seconds,
+# and address lookups find nothing until then.
+GEOCODE_BREAKER_THRESHOLD = 5
+GEOCODE_BREAKER_RESET = 60
+
+# Vendors are geocoded from a queue by the geocode_vendors command: at
+# most GEOCODE_QUEUE_RATE lookups a second, GEOCODE_QUEUE_BATCH_SIZE
+# jobs claimed at a time and held for GEOCODE_QUEUE_LEASE seconds. A
+# failed lookup is retried after GEOCODE_QUEUE_RETRY_DELAY seconds,
+# doubling each time, until GEOCODE_QUEUE_MAX_ATTEMPTS. An idle worker
+# checks for new jobs every GEOCODE_QUEUE_POLL_INTERVAL seconds.
+GEOCODE_QUEUE_RATE = 5
+GEOCODE_QUEUE_BATCH_SIZE = 20
+GEOCODE_QUEUE_LEASE = 60 * 5
+GEOCODE_QUEUE_RETRY_DELAY = 60
+GEOCODE_QUEUE_MAX_ATTEMPTS = 6
+GEOCODE_QUEUE_POLL_INTERVAL = 5
+
+# How long, in seconds, the vendor, tag and neighborhood names used to
+# decide whether a search query could be an address are kept in memory.
+SEARCH_VOCABULARY_TTL = 60 * 5
+
+# Which engine vegancity.search.master_search uses. 'document' matches
+# against each vendor's combined, GIN indexed search_document.
+# 'single_statement' searches the vendor, tag and review indexes in one
+# query; 'union' is the original implementation, which runs each kind of
+# search separately.
+SEARCH_ENGINE = 'document'
+
+# Whether searches with no full text matches fall back to fuzzy and
+# partial word matching of vendor, neighborhood and tag names, and how
+# similar (from 0 to 1) a name has to be to match. Thresholds below
+# pg_trgm's own limit, 0.3 by default, have no further effect.
+SEARCH_TRIGRAM_ENABLED = True
+SEARCH_TRIGRAM_THRESHOLD = 0.3
+
+# How many seconds the vendor ids a search finds are cached for. Any
+# change to a vendor, review, tag or neighborhood invalidates them
+# sooner.
+SEARCH_CACHE_TTL = 60 * 60
+
+# How many seconds each list on the home page is cached for. Changes
+# that affect a list invalidate it sooner.
+HOME_FRAGMENT_TTL = 60 * 60 * 24
+
+# Whether whole pages are cached for visitors who are not logged in,
+# and for how many seconds. Changes to a vendor or its reviews purge
+# the pages that show it sooner.
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_TTL = 60 * 5
+
+# How many completions the autocomplete endpoint returns, and how many
+# seconds its in-memory index is kept before it is reloaded. Changes
+# made in the same process reload it immediately.
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_INDEX_TTL = 60 * 5
+
+# How many search results are shown per page, and how far result
+# totals are counted before they are reported as "more than".
+SEARCH_PAGE_SIZE = 25
+SEARCH_COUNT_CAP = 500
+
+# How many vendors a map viewport (a bbox= query) returns at most.
+# Responses that were cut short say there are more.
+VIEWPORT_VENDOR_LIMIT = 500
+
+# How many vendors a nearest vendor search returns by default and at
+# most, and how far away, in meters, it looks by default.
+NEAREST_LIMIT = 25
+NEAREST_MAX_LIMIT = 100
+NEAREST_MAX_DISTANCE = 5000
+
+# Below MAP_CLUSTER_MAX_ZOOM, the map shows clusters of vendors rather
+# than each one. Each map tile is split into a grid of MAP_CLUSTER_GRID
+# by MAP_CLUSTER_GRID clusters, and a viewport covering more than
+# MAP_CLUSTER_MAX_TILES tiles is clustered at a lower zoom instead.
+MAP_CLUSTER_MAX_ZOOM = 13
+MAP_CLUSTER_GRID = 8
+MAP_CLUSTER_MAX_TILES = 64
+
+# Where the vendor map tiles are kept, which zooms they are served at,
+# and how many seconds one is served before it is rendered again.
+# Changes to a vendor delete the tiles it is in sooner.
+MAP_TILE_DIR = '/var/cache/vegphilly/tiles'
+MAP_TILE_MIN_ZOOM = 9
+MAP_TILE_MAX_ZOOM = 18
+MAP_TILE_TTL = 60 * 60 * 24
+
 # Used to specify where the map will center.
 DEFAULT_CENTER = (39.946385, -75.1785634)
 
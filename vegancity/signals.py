@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# sent by VendorManager.update_rating_aggregates once the review
+# aggregates stored on `vendor_ids` have been recomputed.
+rating_aggregates_changed = Signal(providing_args=['vendor_ids'])
+
+# sent by VendorManager.assign_neighborhoods with the vendors whose
+# neighborhood it changed.
+vendor_neighborhoods_changed = Signal(providing_args=['vendor_ids'])
+
+# sent by VendorManager.update_locations with the vendors it moved, and
+# `points`, their locations before and after.
+vendor_locations_changed = Signal(providing_args=['vendor_ids', 'points'])
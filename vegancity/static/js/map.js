@@ -36,6 +36,7 @@ var vendorMap = {
         this.captionBubble = new google.maps.InfoWindow();
         this.map = null;
         this.markers = {};
+        this.clusterMarkers = [];
         this.markerImage = null;
 
         if (typeof defaultCenter === "undefined") {
@@ -76,6 +77,49 @@ var vendorMap = {
         }, this);
     },
 
+    // replaces the markers on the map with one per cluster, labelled
+    // with how many vendors it stands for
+    showClusters: function(clusters) {
+        this.clearClusters();
+        _.each(this.markers, function(marker) {
+            marker.setMap(null);
+        });
+        this.markers = {};
+        this.vendors = [];
+
+        this.clusterMarkers = _.map(clusters, function(cluster) {
+            var marker = new google.maps.Marker({
+                position: new google.maps.LatLng(cluster.latitude,
+                                                 cluster.longitude),
+                label: String(cluster.count),
+                title: cluster.count + " vendors",
+                map: this.map
+            });
+            google.maps.event.addListener(marker, 'click', _.bind(function () {
+                this.map.setCenter(marker.getPosition());
+                this.map.setZoom(this.map.getZoom() + 2);
+            }, this));
+            return marker;
+        }, this);
+    },
+
+    clearClusters: function() {
+        _.each(this.clusterMarkers, function(marker) {
+            marker.setMap(null);
+        });
+        this.clusterMarkers = [];
+    },
+
+    // plots the vendors that aren't on the map yet
+    addVendors: function(vendors) {
+        _.each(vendors, function(vendor) {
+            if (!_.has(this.markers, vendor.id)) {
+                this.vendors.push(vendor);
+                this.markers[vendor.id] = this.place(vendor);
+            }
+        }, this);
+    },
+
     getBounds: function () {
         var bounds = new google.maps.LatLngBounds();
         if (this.vendors.length === 0) {
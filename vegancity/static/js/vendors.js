@@ -1,4 +1,48 @@
 /*global google *, $, _, Backbone */
+
+// the map takes flat vendor objects, with the text fields html-escaped
+function vendorFromFeature(feature) {
+    var properties = feature.properties;
+    return {
+        id: feature.id,
+        name: _.escape(properties.name),
+        address: _.escape(properties.address || "").replace(/\n/g, "<br />"),
+        phone: _.escape(properties.phone || ""),
+        url: _.escape(properties.url),
+        longitude: feature.geometry.coordinates[0],
+        latitude: feature.geometry.coordinates[1],
+        vegLevel: properties.vegLevel
+    };
+}
+
+// fetches the vendors, or clusters of them when zoomed out, in the
+// map's viewport whenever it stops moving
+function loadVisibleVendors() {
+    google.maps.event.addListener(vendorMap.map, 'idle', function () {
+        var bounds = vendorMap.map.getBounds(),
+            southWest = bounds.getSouthWest(),
+            northEast = bounds.getNorthEast(),
+            bbox = [southWest.lng(), southWest.lat(),
+                    northEast.lng(), northEast.lat()].join(",");
+
+        $.getJSON(geojsonUrl, {bbox: bbox, zoom: vendorMap.map.getZoom()},
+                  function (collection) {
+            if (collection.clustered) {
+                vendorMap.showClusters(_.map(collection.features, function (feature) {
+                    return {
+                        count: feature.properties.count,
+                        longitude: feature.geometry.coordinates[0],
+                        latitude: feature.geometry.coordinates[1]
+                    };
+                }));
+            } else {
+                vendorMap.clearClusters();
+                vendorMap.addVendors(_.map(collection.features, vendorFromFeature));
+            }
+        });
+    });
+}
+
 var SearchFormView = Backbone.View.extend({
     events: {
         "click #clear_all": function (event) {
@@ -25,7 +69,18 @@ var SearchFormView = Backbone.View.extend({
         //TODO: change the feature modelchoicefield to a choicefield
         $("#id_feature").val("");
 
-        vendorMap.initialize("#map_canvas", vendors, "summary", autoResize);
+        if (autoResize) {
+            // a search zooms the map to fit all of its results.
+            $.getJSON(geojsonUrl, function (collection) {
+                vendorMap.initialize("#map_canvas",
+                                     _.map(collection.features, vendorFromFeature),
+                                     "summary", true);
+                loadVisibleVendors();
+            });
+        } else {
+            vendorMap.initialize("#map_canvas", [], "summary", false);
+            loadVisibleVendors();
+        }
 
         this.styleVegLevelPins();
     },
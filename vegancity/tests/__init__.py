@@ -20,6 +20,34 @@ from vegancity.tests.validators import *  # NOQA
 
 from vegancity.tests.template_tags import *  # NOQA
 
+from vegancity.tests.geocode import *  # NOQA
+
+from vegancity.tests.query_classifier import *  # NOQA
+
+from vegancity.tests.search import *  # NOQA
+
+from vegancity.tests.autocomplete import *  # NOQA
+
+from vegancity.tests.search_cache import *  # NOQA
+
+from vegancity.tests.api import *  # NOQA
+
+from vegancity.tests.leaderboards import *  # NOQA
+
+from vegancity.tests.page_cache import *  # NOQA
+
+from vegancity.tests.clusters import *  # NOQA
+
+from vegancity.tests.vector_tiles import *  # NOQA
+
+from vegancity.tests.neighborhoods import *  # NOQA
+
+from vegancity.tests.geocode_queue import *  # NOQA
+
+from vegancity.tests.regeocode import *  # NOQA
+
+from vegancity.tests.addresses import *  # NOQA
+
 
 class VegancityTestRunner(DjangoTestSuiteRunner):
 
@@ -38,6 +66,13 @@ class VegancityTestRunner(DjangoTestSuiteRunner):
         return super(VegancityTestRunner, self).__init__(interactve=False,
                                                          *args, **kwargs)
 
+    def setup_test_environment(self, **kwargs):
+        super(VegancityTestRunner, self).setup_test_environment(**kwargs)
+        # the test database is rolled back after each test, but the
+        # cache isn't, so a cached page would outlive the data it shows.
+        # tests/page_cache.py turns it back on.
+        settings.PAGE_CACHE_ENABLED = False
+
     def run_tests(self, *args, **kwargs):
         logging.disable(logging.CRITICAL)
         return super(VegancityTestRunner, self).run_tests(*args, **kwargs)
@@ -0,0 +1,89 @@
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+from mock import patch
+
+from vegancity import addresses, geocode, search
+from vegancity.forms import NewVendorForm
+from vegancity.models import Vendor
+
+
+class NormalizeTest(TestCase):
+
+    def assertSameAddress(self, canonical, *written):
+        for address in written:
+            self.assertEqual(addresses.normalize(address), canonical)
+
+    def test_suffixes_and_directionals(self):
+        self.assertSameAddress("123 s st",
+                               "123 South St.",
+                               "123 south street",
+                               "123 S Str")
+        self.assertSameAddress("1100 s christopher columbus blvd",
+                               "1100 S. Christopher Columbus Boulevard")
+
+    def test_defaults_and_zip_codes_are_dropped(self):
+        self.assertSameAddress("123 s st",
+                               "123 S St, Philadelphia",
+                               "123 S St, Philadelphia, PA 19147",
+                               "123 S St Philadelphia Pennsylvania USA")
+        self.assertEqual(addresses.normalize("123 Haddon Ave, Collingswood"),
+                         "123 haddon ave collingswood")
+
+    def test_neighborhoods_named_for_the_city_are_kept(self):
+        self.assertSameAddress("w philadelphia",
+                               "West Philadelphia",
+                               "West Philadelphia, PA")
+        self.assertSameAddress("s philadelphia", "South Philadelphia")
+        self.assertSameAddress("n philadelphia", "North Philadelphia")
+        self.assertSameAddress("4000 walnut st w philadelphia",
+                               "4000 Walnut St, West Philadelphia, PA")
+        keys = set(geocode.cache_key(name) for name in
+                   ["West Philadelphia", "South Philadelphia",
+                    "North Philadelphia", "Philadelphia"])
+        self.assertEqual(len(keys), 4)
+
+    def test_units_are_dropped(self):
+        self.assertSameAddress("4907 catharine st",
+                               "4907 Catharine St Apt 2",
+                               "4907 Catharine St #2",
+                               "4907 Catharine St, Suite 2B")
+
+    def test_first_street_word_is_a_name(self):
+        self.assertEqual(addresses.normalize("123 Avenue of the Arts"),
+                         "123 avenue of the arts")
+        self.assertEqual(addresses.normalize("Philadelphia"),
+                         "philadelphia")
+
+    def test_geocode_cache_key_is_canonical(self):
+        self.assertEqual(geocode.cache_key("123 South St."),
+                         geocode.cache_key("123 S St, Philadelphia, PA"))
+
+
+class AddressKeyTest(TestCase):
+
+    def setUp(self):
+        self.vendor = Vendor.objects.create(
+            name="Hibiscus Cafe",
+            address="4907 Catharine Street, Philadelphia, PA 19143")
+        Vendor.objects.filter(pk=self.vendor.pk).update(
+            location=Point(-75.22, 39.95, srid=4326))
+
+    def test_vendors_are_found_by_address(self):
+        self.assertEqual(list(Vendor.objects.at_address("4907 catharine st")),
+                         [self.vendor])
+        self.assertEqual(list(Vendor.objects.at_address("")), [])
+
+    def test_duplicate_vendors_are_refused(self):
+        form = NewVendorForm({'name': "hibiscus cafe",
+                              'address': "4907 Catharine St"})
+        self.assertFalse(form.is_valid())
+
+        form = NewVendorForm({'name': "Hibiscus Juice Bar",
+                              'address': "4907 Catharine St"})
+        self.assertTrue(form.is_valid())
+
+    def test_vendor_addresses_are_not_geocoded(self):
+        with patch.object(geocode, 'geocode_address') as geocode_address:
+            self.assertEqual(search.geocode_query("4907 Catharine St."),
+                             Point(-75.22, 39.95, srid=4326))
+        self.assertFalse(geocode_address.called)
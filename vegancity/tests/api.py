@@ -0,0 +1,186 @@
+import json
+
+from mock import Mock
+
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import TestCase
+
+from vegancity import geocode
+from vegancity.models import (Vendor, Review, CuisineTag, FeatureTag,
+                              Neighborhood, VegLevel)
+from vegancity.query_classifier import vocabulary
+from vegancity.tests.utils import get_user
+from vegancity.fields import StatusField as SF
+
+
+class VendorSearchApiTest(TestCase):
+
+    def setUp(self):
+        geocode.geocode_address = Mock(return_value=(None, None, None))
+        vocabulary.invalidate()
+        self.neighborhood = Neighborhood.objects.create(name="Queen Village")
+        self.veg_level = VegLevel.objects.create(name="vegan",
+                                                 description="Vegan")
+        self.cuisine_tag = CuisineTag.objects.create(name="cafe",
+                                                     description="Cafe")
+        self.feature_tag = FeatureTag.objects.create(name="patio",
+                                                     description="Patio")
+        self.author = get_user()
+
+    def tearDown(self):
+        vocabulary.invalidate()
+
+    def create_vendors(self, count):
+        for i in range(count):
+            vendor = Vendor.objects.create(name="Hibiscus %d" % i,
+                                           neighborhood=self.neighborhood,
+                                           veg_level=self.veg_level,
+                                           approval_status=SF.APPROVED)
+            vendor.cuisine_tags.add(self.cuisine_tag)
+            vendor.feature_tags.add(self.feature_tag)
+            Review.objects.create(vendor=vendor, author=self.author,
+                                  food_rating=4, atmosphere_rating=2,
+                                  approval_status=SF.APPROVED,
+                                  content="good")
+
+    def search(self):
+        response = self.client.get('/api/v1/vendors/search/',
+                                   {'q': 'hibiscus', 'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def assertSearchQueries(self, count):
+        self.create_vendors(count)
+        vocabulary.refresh()
+        # one count, one page of vendors with their neighborhoods and
+        # veg levels, and one each for cuisine tags, feature tags and
+        # reviews.
+        with self.settings(SEARCH_PAGE_SIZE=100):
+            with self.assertNumQueries(5):
+                content = self.search()
+
+        self.assertEqual(content['meta']['total_count'], count)
+        self.assertEqual(len(content['vendors']), count)
+        vendor = content['vendors'][0]
+        self.assertEqual(vendor['neighborhood']['name'], "Queen Village")
+        self.assertEqual(vendor['veg_level']['name'], "vegan")
+        self.assertEqual(vendor['cuisine_tags'][0]['description'], "Cafe")
+        self.assertEqual(vendor['feature_tags'][0]['description'], "Patio")
+        self.assertEqual(len(vendor['reviews']), 1)
+        self.assertEqual(vendor['food_rating'], 4)
+        self.assertEqual(vendor['atmosphere_rating'], 2)
+
+    def test_search_queries_for_1_result(self):
+        self.assertSearchQueries(1)
+
+    def test_search_queries_for_10_results(self):
+        self.assertSearchQueries(10)
+
+    def test_search_queries_for_100_results(self):
+        self.assertSearchQueries(100)
+
+
+class VendorGeoJsonApiTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.neighborhood = Neighborhood.objects.create(name="Queen Village")
+        self.veg_level = VegLevel.objects.create(name="vegan",
+                                                 description="Vegan")
+        self.located = Vendor.objects.create(name="Hibiscus Cafe",
+                                             address="4907 Catharine St",
+                                             neighborhood=self.neighborhood,
+                                             veg_level=self.veg_level,
+                                             approval_status=SF.APPROVED)
+        self.elsewhere = Vendor.objects.create(name="Green Line",
+                                               approval_status=SF.APPROVED)
+        self.unlocated = Vendor.objects.create(name="Royal Tavern",
+                                               neighborhood=self.neighborhood,
+                                               approval_status=SF.APPROVED)
+        for vendor in (self.located, self.elsewhere):
+            Vendor.objects.filter(pk=vendor.pk).update(
+                location=Point(-75.15, 39.94, srid=4326))
+
+    def get(self, params=None, **headers):
+        return self.client.get('/api/v1/vendors/geojson/', params or {},
+                               **headers)
+
+    def test_features_match_the_vendors_page_filters(self):
+        response = self.get({'neighborhood': self.neighborhood.pk})
+        self.assertEqual(response.status_code, 200)
+        collection = json.loads(response.content)
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual(collection['features'], [{
+            'type': 'Feature',
+            'id': self.located.pk,
+            'geometry': {'type': 'Point', 'coordinates': [-75.15, 39.94]},
+            'properties': {
+                'name': "Hibiscus Cafe",
+                'address': "4907 Catharine St",
+                'phone': None,
+                'url': "/vendors/%d-hibiscus-cafe/" % self.located.pk,
+                'vegLevel': self.veg_level.pk,
+            },
+        }])
+
+    def test_bbox_limits_features_to_the_viewport(self):
+        Vendor.objects.filter(pk=self.elsewhere.pk).update(
+            location=Point(-80, 40, srid=4326))
+        collection = json.loads(
+            self.get({'bbox': '-75.2,39.9,-75.1,40.0'}).content)
+        self.assertEqual([f['id'] for f in collection['features']],
+                         [self.located.pk])
+        self.assertFalse(collection['more'])
+
+    def test_bbox_results_are_capped(self):
+        with self.settings(VIEWPORT_VENDOR_LIMIT=1):
+            collection = json.loads(
+                self.get({'bbox': '-75.2,39.9,-75.1,40.0'}).content)
+        self.assertEqual(len(collection['features']), 1)
+        self.assertTrue(collection['more'])
+
+    def test_unchanged_results_are_not_modified(self):
+        response = self.get()
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_change_the_etag(self):
+        etag = self.get()['ETag']
+        self.elsewhere.phone = "215-555-0100"
+        self.elsewhere.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class VendorNearbyApiTest(TestCase):
+
+    def setUp(self):
+        for name, lat in (("Far", 39.95), ("Near", 39.941)):
+            vendor = Vendor.objects.create(name=name,
+                                           approval_status=SF.APPROVED)
+            Vendor.objects.filter(pk=vendor.pk).update(
+                location=Point(-75.15, lat, srid=4326))
+
+    def test_nearest_first_with_distances(self):
+        response = self.client.get('/api/v1/vendors/nearby/',
+                                   {'lat': '39.94', 'lng': '-75.15',
+                                    'format': 'json'})
+        vendors = json.loads(response.content)['vendors']
+        self.assertEqual([v['name'] for v in vendors], ["Near", "Far"])
+        self.assertAlmostEqual(vendors[0]['distance'], 111, delta=1)
+
+    def test_address_is_geocoded(self):
+        geocode.geocode_address = Mock(return_value=(39.94, -75.15, None))
+        response = self.client.get('/api/v1/vendors/nearby/',
+                                   {'near': '300 christian st',
+                                    'limit': 1, 'format': 'json'})
+        vendors = json.loads(response.content)['vendors']
+        self.assertEqual([v['name'] for v in vendors], ["Near"])
+
+    def test_point_is_required(self):
+        response = self.client.get('/api/v1/vendors/nearby/')
+        self.assertEqual(response.status_code, 400)
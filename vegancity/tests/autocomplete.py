@@ -0,0 +1,78 @@
+import json
+
+from django.test import TestCase
+
+from vegancity import autocomplete
+from vegancity.models import Vendor, Neighborhood, CuisineTag
+from vegancity.fields import StatusField as SF
+
+
+class PrefixIndexTest(TestCase):
+
+    def setUp(self):
+        autocomplete.index.invalidate()
+        self.green_line = Vendor.objects.create(name="Green Line",
+                                                approval_status=SF.APPROVED)
+        self.mean_green = Vendor.objects.create(name="Mean Green Cafe",
+                                                approval_status=SF.APPROVED)
+        self.pending = Vendor.objects.create(name="Green Pending")
+        self.tag = CuisineTag.objects.create(name="greek",
+                                             description="Greek")
+        self.n1 = Neighborhood.objects.create(name="Greenwich")
+
+    def tearDown(self):
+        autocomplete.index.invalidate()
+
+    def complete(self, prefix, limit=None):
+        return [(kind, pk) for kind, pk, label in
+                autocomplete.index.complete(prefix, limit)]
+
+    def test_whole_names_before_later_words(self):
+        self.assertEqual(self.complete("gre"),
+                         [('cuisine_tag', self.tag.pk),
+                          ('vendor', self.green_line.pk),
+                          ('neighborhood', self.n1.pk),
+                          ('vendor', self.mean_green.pk)])
+
+    def test_limit(self):
+        self.assertEqual(len(self.complete("gre", limit=2)), 2)
+
+    def test_prefix_is_normalized(self):
+        self.assertEqual(self.complete("  MEAN  green, "),
+                         [('vendor', self.mean_green.pk)])
+
+    def test_empty_prefix(self):
+        self.assertEqual(self.complete(""), [])
+
+    def test_lookups_do_not_query_once_loaded(self):
+        self.complete("gre")
+        with self.assertNumQueries(0):
+            self.complete("green")
+            self.complete("mea")
+
+    def test_changes_rebuild_index(self):
+        self.complete("gre")
+        self.pending.approval_status = SF.APPROVED
+        self.pending.save()
+        self.assertIn(('vendor', self.pending.pk), self.complete("green p"))
+        self.green_line.delete()
+        self.assertEqual(self.complete("green l"), [])
+
+
+class AutocompleteApiTest(TestCase):
+
+    def setUp(self):
+        autocomplete.index.invalidate()
+        self.vendor = Vendor.objects.create(name="Hibiscus Cafe",
+                                            approval_status=SF.APPROVED)
+
+    def tearDown(self):
+        autocomplete.index.invalidate()
+
+    def test_completions(self):
+        response = self.client.get('/api/v1/vendors/autocomplete/',
+                                   {'q': 'hib', 'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['completions'],
+                         [{'type': 'vendor', 'id': self.vendor.pk,
+                           'name': "Hibiscus Cafe"}])
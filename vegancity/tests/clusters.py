@@ -0,0 +1,100 @@
+import json
+
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import TestCase
+
+from vegancity import clusters, tiles
+from vegancity.models import Vendor, VegLevel
+from vegancity.fields import StatusField as SF
+
+
+class TileTest(TestCase):
+
+    def test_tile_contains_its_points(self):
+        x, y = tiles.tile_for(-75.15, 39.94, 12)
+        min_lng, min_lat, max_lng, max_lat = tiles.tile_bounds(12, x, y)
+        self.assertTrue(min_lng <= -75.15 < max_lng)
+        self.assertTrue(min_lat <= 39.94 < max_lat)
+
+    def test_tiles_covering(self):
+        extent = tiles.tile_bounds(12, 1192, 1551)
+        self.assertEqual(tiles.tiles_covering(extent, 12),
+                         [(1192, 1551), (1192, 1552),
+                          (1193, 1551), (1193, 1552)])
+        self.assertEqual(len(tiles.tiles_covering(extent, 14)), 25)
+
+
+class ClusterTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.vegan = VegLevel.objects.create(name="vegan",
+                                             description="Vegan")
+        self.vendors = []
+        for i, (lng, lat, veg_level) in enumerate([
+                (-75.150, 39.940, self.vegan),
+                (-75.151, 39.941, self.vegan),
+                (-75.152, 39.942, None),
+                (-75.050, 40.040, None)]):
+            vendor = Vendor.objects.create(name="Vendor %d" % i,
+                                           veg_level=veg_level,
+                                           approval_status=SF.APPROVED)
+            Vendor.objects.filter(pk=vendor.pk).update(
+                location=Point(lng, lat, srid=4326))
+            self.vendors.append(vendor)
+        self.vendor_ids = [v.pk for v in self.vendors]
+
+    def get_clusters(self, zoom, extent=(-75.2, 39.9, -75.0, 40.1)):
+        return clusters.get_clusters(self.vendor_ids, 'test-key',
+                                     extent, zoom)
+
+    def test_nearby_vendors_are_clustered(self):
+        found = sorted(self.get_clusters(12), key=lambda c: c['count'])
+        self.assertEqual([c['count'] for c in found], [1, 3])
+        self.assertEqual(found[1]['vegLevels'], {self.vegan.pk: 2, 0: 1})
+        self.assertAlmostEqual(found[1]['longitude'], -75.151)
+        self.assertAlmostEqual(found[1]['latitude'], 39.941)
+
+    def test_tiles_are_cached(self):
+        self.get_clusters(12)
+        with self.assertNumQueries(0):
+            self.get_clusters(12)
+        # a viewport within the cached one reuses its tiles.
+        with self.assertNumQueries(0):
+            self.get_clusters(12, (-75.16, 39.93, -75.14, 39.95))
+
+    def test_nearest_vendor_searches_are_not_cached(self):
+        near = {'bbox': '-75.2,39.9,-75.0,40.1', 'zoom': 10,
+                'lat': 40.04, 'lng': -75.05, 'limit': 1}
+        response = self.client.get('/api/v1/vendors/geojson/', near)
+        collection = json.loads(response.content)
+        self.assertEqual(sum(f['properties']['count']
+                             for f in collection['features']), 1)
+
+        del near['lat'], near['lng'], near['limit']
+        response = self.client.get('/api/v1/vendors/geojson/', near)
+        collection = json.loads(response.content)
+        self.assertEqual(sum(f['properties']['count']
+                             for f in collection['features']), 4)
+
+    def test_large_extents_are_clustered_at_a_lower_zoom(self):
+        with self.settings(MAP_CLUSTER_MAX_TILES=1):
+            found = self.get_clusters(12, (-76, 39, -74, 41))
+        self.assertEqual(sum(c['count'] for c in found), 4)
+
+    def test_geojson_endpoint_clusters_when_zoomed_out(self):
+        response = self.client.get('/api/v1/vendors/geojson/',
+                                   {'bbox': '-75.2,39.9,-75.0,40.1',
+                                    'zoom': 10})
+        collection = json.loads(response.content)
+        self.assertTrue(collection['clustered'])
+        self.assertEqual(sum(f['properties']['count']
+                             for f in collection['features']), 4)
+
+        response = self.client.get('/api/v1/vendors/geojson/',
+                                   {'bbox': '-75.2,39.9,-75.0,40.1',
+                                    'zoom': 16})
+        collection = json.loads(response.content)
+        self.assertFalse(collection['clustered'])
+        self.assertEqual(len(collection['features']), 4)
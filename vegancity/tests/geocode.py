@@ -0,0 +1,281 @@
+import httplib
+import json
+import socket
+from datetime import timedelta
+
+from mock import Mock, patch
+
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from vegancity import geocode
+from vegancity.models import AddressPoint, GeocodeCacheEntry
+
+# other tests replace geocode.geocode_address with a Mock and never put
+# it back, so hold on to the real thing while it is still there.
+geocode_address = geocode.geocode_address
+
+
+class GeocodeCacheTest(TestCase):
+
+    def setUp(self):
+        geocode._memory_cache.clear()
+        geocode.breaker.reset()
+        self.addCleanup(geocode.breaker.reset)
+        backend = Mock()
+        backend.geocode.return_value = ('OK',
+                                        (39.94, -75.15, "Queen Village"))
+        patcher = patch.object(geocode, 'get_backend',
+                               Mock(return_value=backend))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend_geocode = backend.geocode
+
+    def test_repeated_lookup_only_geocodes_once(self):
+        self.assertEqual(geocode_address("south street"),
+                         (39.94, -75.15, "Queen Village"))
+        self.assertEqual(geocode_address("south street"),
+                         (39.94, -75.15, "Queen Village"))
+        self.assertEqual(self.backend_geocode.call_count, 1)
+
+    def test_lookup_is_normalized(self):
+        geocode_address("South Street")
+        geocode_address("  south   street ")
+        self.assertEqual(self.backend_geocode.call_count, 1)
+
+    def test_database_cache_survives_memory_cache(self):
+        geocode_address("south street")
+        geocode._memory_cache.clear()
+        geocode_address("south street")
+        self.assertEqual(self.backend_geocode.call_count, 1)
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 1)
+
+    def test_expired_entries_are_refreshed(self):
+        geocode_address("south street")
+        geocode._memory_cache.clear()
+        GeocodeCacheEntry.objects.update(
+            expires=timezone.now() - timedelta(seconds=1))
+        geocode_address("south street")
+        self.assertEqual(self.backend_geocode.call_count, 2)
+        self.assertEqual(GeocodeCacheEntry.objects.live().count(), 1)
+
+    def test_failed_lookups_are_cached(self):
+        self.backend_geocode.return_value = ('ZERO_RESULTS',
+                                             (None, None, None))
+        self.assertEqual(geocode_address("nowhere"), (None, None, None))
+        geocode._memory_cache.clear()
+        self.assertEqual(geocode_address("nowhere"), (None, None, None))
+        self.assertEqual(self.backend_geocode.call_count, 1)
+
+    def test_transient_failures_are_not_cached(self):
+        self.backend_geocode.return_value = ('OVER_QUERY_LIMIT',
+                                             (None, None, None))
+        geocode_address("south street")
+        geocode_address("south street")
+        self.assertEqual(self.backend_geocode.call_count, 2)
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 0)
+
+    def test_lookup_raises_on_transient_failures(self):
+        self.backend_geocode.return_value = ('OVER_QUERY_LIMIT',
+                                             (None, None, None))
+        self.assertRaises(geocode.GeocodeError,
+                          geocode.lookup, "south street")
+        self.backend_geocode.side_effect = IOError("connection refused")
+        self.assertRaises(geocode.GeocodeError,
+                          geocode.lookup, "south street")
+        self.assertEqual(geocode_address("south street"), (None, None, None))
+
+    def test_open_breaker_skips_the_geocoder(self):
+        self.backend_geocode.return_value = ('OVER_QUERY_LIMIT',
+                                             (None, None, None))
+        for i in range(geocode.breaker.threshold):
+            self.assertRaises(geocode.GeocodeError,
+                              geocode.lookup, "south street")
+        self.assertEqual(geocode.breaker.state, geocode.breaker.OPEN)
+
+        self.assertEqual(geocode_address("south street"), (None, None, None))
+        self.assertEqual(self.backend_geocode.call_count,
+                         geocode.breaker.threshold)
+
+    def test_only_geocoder_calls_are_timed(self):
+        with patch.object(geocode.timer, 'record') as record:
+            geocode_address("south street")
+            geocode_address("south street")
+        self.assertEqual(record.call_count, 1)
+
+    def test_refresh_replaces_cached_results(self):
+        geocode.lookup("south street")
+        self.backend_geocode.return_value = ('OK',
+                                             (39.95, -75.16, "Bella Vista"))
+        self.assertEqual(geocode.lookup("south street", refresh=True),
+                         (39.95, -75.16, "Bella Vista"))
+        self.assertEqual(self.backend_geocode.call_count, 2)
+
+        self.assertEqual(geocode.lookup("south street"),
+                         (39.95, -75.16, "Bella Vista"))
+        geocode._memory_cache.clear()
+        self.assertEqual(geocode.lookup("south street"),
+                         (39.95, -75.16, "Bella Vista"))
+        self.assertEqual(self.backend_geocode.call_count, 2)
+
+    def test_cache_key_includes_location_settings(self):
+        key = geocode.cache_key("south street")
+        with patch.object(geocode, 'LOCATION_BOUNDS', "0,0|1,1"):
+            self.assertNotEqual(key, geocode.cache_key("south street"))
+
+
+class LRUCacheTest(TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = geocode.LRUCache(2)
+        cache.set('a', 1, float('inf'))
+        cache.set('b', 2, float('inf'))
+        cache.get('a')
+        cache.set('c', 3, float('inf'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expired_values_are_not_returned(self):
+        cache = geocode.LRUCache(2)
+        cache.set('a', 1, 0)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+
+class CircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        self.breaker = geocode.CircuitBreaker(threshold=2, reset_after=60)
+
+    def test_opens_after_failures_in_a_row(self):
+        self.breaker.failed()
+        self.breaker.succeeded()
+        self.breaker.failed()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failed()
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_one_call_is_let_through_after_the_reset(self):
+        self.breaker.failed()
+        self.breaker.failed()
+        self.breaker.opened -= 60
+        self.assertEqual(self.breaker.state, self.breaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.failed()
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+
+        self.breaker.opened -= 60
+        self.assertTrue(self.breaker.allow())
+        self.breaker.succeeded()
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
+
+
+class BreakerMetricsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = geocode.CircuitBreaker(threshold=1, reset_after=60,
+                                              name='test')
+
+    def test_transitions_and_refusals_are_published(self):
+        self.assertEqual(self.breaker.metrics()['state'], None)
+        self.breaker.failed()
+        self.assertFalse(self.breaker.allow())
+        metrics = self.breaker.metrics()
+        self.assertEqual((metrics['state'], metrics['opened'],
+                          metrics['refused']), ('open', 1, 1))
+
+        self.breaker.opened -= 60
+        self.assertTrue(self.breaker.allow())
+        self.breaker.succeeded()
+        metrics = self.breaker.metrics()
+        self.assertEqual((metrics['state'], metrics['opened'],
+                          metrics['refused']), ('closed', 1, 1))
+
+    def test_status_endpoint(self):
+        geocode.breaker.reset()
+        status = json.loads(self.client.get('/status/geocoder/').content)
+        self.assertEqual(status['process_state'], 'closed')
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        self.pool = geocode.ConnectionPool('example.com', size=2, timeout=1)
+        self.connections = []
+        patcher = patch.object(self.pool, '_connect', self.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self):
+        response = Mock(status=200, will_close=False)
+        response.read.return_value = '{}'
+        connection = Mock()
+        connection.getresponse.return_value = response
+        self.connections.append(connection)
+        return connection
+
+    def test_connections_are_reused(self):
+        self.assertEqual(self.pool.get('/a'), (200, '{}'))
+        self.assertEqual(self.pool.get('/b'), (200, '{}'))
+        self.assertEqual(len(self.connections), 1)
+
+    def test_closed_connections_are_replaced(self):
+        self.pool.get('/a')
+        self.connections[0].request.side_effect = httplib.BadStatusLine('')
+        self.assertEqual(self.pool.get('/b'), (200, '{}'))
+        self.assertEqual(len(self.connections), 2)
+        self.assertTrue(self.connections[0].close.called)
+
+    def test_timeouts_are_not_retried(self):
+        self.pool.get('/a')
+        self.connections[0].request.side_effect = socket.timeout()
+        self.assertRaises(socket.timeout, self.pool.get, '/b')
+        self.assertEqual(len(self.connections), 1)
+
+
+class LocalGeocoderTest(TestCase):
+
+    def setUp(self):
+        geocode._memory_cache.clear()
+        for number, lng in ((100, -75.150), (200, -75.152),
+                            (300, -75.154)):
+            AddressPoint.objects.create(
+                number=number, street="christian st",
+                location=Point(lng, 39.94, srid=4326))
+        self.geocoder = geocode.LocalGeocoder()
+
+    def test_split_address(self):
+        self.assertEqual(geocode.split_address("300 Christian St, PA"),
+                         (300, "christian st"))
+        self.assertEqual(geocode.split_address("Christian St"),
+                         (None, "christian st"))
+
+    def test_known_addresses(self):
+        self.assertEqual(self.geocoder.geocode("200 Christian St"),
+                         ('OK', (39.94, -75.152, None)))
+
+    def test_numbers_between_points_are_interpolated(self):
+        status, (latitude, longitude, _) = self.geocoder.geocode(
+            "150 christian st, philadelphia")
+        self.assertAlmostEqual(longitude, -75.151)
+
+    def test_streets_without_numbers(self):
+        self.assertEqual(self.geocoder.geocode("christian st"),
+                         ('OK', (39.94, -75.152, None)))
+
+    def test_unknown_streets(self):
+        self.assertEqual(self.geocoder.geocode("100 south st"),
+                         ('ZERO_RESULTS', (None, None, None)))
+
+    def test_geocode_address_uses_the_configured_backend(self):
+        with self.settings(
+                GEOCODER_BACKEND='vegancity.geocode.LocalGeocoder'):
+            self.assertEqual(geocode_address("300 Christian St"),
+                             (39.94, -75.154, None))
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+from django.utils import timezone
+from mock import patch
+
+from vegancity import geocode, geocode_queue
+from vegancity.models import GeocodeCacheEntry, GeocodeJob, Vendor
+
+
+class GeocodeQueueTest(TestCase):
+
+    def setUp(self):
+        patcher = patch.object(geocode, 'lookup',
+                               return_value=(39.94, -75.15, None))
+        self.lookup = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vendor = Vendor.objects.create(name="Hibiscus Cafe",
+                                            address="4907 Catharine St")
+
+    def get_vendor(self):
+        return Vendor.objects.get(pk=self.vendor.pk)
+
+    def test_saving_queues_rather_than_geocodes(self):
+        self.assertFalse(self.lookup.called)
+        self.assertEqual(GeocodeJob.objects.get().address,
+                         "4907 Catharine St")
+
+    def test_saving_again_keeps_one_job(self):
+        vendor = self.get_vendor()
+        vendor.address = "4907 Catharine Street"
+        vendor.save()
+        self.assertEqual(GeocodeJob.objects.get().address,
+                         "4907 Catharine Street")
+
+    def test_worker_writes_location(self):
+        self.assertEqual(geocode_queue.run_batch(), 1)
+        self.lookup.assert_called_once_with("4907 Catharine St")
+        self.assertEqual(self.get_vendor().location,
+                         Point(-75.15, 39.94, srid=4326))
+        self.assertEqual(GeocodeJob.objects.count(), 0)
+        self.assertEqual(geocode_queue.run_batch(), 0)
+
+    def test_failures_are_retried_later(self):
+        self.lookup.side_effect = geocode.GeocodeError('OVER_QUERY_LIMIT')
+        geocode_queue.run_batch()
+        job = GeocodeJob.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, 'OVER_QUERY_LIMIT')
+        self.assertTrue(job.next_attempt > timezone.now())
+        self.assertEqual(geocode_queue.run_batch(), 0)
+
+    def test_retries_back_off(self):
+        self.assertEqual(geocode_queue.retry_delay(3),
+                         geocode_queue.retry_delay(1) * 4)
+
+    def test_failed_jobs_are_given_up(self):
+        self.lookup.side_effect = geocode.GeocodeError('OVER_QUERY_LIMIT')
+        with self.settings(GEOCODE_QUEUE_MAX_ATTEMPTS=2):
+            for attempt in range(3):
+                GeocodeJob.objects.update(next_attempt=timezone.now())
+                geocode_queue.run_batch()
+            self.assertEqual(self.lookup.call_count, 2)
+            self.assertEqual(GeocodeJob.objects.failed().count(), 1)
+
+    def test_claimed_jobs_are_passed_over(self):
+        self.assertEqual(len(GeocodeJob.objects.claim(10)), 1)
+        self.assertEqual(len(GeocodeJob.objects.claim(10)), 0)
+        GeocodeJob.objects.update(
+            next_attempt=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(GeocodeJob.objects.claim(10)), 1)
+
+    def test_stale_jobs_do_not_overwrite_new_addresses(self):
+        job, = GeocodeJob.objects.claim(10)
+        vendor = self.get_vendor()
+        vendor.address = "1100 S Christopher Columbus Blvd"
+        vendor.save()
+
+        self.assertFalse(geocode_queue.save_result(job, (39.94, -75.15,
+                                                         None)))
+        self.assertEqual(self.get_vendor().location, None)
+        self.assertEqual(GeocodeJob.objects.get().address,
+                         "1100 S Christopher Columbus Blvd")
+
+    def test_writing_a_result_again_changes_nothing(self):
+        job, = GeocodeJob.objects.claim(10)
+        self.assertTrue(geocode_queue.save_result(job, (39.94, -75.15,
+                                                        None)))
+        self.assertFalse(geocode_queue.save_result(job, (39.94, -75.15,
+                                                         None)))
+
+
+class PurgeCacheTest(TestCase):
+
+    def test_expired_responses_are_deleted(self):
+        now = timezone.now()
+        for key, expires in (('old', now - timedelta(seconds=1)),
+                             ('new', now + timedelta(days=1))):
+            GeocodeCacheEntry.objects.create(key=key, address=key,
+                                             expires=expires)
+        self.assertEqual(geocode_queue.purge_cache(), 1)
+        self.assertEqual(list(GeocodeCacheEntry.objects.values_list(
+            'key', flat=True)), ['new'])
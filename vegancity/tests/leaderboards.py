@@ -0,0 +1,156 @@
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase
+from django.test.client import RequestFactory
+from mock import patch
+
+from vegancity import leaderboards, views
+from vegancity.models import (Vendor, Review, CuisineTag, Neighborhood,
+                              LeaderboardEntry)
+from vegancity.tests.utils import get_user
+from vegancity.fields import StatusField as SF
+
+
+class LeaderboardTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user()
+        self.n1 = Neighborhood.objects.create(name="Queen Village")
+        self.hibiscus = Vendor.objects.create(name="Hibiscus Cafe",
+                                              neighborhood=self.n1,
+                                              approval_status=SF.APPROVED)
+        self.green_line = Vendor.objects.create(name="Green Line",
+                                                approval_status=SF.APPROVED)
+
+    def board(self, name):
+        return [(entry.object_id, entry.count)
+                for entry in leaderboards.get_boards()[name]]
+
+    def review(self, vendor, **kwargs):
+        return Review.objects.create(vendor=vendor, author=self.user,
+                                     approval_status=SF.APPROVED,
+                                     content="good", **kwargs)
+
+    def test_reviews_update_review_boards(self):
+        self.review(self.hibiscus, food_rating=2, atmosphere_rating=2)
+        self.review(self.green_line, food_rating=4, atmosphere_rating=1)
+        self.review(self.green_line)
+        self.assertEqual(self.board('top_rated'),
+                         [(self.green_line.pk, 2), (self.hibiscus.pk, 1)])
+        self.assertEqual(self.board('most_reviewed'),
+                         [(self.green_line.pk, 2), (self.hibiscus.pk, 1)])
+        self.assertEqual(self.board('recently_active'),
+                         [(self.green_line.pk, None),
+                          (self.hibiscus.pk, None)])
+
+    def test_unapproved_review_is_removed(self):
+        review = self.review(self.hibiscus)
+        review.approval_status = SF.PENDING
+        review.save()
+        self.assertEqual(self.board('most_reviewed'), [])
+
+    def test_vendor_changes_update_boards(self):
+        self.assertEqual(self.board('recently_added'),
+                         [(self.green_line.pk, None),
+                          (self.hibiscus.pk, None)])
+        self.assertEqual(self.board('neighborhoods'), [(self.n1.pk, 1)])
+        self.hibiscus.delete()
+        self.assertEqual(self.board('recently_added'),
+                         [(self.green_line.pk, None)])
+        self.assertEqual(self.board('neighborhoods'), [])
+
+    def test_tag_changes_update_boards(self):
+        tag = CuisineTag.objects.create(name="ethiopian",
+                                        description="Ethiopian")
+        self.hibiscus.cuisine_tags.add(tag)
+        self.assertEqual(self.board('cuisine_tags'), [(tag.pk, 1)])
+        tag.description = "Eritrean"
+        tag.save()
+        self.assertEqual(leaderboards.get_boards()['cuisine_tags'][0].name,
+                         "Eritrean")
+        self.hibiscus.cuisine_tags.clear()
+        self.assertEqual(self.board('cuisine_tags'), [])
+
+    def test_vendor_changes_only_refresh_their_boards(self):
+        other = Neighborhood.objects.create(name="Fishtown")
+        with patch.object(leaderboards, 'refresh') as refresh:
+            self.hibiscus.location = Point(-75.15, 39.94, srid=4326)
+            self.hibiscus.save(update_fields=['location'])
+            self.hibiscus.notes = "Cash only"
+            self.hibiscus.save()
+            self.assertFalse(refresh.called)
+            self.hibiscus.neighborhood = other
+            self.hibiscus.save(update_fields=['location', 'neighborhood'])
+        refresh.assert_called_once_with(('neighborhoods',))
+
+    def test_boards_refreshed_in_a_transaction_are_invalidated_after(self):
+        # every test runs inside a transaction, which is pretended away
+        # to end it.
+        ended = patch.object(transaction.get_connection(),
+                             'in_atomic_block', False)
+        with ended:
+            leaderboards.invalidate_pending()
+
+        before = leaderboards.get_versions()
+        leaderboards.refresh(['most_reviewed'])
+        during = leaderboards.get_versions()
+        self.assertNotEqual(during['most_reviewed'],
+                            before['most_reviewed'])
+        leaderboards.invalidate_pending()
+        self.assertEqual(leaderboards.get_versions(), during)
+
+        with ended:
+            leaderboards.invalidate_pending()
+        after = leaderboards.get_versions()
+        self.assertNotEqual(after['most_reviewed'], during['most_reviewed'])
+        self.assertEqual(after['recently_added'], during['recently_added'])
+
+    def test_refresh_repairs_boards(self):
+        LeaderboardEntry.objects.all().delete()
+        leaderboards.refresh()
+        self.assertEqual(len(self.board('recently_added')), 2)
+
+    def test_entry_urls(self):
+        entries = leaderboards.get_boards()
+        self.assertEqual(entries['recently_added'][0].get_absolute_url(),
+                         "/vendors/%d-green-line/" % self.green_line.pk)
+        self.assertEqual(entries['neighborhoods'][0].get_absolute_url(),
+                         "/vendors/?neighborhood=%d" % self.n1.pk)
+
+    def test_home_reads_boards_in_one_query(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        with self.assertNumQueries(0):
+            ctx = views._get_home_context(request)
+        with self.assertNumQueries(1):
+            list(ctx['top_5'])
+            list(ctx['feature_tags'])
+
+
+class HomeFragmentCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = Vendor.objects.create(name="Hibiscus Cafe",
+                                            approval_status=SF.APPROVED)
+
+    def test_cached_home_page_does_not_query(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertContains(response, "Hibiscus Cafe")
+
+    def test_changes_invalidate_their_fragments(self):
+        self.client.get('/')
+        before = leaderboards.get_versions()
+        Review.objects.create(vendor=self.vendor, author=get_user(),
+                              approval_status=SF.APPROVED, content="good")
+        after = leaderboards.get_versions()
+        self.assertNotEqual(after['most_reviewed'], before['most_reviewed'])
+        self.assertEqual(after['recently_added'], before['recently_added'])
+
+        Vendor.objects.create(name="Green Line",
+                              approval_status=SF.APPROVED)
+        self.assertContains(self.client.get('/'), "Green Line")
@@ -1,12 +1,17 @@
-from mock import Mock
+import random
+from StringIO import StringIO
 
+from mock import Mock, patch
+
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
 from django.contrib.gis.geos import Point
 
 from django.test import TestCase
 
-from vegancity import email, geocode
-from vegancity.models import Review, Vendor, Neighborhood
+from vegancity import email, geocode, geocode_queue
+from vegancity.models import (Review, Vendor, Neighborhood, CuisineTag,
+                              FeatureTag)
 from vegancity.tests.utils import get_user
 from vegancity.fields import StatusField as SF
 
@@ -62,13 +67,18 @@ class VendorGeocodeTest(TestCase):
         self.assertFalse(vendor.needs_geocoding())
 
     def test_address_causes_geocode(self):
-        geocode.geocode_address = Mock(return_value=(100, 100, "South Philly"))
         vendor = Vendor(
             name="Test Vendor",
             address="300 Christian St, Philadelphia, PA, 19147")
 
         vendor.save()
+        self.assertEqual(vendor.location, None)
 
+        with patch.object(geocode, 'lookup',
+                          return_value=(100, 100, "South Philly")):
+            geocode_queue.run_batch()
+
+        vendor = Vendor.objects.get(pk=vendor.pk)
         self.assertNotEqual(vendor.location, None)
         self.assertNotEqual(vendor.neighborhood, None)
 
@@ -80,6 +90,11 @@ class VendorGeocodeTest(TestCase):
         self.assertTrue(vendor.needs_geocoding())
 
         vendor.save()
+        with patch.object(geocode, 'lookup',
+                          return_value=(100, 100, None)):
+            geocode_queue.run_batch()
+
+        vendor = Vendor.objects.get(pk=vendor.pk)
         self.assertFalse(vendor.needs_geocoding())
 
     def run_apply_geocoding_test(self, geocoder_return_value,
@@ -223,6 +238,23 @@ class VendorApprovedManagerTest(TestCase):
         self.assertIn(Vendor.objects.approved().get_random_unreviewed(),
                       [v2, v3])
 
+    def test_get_random_unreviewed_reaches_every_vendor(self):
+        vendors = [Vendor.objects.create(name='tv%d' % i,
+                                         approval_status=SF.APPROVED)
+                   for i in range(3)]
+        with patch.object(random, 'randint', Mock(side_effect=[
+                vendor.pk for vendor in vendors])):
+            picks = [Vendor.objects.approved().get_random_unreviewed()
+                     for i in range(3)]
+        self.assertEqual(picks, vendors)
+
+    def test_get_random_unreviewed_is_two_queries(self):
+        for i in range(10):
+            Vendor.objects.create(name='tv%d' % i,
+                                  approval_status=SF.APPROVED)
+        with self.assertNumQueries(2):
+            Vendor.objects.approved().get_random_unreviewed()
+
 
 class VendorModelTest(TestCase):
 
@@ -347,3 +379,123 @@ class VendorEmailTest(TestCase):
         vendor.approval_status = SF.APPROVED
         vendor.save()
         email.send_new_vendor_approval.assert_not_called()
+
+
+class VendorSearchDocumentTest(TestCase):
+
+    def setUp(self):
+        self.vendor = Vendor.objects.create(name="Test Vendor",
+                                            approval_status=SF.APPROVED)
+        self.tag = CuisineTag.objects.create(name="ethiopian",
+                                             description="Ethiopian")
+
+    def assertMatches(self, query, matches=True):
+        vendors = Vendor.objects.extra(
+            where=["search_document @@ "
+                   "plainto_tsquery('pg_catalog.english', %s)"],
+            params=[query])
+        self.assertEqual(self.vendor in vendors, matches)
+
+    def test_vendor_fields(self):
+        self.assertMatches("vendor")
+        self.vendor.notes = "famous for injera"
+        self.vendor.save()
+        self.assertMatches("injera")
+
+    def test_tag_added_and_removed(self):
+        self.vendor.cuisine_tags.add(self.tag)
+        self.assertMatches("ethiopian")
+        self.vendor.cuisine_tags.remove(self.tag)
+        self.assertMatches("ethiopian", False)
+
+    def test_tag_added_and_cleared_from_tag_side(self):
+        feature = FeatureTag.objects.create(name="outdoor_seating",
+                                            description="Sidewalk tables")
+        feature.vendor_set.add(self.vendor)
+        self.assertMatches("sidewalk")
+        self.assertMatches("outdoor")
+        feature.vendor_set.clear()
+        self.assertMatches("sidewalk", False)
+
+    def test_tag_renamed_and_deleted(self):
+        self.vendor.cuisine_tags.add(self.tag)
+        self.tag.description = "Eritrean"
+        self.tag.save()
+        self.assertMatches("eritrean")
+        self.tag.delete()
+        self.assertMatches("eritrean", False)
+
+    def test_review_approval(self):
+        review = Review.objects.create(vendor=self.vendor, author=get_user(),
+                                       content="the tofu scramble")
+        self.assertMatches("scramble", False)
+        review.approval_status = SF.APPROVED
+        review.save()
+        self.assertMatches("scramble")
+        review.delete()
+        self.assertMatches("scramble", False)
+
+
+class VendorRatingAggregateTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user()
+        self.vendor = Vendor.objects.create(name="Hibiscus Cafe",
+                                            approval_status=SF.APPROVED)
+
+    def review(self, vendor=None, **kwargs):
+        kwargs.setdefault('approval_status', SF.APPROVED)
+        return Review.objects.create(vendor=vendor or self.vendor,
+                                     author=self.user, **kwargs)
+
+    def reload(self, vendor=None):
+        return Vendor.objects.get(pk=(vendor or self.vendor).pk)
+
+    def test_aggregates(self):
+        self.review(food_rating=2)
+        second = self.review(food_rating=3, atmosphere_rating=4)
+        self.review(food_rating=1, approval_status=SF.PENDING)
+
+        vendor = self.reload()
+        self.assertEqual(vendor.approved_review_count, 2)
+        self.assertEqual(vendor.food_rating_count, 2)
+        self.assertEqual(vendor.food_rating_total, 5)
+        self.assertEqual(vendor.average_food_rating, 2.5)
+        self.assertEqual(vendor.atmosphere_rating_count, 1)
+        self.assertEqual(vendor.atmosphere_rating_total, 4)
+        self.assertEqual(vendor.average_atmosphere_rating, 4.0)
+        self.assertEqual(vendor.last_reviewed, second.created)
+        self.assertEqual(vendor.food_rating(), 2)
+
+    def test_unapproval_and_delete(self):
+        review = self.review(food_rating=2)
+        review.approval_status = SF.PENDING
+        review.save()
+        self.assertEqual(self.reload().approved_review_count, 0)
+
+        review.approval_status = SF.APPROVED
+        review.save()
+        self.assertEqual(self.reload().approved_review_count, 1)
+
+        Review.objects.filter(pk=review.pk).delete()
+        vendor = self.reload()
+        self.assertEqual(vendor.approved_review_count, 0)
+        self.assertEqual(vendor.average_food_rating, None)
+        self.assertEqual(vendor.last_reviewed, None)
+
+    def test_review_moved_to_another_vendor(self):
+        other = Vendor.objects.create(name="Green Line",
+                                      approval_status=SF.APPROVED)
+        review = self.review(food_rating=2)
+        review.vendor = other
+        review.save()
+        self.assertEqual(self.reload().food_rating(), None)
+        self.assertEqual(self.reload(other).food_rating(), 2)
+
+    def test_rebuild_command_repairs_drift(self):
+        self.review(food_rating=2)
+        Vendor.objects.update(approved_review_count=0, food_rating_total=0)
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        vendor = self.reload()
+        self.assertEqual(vendor.approved_review_count, 1)
+        self.assertEqual(vendor.food_rating(), 2)
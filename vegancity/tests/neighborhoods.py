@@ -0,0 +1,91 @@
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+from django.test import TestCase
+from mock import patch
+
+from vegancity import geocode, geocode_queue
+from vegancity.models import Neighborhood, Vendor
+from vegancity.fields import StatusField as SF
+
+
+def square(min_lng, min_lat, max_lng, max_lat):
+    return MultiPolygon(Polygon.from_bbox((min_lng, min_lat,
+                                           max_lng, max_lat)), srid=4326)
+
+
+class NeighborhoodBoundaryTest(TestCase):
+
+    def setUp(self):
+        self.center_city = Neighborhood.objects.create(name="Center City")
+        self.rittenhouse = Neighborhood.objects.create(name="Rittenhouse")
+        self.fishtown = Neighborhood.objects.create(name="Fishtown")
+
+        self.vendors = []
+        for i, (lng, lat) in enumerate([(-75.17, 39.95),
+                                        (-75.15, 39.95),
+                                        (-75.13, 39.97),
+                                        (-75.00, 40.10)]):
+            vendor = Vendor.objects.create(name="Vendor %d" % i,
+                                           approval_status=SF.APPROVED)
+            Vendor.objects.filter(pk=vendor.pk).update(
+                location=Point(lng, lat, srid=4326))
+            self.vendors.append(vendor)
+
+    def load_boundaries(self):
+        for neighborhood, boundary in (
+                (self.center_city, square(-75.18, 39.94, -75.14, 39.96)),
+                (self.rittenhouse, square(-75.18, 39.94, -75.16, 39.96)),
+                (self.fishtown, square(-75.14, 39.96, -75.12, 39.98))):
+            neighborhood.boundary = boundary
+            neighborhood.save()
+
+    def neighborhoods(self):
+        return [Vendor.objects.get(pk=v.pk).neighborhood
+                for v in self.vendors]
+
+    def test_containing_prefers_the_smallest_boundary(self):
+        self.load_boundaries()
+        self.assertEqual(
+            Neighborhood.objects.containing(Point(-75.17, 39.95, srid=4326)),
+            self.rittenhouse)
+        self.assertEqual(
+            Neighborhood.objects.containing(Point(-75.15, 39.95, srid=4326)),
+            self.center_city)
+        self.assertEqual(
+            Neighborhood.objects.containing(Point(-75.0, 40.1, srid=4326)),
+            None)
+
+    def test_every_vendor_is_assigned_at_once(self):
+        self.load_boundaries()
+        changed = Vendor.objects.assign_neighborhoods()
+        self.assertEqual(sorted(changed),
+                         sorted(v.pk for v in self.vendors[:3]))
+        self.assertEqual(self.neighborhoods(),
+                         [self.rittenhouse, self.center_city,
+                          self.fishtown, None])
+
+    def test_only_changed_vendors_are_updated(self):
+        self.load_boundaries()
+        Vendor.objects.assign_neighborhoods()
+        Vendor.objects.filter(pk=self.vendors[3].pk).update(
+            neighborhood=self.fishtown)
+        self.assertEqual(Vendor.objects.assign_neighborhoods(),
+                         [self.vendors[3].pk])
+        self.assertEqual(Vendor.objects.assign_neighborhoods(), [])
+
+    def test_nothing_is_assigned_without_boundaries(self):
+        Vendor.objects.filter(pk=self.vendors[0].pk).update(
+            neighborhood=self.fishtown)
+        self.assertEqual(Vendor.objects.assign_neighborhoods(), [])
+        self.assertEqual(self.neighborhoods()[0], self.fishtown)
+
+    def test_geocoding_uses_boundaries_over_the_geocoder(self):
+        self.load_boundaries()
+        vendor = Vendor.objects.create(name="Vendor 4",
+                                       address="100 Frankford Ave")
+        with patch.object(geocode, 'lookup',
+                          return_value=(39.97, -75.13, "Northern Liberties")):
+            geocode_queue.run_batch()
+        vendor = Vendor.objects.get(pk=vendor.pk)
+        self.assertEqual(vendor.neighborhood, self.fishtown)
+        self.assertFalse(Neighborhood.objects.filter(
+            name="Northern Liberties").exists())
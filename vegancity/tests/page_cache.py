@@ -0,0 +1,106 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from mock import patch
+
+from vegancity.models import Vendor, Review, CuisineTag
+from vegancity.tests.utils import get_user
+from vegancity.fields import StatusField as SF
+
+
+class PageCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.settings_override = self.settings(PAGE_CACHE_ENABLED=True)
+        self.settings_override.enable()
+        self.hibiscus = Vendor.objects.create(name="Hibiscus Cafe",
+                                              approval_status=SF.APPROVED)
+        self.green_line = Vendor.objects.create(name="Green Line",
+                                                approval_status=SF.APPROVED)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        cache.clear()
+
+    def assertCached(self, path, cached=True):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('X-Page-Cache'),
+                         'hit' if cached else 'miss')
+        return response
+
+    def test_second_anonymous_request_is_served_from_cache(self):
+        path = self.hibiscus.get_absolute_url()
+        self.assertCached(path, False)
+        with self.assertNumQueries(0):
+            response = self.assertCached(path)
+        self.assertContains(response, "Hibiscus Cafe")
+
+    def test_varies_on_query_string(self):
+        self.assertCached('/vendors/?current_query=hibiscus', False)
+        self.assertCached('/vendors/?current_query=green', False)
+        self.assertCached('/vendors/?current_query=hibiscus')
+
+    def test_searches_served_from_cache_are_logged(self):
+        path = '/vendors/?current_query=hibiscus'
+        with patch('vegancity.views.search_logger') as search_logger:
+            self.assertCached(path, False)
+            self.assertCached(path)
+        self.assertEqual(search_logger.info.call_count, 2)
+        for call in search_logger.info.call_args_list:
+            self.assertEqual(call[1]['extra']['current_query'], 'hibiscus')
+        self.assertEqual(
+            search_logger.info.call_args[1]['extra']['address_lookup'],
+            'cached')
+
+    def test_logged_in_users_are_not_cached(self):
+        User.objects.create_user('moby', password='vegan')
+        self.client.login(username='moby', password='vegan')
+        self.client.get('/about/')
+        response = self.client.get('/about/')
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_review_purges_pages_showing_its_vendor(self):
+        paths = [self.hibiscus.get_absolute_url(),
+                 self.green_line.get_absolute_url(),
+                 '/vendors/?current_query=hibiscus',
+                 '/vendors/?current_query=green']
+        for path in paths:
+            self.client.get(path)
+
+        Review.objects.create(vendor=self.hibiscus, author=get_user(),
+                              approval_status=SF.APPROVED, content="good")
+
+        self.assertCached(paths[0], False)
+        self.assertCached(paths[1])
+        self.assertCached(paths[2], False)
+        self.assertCached(paths[3])
+
+    def test_approval_purges_listings_and_home(self):
+        self.client.get('/')
+        self.client.get('/vendors/?current_query=green')
+        self.client.get(self.hibiscus.get_absolute_url())
+
+        vendor = Vendor.objects.create(name="Green Grocer")
+        self.assertCached('/vendors/?current_query=green')
+
+        vendor.approval_status = SF.APPROVED
+        vendor.save()
+        self.assertContains(
+            self.assertCached('/vendors/?current_query=green', False),
+            "Green Grocer")
+        self.assertContains(self.assertCached('/', False), "Green Grocer")
+        self.assertCached(self.hibiscus.get_absolute_url())
+
+    def test_clearing_a_tag_purges_its_vendors(self):
+        tag = CuisineTag.objects.create(name="cafe", description="Cafe")
+        self.hibiscus.cuisine_tags.add(tag)
+        paths = [self.hibiscus.get_absolute_url(),
+                 self.green_line.get_absolute_url()]
+        for path in paths:
+            self.client.get(path)
+
+        tag.vendor_set.clear()
+        self.assertCached(paths[0], False)
+        self.assertCached(paths[1])
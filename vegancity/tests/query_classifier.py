@@ -0,0 +1,81 @@
+from mock import Mock
+
+from django.test import TestCase
+
+from vegancity import geocode, search
+from vegancity.query_classifier import classify, vocabulary
+from vegancity.models import Vendor, Neighborhood, CuisineTag
+from vegancity.fields import StatusField as SF
+
+
+class QueryClassifierTest(TestCase):
+
+    def setUp(self):
+        Vendor.objects.create(name="Blackbird Pizzeria",
+                              approval_status=SF.APPROVED)
+        Neighborhood.objects.create(name="Queen Village")
+        CuisineTag.objects.create(name="ethiopian", description="Ethiopian")
+        vocabulary.invalidate()
+
+    def tearDown(self):
+        vocabulary.invalidate()
+
+    def assertClassified(self, query, should_geocode, reason):
+        self.assertEqual(classify(query), (should_geocode, reason))
+
+    def test_empty_query(self):
+        self.assertClassified("", False, 'empty')
+        self.assertClassified("  !! ", False, 'empty')
+
+    def test_street_patterns(self):
+        self.assertClassified("123 South St.", True, 'street_pattern')
+        self.assertClassified("18th and walnut", True, 'street_pattern')
+        self.assertClassified("19147", True, 'street_pattern')
+        self.assertClassified("south street", True, 'street_pattern')
+        self.assertClassified("Passyunk Ave", True, 'street_pattern')
+
+    def test_vendor_name(self):
+        self.assertClassified("blackbird pizzeria", False, 'vendor_name')
+
+    def test_new_vendors_are_known_at_once(self):
+        self.assertClassified("hibiscus cafe", True, 'unclassified')
+        Vendor.objects.create(name="Hibiscus Cafe",
+                              approval_status=SF.APPROVED)
+        self.assertClassified("hibiscus cafe", False, 'vendor_name')
+
+    def test_tag_name(self):
+        self.assertClassified("Ethiopian", False, 'tag_name')
+
+    def test_neighborhood(self):
+        self.assertClassified("queen village", True, 'neighborhood')
+        self.assertClassified("brunch in queen village", True, 'neighborhood')
+
+    def test_known_words(self):
+        self.assertClassified("vegan pizzeria", False, 'known_words')
+        self.assertClassified("brunch", False, 'known_words')
+
+    def test_unclassified_queries_are_geocoded(self):
+        self.assertClassified("fishtown", True, 'unclassified')
+
+
+class MasterSearchGeocodeTest(TestCase):
+
+    def setUp(self):
+        geocode.geocode_address = Mock(return_value=(100, 100, None))
+        vocabulary.invalidate()
+
+    def tearDown(self):
+        vocabulary.invalidate()
+
+    def test_non_address_skips_geocoder(self):
+        stats = {}
+        search.master_search("brunch", stats=stats)
+        self.assertFalse(geocode.geocode_address.called)
+        self.assertEqual(stats['address_lookup'], 'skipped:known_words')
+
+    def test_address_is_geocoded(self):
+        stats = {}
+        search.master_search("300 christian st", stats=stats)
+        geocode.geocode_address.assert_called_with("300 christian st")
+        self.assertEqual(stats['address_lookup'], 'geocoded:street_pattern')
+        self.assertEqual(stats['geocode_time_saved'], 0)
@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from mock import patch
+
+from vegancity import geocode
+from vegancity.models import Neighborhood, Vendor
+
+
+class RegeocodeTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+
+        patcher = patch.object(geocode, 'lookup',
+                               return_value=(39.94, -75.15, "Queen Village"))
+        self.lookup = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.vendors = []
+        for i, location in enumerate([None,
+                                      Point(-75.16, 39.95, srid=4326),
+                                      Point(-80.0, 30.0, srid=4326),
+                                      None]):
+            vendor = Vendor.objects.create(name="Vendor %d" % i,
+                                           address="%d South St" % i)
+            Vendor.objects.filter(pk=vendor.pk).update(location=location)
+            self.vendors.append(vendor)
+
+    def regeocode(self, *args, **options):
+        options.setdefault('checkpoint', self.checkpoint)
+        call_command('regeocode', *args, stdout=StringIO(),
+                     stderr=StringIO(), **options)
+
+    def locations(self):
+        return [Vendor.objects.get(pk=v.pk).location for v in self.vendors]
+
+    def looked_up(self):
+        return sorted(call[0][0] for call in self.lookup.call_args_list)
+
+    def test_filters_choose_vendors(self):
+        self.regeocode(missing_location=True, outside_bounds=True)
+        self.assertEqual(self.looked_up(),
+                         ["0 South St", "2 South St", "3 South St"])
+        self.assertEqual(self.locations(),
+                         [Point(-75.15, 39.94, srid=4326),
+                          Point(-75.16, 39.95, srid=4326),
+                          Point(-75.15, 39.94, srid=4326),
+                          Point(-75.15, 39.94, srid=4326)])
+        self.assertEqual(
+            Vendor.objects.get(pk=self.vendors[0].pk).neighborhood.name,
+            "Queen Village")
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_cached_results_are_not_used(self):
+        self.regeocode(missing_location=True)
+        for call in self.lookup.call_args_list:
+            self.assertEqual(call[1], {'refresh': True})
+
+    def test_runs_resume_from_the_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'filters': ['missing_location'],
+                       'last_pk': self.vendors[0].pk}, f)
+        self.regeocode(missing_location=True, batch_size=1)
+        self.assertEqual(self.looked_up(), ["3 South St"])
+
+    def test_checkpoint_must_match_the_filters(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'filters': ['no_neighborhood'], 'last_pk': 0}, f)
+        self.assertRaises(CommandError, self.regeocode,
+                          missing_location=True)
+        self.regeocode(missing_location=True, restart=True)
+        self.assertEqual(len(self.looked_up()), 2)
+
+    def test_vendors_without_results_are_left_alone(self):
+        self.lookup.return_value = (None, None, None)
+        self.regeocode(missing_location=True)
+        self.assertEqual(self.locations()[0], None)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @patch('vegancity.management.commands.regeocode.time')
+    def test_geocoder_failures_are_waited_out(self, time):
+        self.lookup.side_effect = [
+            (39.94, -75.15, "Queen Village"),
+            geocode.GeocodeError('OVER_QUERY_LIMIT'),
+            (39.94, -75.15, "Queen Village")]
+        self.regeocode(missing_location=True, batch_size=2, threads=1,
+                       retry_delay=10)
+        time.sleep.assert_called_once_with(10)
+        self.assertEqual(self.looked_up(),
+                         ["0 South St", "3 South St", "3 South St"])
+        self.assertEqual(self.locations()[3],
+                         Point(-75.15, 39.94, srid=4326))
+
+    @patch('vegancity.management.commands.regeocode.time')
+    def test_runs_stop_where_the_geocoder_failed(self, time):
+        results = [(39.94, -75.15, "Queen Village")]
+
+        def lookup(address, refresh=False):
+            if not results:
+                raise geocode.GeocodeError('OVER_QUERY_LIMIT')
+            return results.pop()
+
+        self.lookup.side_effect = lookup
+        self.assertRaises(CommandError, self.regeocode,
+                          missing_location=True, batch_size=1, threads=1,
+                          max_retries=2)
+        self.assertEqual([call[0][0] for call in time.sleep.call_args_list],
+                         [60, 120])
+        self.assertEqual(self.locations()[3], None)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['last_pk'], self.vendors[0].pk)
+
+
+class UpdateLocationsTest(TestCase):
+
+    def setUp(self):
+        self.neighborhood = Neighborhood.objects.create(name="Fishtown")
+        self.vendor = Vendor.objects.create(name="Vendor",
+                                            address="1 Frankford Ave")
+
+    def update(self, address="1 Frankford Ave", lng=-75.13, lat=39.97,
+               neighborhood_id=None):
+        return Vendor.objects.update_locations(
+            [(self.vendor.pk, address, lng, lat, neighborhood_id)])
+
+    def test_vendors_are_moved(self):
+        self.assertEqual(self.update(neighborhood_id=self.neighborhood.pk),
+                         [self.vendor.pk])
+        vendor = Vendor.objects.get(pk=self.vendor.pk)
+        self.assertEqual(vendor.location, Point(-75.13, 39.97, srid=4326))
+        self.assertEqual(vendor.neighborhood, self.neighborhood)
+
+    def test_unchanged_vendors_are_not_updated(self):
+        self.update(neighborhood_id=self.neighborhood.pk)
+        self.assertEqual(self.update(), [])
+
+    def test_vendors_with_new_addresses_are_not_updated(self):
+        self.assertEqual(self.update(address="2 Frankford Ave"), [])
+        self.assertEqual(Vendor.objects.get(pk=self.vendor.pk).location,
+                         None)
@@ -0,0 +1,250 @@
+from mock import Mock
+
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+
+from vegancity import geocode, search
+from vegancity.models import (Vendor, Review, CuisineTag, FeatureTag,
+                              Neighborhood)
+from vegancity.query_classifier import vocabulary
+from vegancity.tests.utils import get_user
+from vegancity.fields import StatusField as SF
+
+
+class SearchEngineTest(TestCase):
+
+    def setUp(self):
+        geocode.geocode_address = Mock(return_value=(None, None, None))
+        vocabulary.invalidate()
+
+        self.n1 = Neighborhood.objects.create(name="Queen Village")
+        self.by_name = Vendor.objects.create(name="Hibiscus Cafe",
+                                             neighborhood=self.n1,
+                                             approval_status=SF.APPROVED)
+        self.by_cuisine = Vendor.objects.create(name="Abyssinia",
+                                                approval_status=SF.APPROVED)
+        self.by_feature = Vendor.objects.create(name="Green Line",
+                                                approval_status=SF.APPROVED)
+        self.by_review = Vendor.objects.create(name="Royal Tavern",
+                                               neighborhood=self.n1,
+                                               approval_status=SF.APPROVED)
+        self.by_location = Vendor.objects.create(name="Grindcore House",
+                                                 approval_status=SF.APPROVED)
+        self.pending = Vendor.objects.create(name="Pending Hibiscus")
+
+        self.by_cuisine.cuisine_tags.add(CuisineTag.objects.create(
+            name="hibiscus_tea", description="Hibiscus Tea"))
+        self.by_feature.feature_tags.add(FeatureTag.objects.create(
+            name="hibiscus_patio", description="Hibiscus Patio"))
+        Review.objects.create(vendor=self.by_review, author=get_user(),
+                              approval_status=SF.APPROVED,
+                              content="The hibiscus lemonade is great")
+        Review.objects.create(vendor=self.pending, author=get_user(),
+                              approval_status=SF.APPROVED,
+                              content="hibiscus")
+
+        Vendor.objects.filter(pk=self.by_location.pk).update(
+            location=Point(-75.15, 39.94, srid=4326))
+
+    def tearDown(self):
+        vocabulary.invalidate()
+
+    def run_engines(self, query, point=None, initial_queryset=None):
+        results = [set(engine(query, point, initial_queryset))
+                   for engine in (search.union_search,
+                                  search.single_statement_search,
+                                  search.document_search)]
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+        return results[0]
+
+    def test_matches_every_source(self):
+        self.assertEqual(self.run_engines("hibiscus"),
+                         set([self.by_name, self.by_cuisine,
+                              self.by_feature, self.by_review]))
+
+    def test_matches_location(self):
+        point = Point(-75.151, 39.941, srid=4326)
+        self.assertEqual(self.run_engines("nothing matches", point),
+                         set([self.by_location]))
+
+    def test_initial_queryset_is_respected(self):
+        initial = Vendor.objects.approved().filter(neighborhood=self.n1)
+        self.assertEqual(self.run_engines("hibiscus",
+                                          initial_queryset=initial),
+                         set([self.by_name, self.by_review]))
+
+    def test_single_statement_is_one_query(self):
+        initial = Vendor.objects.approved().filter(neighborhood=self.n1)
+        with self.assertNumQueries(1):
+            list(search.single_statement_search("hibiscus", None, initial))
+
+    def test_document_is_one_query(self):
+        initial = Vendor.objects.approved().filter(neighborhood=self.n1)
+        with self.assertNumQueries(1):
+            list(search.document_search("hibiscus", None, initial))
+
+
+class RankedSearchTest(TestCase):
+
+    def setUp(self):
+        self.in_name = Vendor.objects.create(name="Hibiscus Cafe",
+                                             approval_status=SF.APPROVED)
+        self.in_notes = Vendor.objects.create(name="Green Line",
+                                              notes="hibiscus iced tea",
+                                              approval_status=SF.APPROVED)
+        self.nearby = Vendor.objects.create(name="Grindcore House",
+                                            approval_status=SF.APPROVED)
+        Vendor.objects.filter(pk=self.nearby.pk).update(
+            location=Point(-75.15, 39.94, srid=4326))
+
+    def test_results_are_ordered_by_rank(self):
+        results = list(search.document_search("hibiscus", None))
+        self.assertEqual(results, [self.in_name, self.in_notes])
+        self.assertTrue(results[0].search_score > results[1].search_score)
+
+    def test_closeness_outranks_text(self):
+        point = Point(-75.1501, 39.9401, srid=4326)
+        results = list(search.document_search("hibiscus", point))
+        self.assertEqual(results[0], self.nearby)
+
+    def test_paginate_visits_every_result_once(self):
+        for i in range(7):
+            Vendor.objects.create(name="Hibiscus %d" % i,
+                                  approval_status=SF.APPROVED)
+        results = search.document_search("hibiscus", None)
+        expected = list(results)
+
+        seen, after = [], None
+        while True:
+            page, after = search.paginate(results, after, page_size=3)
+            self.assertTrue(len(page) <= 3)
+            seen.extend(page)
+            if after is None:
+                break
+
+        self.assertEqual(seen, expected)
+
+    def test_paginate_unranked_vendors_by_name(self):
+        page, after = search.paginate(Vendor.objects.approved(),
+                                      page_size=2)
+        self.assertEqual(page, [self.in_notes, self.nearby])
+        page, after = search.paginate(Vendor.objects.approved(), after,
+                                      page_size=2)
+        self.assertEqual(page, [self.in_name])
+        self.assertEqual(after, None)
+
+    def test_bbox_param(self):
+        bbox = search.get_bbox_param({'bbox': '-75.2,39.9,-75.1,40.0'})
+        self.assertEqual(bbox.extent, (-75.2, 39.9, -75.1, 40.0))
+        self.assertEqual(bbox.srid, 4326)
+        self.assertEqual(search.get_bbox_param({}), None)
+        self.assertEqual(search.get_bbox_param({'bbox': '1,2,3'}), None)
+        self.assertEqual(search.get_bbox_param({'bbox': '3,2,1,4'}), None)
+        self.assertEqual(search.get_bbox_param({'bbox': 'a,b,c,d'}), None)
+
+    def test_estimate_count(self):
+        vendors = Vendor.objects.approved()
+        self.assertEqual(search.estimate_count(vendors, cap=5), (3, True))
+        self.assertEqual(search.estimate_count(vendors, cap=3), (3, True))
+        self.assertEqual(search.estimate_count(vendors, cap=2), (2, False))
+
+
+class TrigramSearchTest(TestCase):
+
+    def setUp(self):
+        self.n1 = Neighborhood.objects.create(name="Passyunk Square")
+        self.hibiscus = Vendor.objects.create(name="Hibiscus Cafe",
+                                              approval_status=SF.APPROVED)
+        self.bar = Vendor.objects.create(name="Test Vendor Bar",
+                                         approval_status=SF.APPROVED)
+        self.bart = Vendor.objects.create(name="Test Vendor Bart",
+                                          neighborhood=self.n1,
+                                          approval_status=SF.APPROVED)
+        self.bart.cuisine_tags.add(CuisineTag.objects.create(
+            name="ethiopian", description="Ethiopian"))
+
+    def assertFound(self, query, vendors):
+        self.assertEqual(set(search.document_search(query, None)),
+                         set(vendors))
+
+    def test_prefix_matches_name(self):
+        self.assertFound("hibis", [self.hibiscus])
+
+    def test_misspelling_matches_name(self):
+        self.assertFound("hibiscis cafe", [self.hibiscus])
+
+    def test_matches_neighborhood(self):
+        self.assertFound("passyunk", [self.bart])
+
+    def test_matches_tag_description(self):
+        self.assertFound("ethiop", [self.bart])
+
+    def test_exact_matches_are_not_diluted(self):
+        self.assertFound("bar", [self.bar])
+
+    def test_can_be_disabled(self):
+        with self.settings(SEARCH_TRIGRAM_ENABLED=False):
+            self.assertFound("hibis", [])
+
+    def test_like_wildcards_are_escaped(self):
+        self.assertFound("%", [])
+
+    def test_blank_and_stop_word_queries_match_nothing(self):
+        self.assertFound("", [])
+        self.assertFound(" ?! ", [])
+        self.assertFound("a", [])
+
+
+class NearestSearchTest(TestCase):
+
+    def setUp(self):
+        self.origin = Point(-75.15, 39.94, srid=4326)
+        self.vendors = {}
+        # a degree of longitude is about 85km here, and one of latitude
+        # about 111km, so "east" is nearer than "north" in meters but
+        # not in degrees.
+        for name, lng, lat in (("north_100m", -75.15, 39.9409),
+                               ("east_170m", -75.148, 39.94),
+                               ("north_200m", -75.15, 39.9418),
+                               ("north_2km", -75.15, 39.958)):
+            vendor = Vendor.objects.create(name=name,
+                                           approval_status=SF.APPROVED)
+            Vendor.objects.filter(pk=vendor.pk).update(
+                location=Point(lng, lat, srid=4326))
+            self.vendors[name] = vendor
+        Vendor.objects.create(name="pending")
+
+    def assertNearest(self, names, **kwargs):
+        results = list(search.nearest(self.origin, **kwargs))
+        self.assertEqual([v.name for v in results], names)
+        return results
+
+    def test_ordered_by_true_distance(self):
+        results = self.assertNearest(["north_100m", "east_170m",
+                                      "north_200m"], max_distance=1000)
+        self.assertAlmostEqual(results[0].distance, 100, delta=1)
+        self.assertAlmostEqual(results[1].distance, 170, delta=2)
+
+    def test_max_distance_and_limit(self):
+        self.assertNearest(["north_100m", "east_170m"], limit=2)
+        self.assertNearest(["north_100m"], max_distance=150)
+        self.assertEqual(len(list(search.nearest(self.origin,
+                                                 max_distance=5000))), 4)
+
+    def test_near_params(self):
+        point, limit, distance = search.get_near_params(
+            {'lat': '39.94', 'lng': '-75.15', 'limit': '1000',
+             'distance': '300'})
+        self.assertEqual(point.coords, (-75.15, 39.94))
+        self.assertEqual(limit, 100)
+        self.assertEqual(distance, 300)
+        self.assertEqual(search.get_near_params({}), (None, None, None))
+
+    def test_vendors_view_lists_nearest_first(self):
+        response = self.client.get('/vendors/', {'lat': '39.94',
+                                                 'lng': '-75.15',
+                                                 'distance': '1000'})
+        self.assertEqual([v.name for v in response.context['vendors']],
+                         ["north_100m", "east_170m", "north_200m"])
+        self.assertContains(response, "north_100m (100 m)")
@@ -0,0 +1,82 @@
+from mock import Mock, patch
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from vegancity import cache_versions, geocode, search, search_cache
+from vegancity.models import Vendor, Review, FeatureTag
+from vegancity.query_classifier import vocabulary
+from vegancity.tests.utils import get_user
+from vegancity.fields import StatusField as SF
+
+
+class SearchCacheKeyTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_equivalent_searches_share_a_key(self):
+        self.assertEqual(search_cache.make_key("Brunch!", 1, None, [3, 2]),
+                         search_cache.make_key("  brunch", 1, None, [2, 3]))
+
+    def test_units_and_zip_codes_are_part_of_the_key(self):
+        self.assertNotEqual(search_cache.make_key("4907 Catharine St"),
+                            search_cache.make_key("4907 Catharine St Apt 2"))
+        self.assertNotEqual(search_cache.make_key("4907 Catharine St"),
+                            search_cache.make_key("4907 Catharine St 19143"))
+
+    def test_filters_are_part_of_the_key(self):
+        self.assertNotEqual(search_cache.make_key("brunch", 1),
+                            search_cache.make_key("brunch", None, 1))
+
+    def test_changes_bump_the_generation(self):
+        vendor = Vendor.objects.create(name="Hibiscus Cafe")
+        tag = FeatureTag.objects.create(name="patio", description="Patio")
+        before = search_cache.generation()
+        vendor.feature_tags.add(tag)
+        after_tag = search_cache.generation()
+        Review.objects.create(vendor=vendor, author=get_user(),
+                              content="great")
+        after_review = search_cache.generation()
+        self.assertTrue(before < after_tag < after_review)
+
+    def test_generation_restarts_from_the_clock(self):
+        cache.delete(cache_versions.KEY_FORMAT % search_cache.GENERATION)
+        with patch.object(cache_versions.time, 'time',
+                          Mock(return_value=1234.5)):
+            search_cache.bump_generation()
+        self.assertEqual(search_cache.generation(), 1234500)
+
+
+class CachedVendorsViewTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        geocode.geocode_address = Mock(return_value=(None, None, None))
+        vocabulary.invalidate()
+        self.vendor = Vendor.objects.create(name="Hibiscus Cafe",
+                                            approval_status=SF.APPROVED)
+        patcher = patch.object(search, 'master_search',
+                               Mock(wraps=search.master_search))
+        self.master_search = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        vocabulary.invalidate()
+
+    def get_vendors(self, query):
+        response = self.client.get('/vendors/', {'current_query': query})
+        return response.context['vendors']
+
+    def test_repeat_searches_are_cached(self):
+        self.assertEqual(self.get_vendors("hibiscus"), [self.vendor])
+        self.assertEqual(self.get_vendors("Hibiscus "), [self.vendor])
+        self.assertEqual(self.master_search.call_count, 1)
+
+    def test_changes_invalidate_cached_searches(self):
+        self.get_vendors("hibiscus")
+        other = Vendor.objects.create(name="Hibiscus Two",
+                                      approval_status=SF.APPROVED)
+        self.assertEqual(set(self.get_vendors("hibiscus")),
+                         set([self.vendor, other]))
+        self.assertEqual(self.master_search.call_count, 2)
@@ -0,0 +1,106 @@
+import errno
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+
+from vegancity import tiles, vector_tiles
+from vegancity.models import Vendor, VegLevel
+from vegancity.fields import StatusField as SF
+
+
+class VectorTileTest(TestCase):
+
+    def setUp(self):
+        self.tile_dir = tempfile.mkdtemp()
+        self.settings_override = self.settings(MAP_TILE_DIR=self.tile_dir)
+        self.settings_override.enable()
+
+        self.vegan = VegLevel.objects.create(name="vegan",
+                                             description="Vegan")
+        self.vendor = Vendor.objects.create(name="Hibiscus Cafe",
+                                            veg_level=self.vegan,
+                                            approval_status=SF.APPROVED)
+        self.vendor.location = Point(-75.15, 39.94, srid=4326)
+        self.vendor.save()
+        self.tile = (14,) + tiles.tile_for(-75.15, 39.94, 14)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tile_dir)
+
+    def get_features(self, zoom, x, y):
+        response = self.client.get('/tiles/vendors/%d/%d/%d.json'
+                                   % (zoom, x, y))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['features']
+
+    def test_tile_shows_vendors_by_veg_level(self):
+        self.assertEqual(self.get_features(*self.tile), [{
+            'type': 'Feature',
+            'id': self.vendor.pk,
+            'geometry': {'type': 'Point', 'coordinates': [-75.15, 39.94]},
+            'properties': {'vegLevel': self.vegan.pk},
+        }])
+
+    def test_tiles_are_served_from_disk(self):
+        self.get_features(*self.tile)
+        self.assertTrue(os.path.exists(vector_tiles.tile_path(*self.tile)))
+        with self.assertNumQueries(0):
+            self.get_features(*self.tile)
+
+    def test_moving_a_vendor_deletes_only_its_tiles(self):
+        other = Vendor.objects.create(name="Green Line",
+                                      approval_status=SF.APPROVED)
+        other.location = Point(-75.05, 40.04, srid=4326)
+        other.save()
+        other_tile = (14,) + tiles.tile_for(-75.05, 40.04, 14)
+        new_tile = (14,) + tiles.tile_for(-75.25, 39.90, 14)
+        for tile in (self.tile, other_tile, new_tile):
+            self.get_features(*tile)
+
+        self.vendor.location = Point(-75.25, 39.90, srid=4326)
+        self.vendor.save()
+
+        self.assertFalse(os.path.exists(vector_tiles.tile_path(*self.tile)))
+        self.assertFalse(os.path.exists(vector_tiles.tile_path(*new_tile)))
+        self.assertTrue(os.path.exists(vector_tiles.tile_path(*other_tile)))
+        self.assertEqual(self.get_features(*self.tile), [])
+        self.assertEqual(len(self.get_features(*new_tile)), 1)
+
+    def test_vendor_on_a_tile_edge_is_only_in_its_own_tile(self):
+        zoom, x, y = self.tile
+        min_lng, min_lat, max_lng, max_lat = tiles.tile_bounds(zoom, x, y)
+        self.vendor.location = Point(min_lng, (min_lat + max_lat) / 2,
+                                     srid=4326)
+        self.vendor.save()
+        self.assertEqual(tiles.tile_for(self.vendor.location.x,
+                                        self.vendor.location.y, zoom), (x, y))
+        self.assertEqual(len(self.get_features(zoom, x, y)), 1)
+        self.assertEqual(self.get_features(zoom, x - 1, y), [])
+
+    def test_tiles_that_cant_be_deleted_dont_fail_saves(self):
+        error = OSError(errno.EACCES, "Permission denied")
+        with patch('vegancity.vector_tiles.os.remove',
+                        side_effect=error):
+            self.vendor.location = Point(-75.25, 39.90, srid=4326)
+            self.vendor.save()
+        self.assertEqual(Vendor.objects.get(pk=self.vendor.pk).location.x,
+                         -75.25)
+
+    def test_edits_the_map_does_not_show_keep_tiles(self):
+        self.get_features(*self.tile)
+        self.vendor.notes = "Try the hibiscus tea"
+        self.vendor.save()
+        self.assertTrue(os.path.exists(vector_tiles.tile_path(*self.tile)))
+
+    def test_zooms_outside_the_map_are_not_found(self):
+        response = self.client.get('/tiles/vendors/3/1/1.json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/tiles/vendors/14/16384/1.json')
+        self.assertEqual(response.status_code, 404)
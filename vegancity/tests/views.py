@@ -75,5 +75,7 @@ class HomeViewTest(ViewTestCase):
         request.user = self.user
         ctx = views._get_home_context(request)
         self.assertEqual(list(ctx['top_5']), [])
-        self.assertEqual(list(ctx['recently_added']), [t2, t1])
-        self.assertEqual(list(ctx['neighborhoods']), [n2])
+        self.assertEqual([e.object_id for e in ctx['recently_added']],
+                         [t2.pk, t1.pk])
+        self.assertEqual([e.object_id for e in ctx['neighborhoods']],
+                         [n2.pk])
@@ -0,0 +1,51 @@
+"""
+web mercator ("slippy map") tile arithmetic, as google maps uses it.
+
+Tiles are addressed by zoom, x and y, with x growing east and y growing
+south from the north-west corner of the world.
+"""
+
+import math
+
+# half the width of the world, in web mercator meters
+ORIGIN = 20037508.342789244
+
+# the latitudes web mercator stops at
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_size(zoom):
+    "the width of a tile at `zoom`, in web mercator meters."
+    return 2 * ORIGIN / (2 ** zoom)
+
+
+def tile_for(lng, lat, zoom):
+    "returns the (x, y) of the tile a point falls in."
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    n = 2 ** zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(math.radians(lat)) +
+                            1.0 / math.cos(math.radians(lat))) / math.pi)
+            / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom, x, y):
+    "returns a tile's (min_lng, min_lat, max_lng, max_lat)."
+    n = 2.0 ** zoom
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return (x / n * 360.0 - 180.0, lat(y + 1),
+            (x + 1) / n * 360.0 - 180.0, lat(y))
+
+
+def tiles_covering(extent, zoom):
+    "returns the (x, y) of every tile that overlaps a lng/lat extent."
+    min_lng, min_lat, max_lng, max_lat = extent
+    min_x, min_y = tile_for(min_lng, max_lat, zoom)
+    max_x, max_y = tile_for(max_lng, min_lat, zoom)
+    return [(x, y)
+            for x in range(min_x, max_x + 1)
+            for y in range(min_y, max_y + 1)]
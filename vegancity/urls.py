@@ -1,6 +1,6 @@
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
-from vegancity import views
+from vegancity import page_cache, views
 from .api import build_api
 
 admin.autodiscover()
@@ -22,9 +22,11 @@ urlpatterns = patterns(
     url(r'^vendors/add/thanks/$', views.VendorThanksView.as_view(), name="vendor_thanks"),
     url(r'^vendors/review/(?P<vendor_id>\d+)/$', views.new_review, name="new_review"),
     url(r'^vendors/(?P<pk>\d+)(-[\w\d]+)*/$', views.vendor_detail, name="vendor_detail"),
-    url(r'^connect/$', views.ConnectView.as_view(), name='connect'),
-    url(r'^about/$', views.AboutView.as_view(), name='about'),
-    url(r'^privacy/$', views.PrivacyView.as_view(), name='privacy'),
+    url(r'^status/geocoder/$', views.geocoder_status, name='geocoder_status'),
+    url(r'^tiles/vendors/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)\.json$', views.vendor_tile, name='vendor_tile'),
+    url(r'^connect/$', page_cache.cache_anonymous(views.ConnectView.as_view()), name='connect'),
+    url(r'^about/$', page_cache.cache_anonymous(views.AboutView.as_view()), name='about'),
+    url(r'^privacy/$', page_cache.cache_anonymous(views.PrivacyView.as_view()), name='privacy'),
     url(r'^vendors/review/(?P<pk>\d+)/thanks/$', views.ReviewThanksView.as_view(), name="review_thanks"),
 
     url(r'^accounts/login/$',  'django.contrib.auth.views.login', name='login'),
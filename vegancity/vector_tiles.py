@@ -0,0 +1,133 @@
+"""
+vendor locations published as vector tiles, one file per z/x/y.
+
+Each tile is a GeoJSON FeatureCollection of the approved vendors in it,
+with their ids and veg levels, computed in PostGIS and kept on disk
+under MAP_TILE_DIR. A tile is rendered the first time it is asked for,
+or ahead of time by the render_map_tiles command.
+
+When a vendor's location, veg level or approval changes, only the tiles
+that contain its old or new location, at each zoom, are deleted, and are
+rendered again on their next request. Tiles older than MAP_TILE_TTL
+seconds are rendered again too, which bounds how long a tile rendered
+while a change was being saved can be stale.
+"""
+
+import errno
+import json
+import logging
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from vegancity import tiles
+from vegancity.fields import StatusField as SF
+
+logger = logging.getLogger(__name__)
+
+# the envelope test uses the spatial index, but includes both edges, so
+# the coordinates are then held to the half open bounds `tile_for` uses:
+# a vendor on the line between two tiles is only in the tile east or
+# south of it, the only one its save deletes.
+
+TILE_SQL = """
+    SELECT %(id)s, COALESCE(%(veg_level_id)s, 0),
+           ST_X(%(location)s), ST_Y(%(location)s)
+    FROM %(table)s
+    WHERE %(approval_status)s = %%s
+    AND %(location)s && ST_MakeEnvelope(%%s, %%s, %%s, %%s, 4326)
+    AND ST_X(%(location)s) >= %%s AND ST_X(%(location)s) < %%s
+    AND ST_Y(%(location)s) > %%s AND ST_Y(%(location)s) <= %%s
+    ORDER BY %(id)s
+"""
+
+
+def zooms():
+    return range(settings.MAP_TILE_MIN_ZOOM, settings.MAP_TILE_MAX_ZOOM + 1)
+
+
+def tile_path(zoom, x, y):
+    return os.path.join(settings.MAP_TILE_DIR, str(zoom), str(x),
+                        '%d.json' % y)
+
+
+def render(zoom, x, y):
+    "returns the contents of a tile, as a string, from the database."
+    from vegancity.models import Vendor
+
+    qn = connection.ops.quote_name
+    table = qn(Vendor._meta.db_table)
+    sql = TILE_SQL % {
+        'table': table,
+        'id': "%s.%s" % (table, qn('id')),
+        'veg_level_id': "%s.%s" % (table, qn('veg_level_id')),
+        'location': "%s.%s" % (table, qn('location')),
+        'approval_status': "%s.%s" % (table, qn('approval_status')),
+    }
+
+    min_lng, min_lat, max_lng, max_lat = tiles.tile_bounds(zoom, x, y)
+    cursor = connection.cursor()
+    cursor.execute(sql, [SF.APPROVED, min_lng, min_lat, max_lng, max_lat,
+                         min_lng, max_lng, min_lat, max_lat])
+    features = [{
+        'type': 'Feature',
+        'id': pk,
+        'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+        'properties': {'vegLevel': veg_level_id},
+    } for pk, veg_level_id, lng, lat in cursor.fetchall()]
+
+    return json.dumps({'type': 'FeatureCollection', 'features': features})
+
+
+def write(zoom, x, y, content):
+    path = tile_path(zoom, x, y)
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    # written to a temporary file and renamed into place, so a tile is
+    # never read half written.
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    os.rename(temp_path, path)
+
+
+def get_tile(zoom, x, y):
+    "returns the contents of a tile, rendering it if it isn't on disk."
+    path = tile_path(zoom, x, y)
+    try:
+        if os.path.getmtime(path) > time.time() - settings.MAP_TILE_TTL:
+            with open(path) as f:
+                return f.read()
+    except (IOError, OSError):
+        pass
+
+    content = render(zoom, x, y)
+    write(zoom, x, y, content)
+    return content
+
+
+def invalidate(points):
+    """
+    deletes the tiles, at every zoom, that contain any of `points`.
+
+    This runs while vendors are saved, so a tile that can't be deleted is
+    logged rather than failing the save; it is rendered again once it is
+    older than MAP_TILE_TTL.
+    """
+    for zoom in zooms():
+        for x, y in set(tiles.tile_for(point.x, point.y, zoom)
+                        for point in points):
+            path = tile_path(zoom, x, y)
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    logger.warn("Couldn't delete map tile %s: %s" % (path, e))
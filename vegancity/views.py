@@ -1,7 +1,8 @@
 import functools
+import json
 import logging
 
-from django.http import HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render_to_response, get_object_or_404, redirect
 from django.template import RequestContext
 from django.core.urlresolvers import reverse
@@ -16,8 +17,7 @@ import django.contrib.auth.views
 from vegancity import forms
 from vegancity.models import (Vendor, CuisineTag, FeatureTag,
                               Neighborhood, User, Review)
-from vegancity import search
-from vegancity.fields import StatusField as SF
+from vegancity import geocode, leaderboards, page_cache, search, vector_tiles
 
 search_logger = logging.getLogger('vegancity-search')
 
@@ -35,73 +35,33 @@ def password_change(request):
 
 
 def _get_home_context(request):
-    vendors = Vendor.objects.approved().all()
-
     random_unreviewed = (Vendor
                          .objects.approved()
                          .get_random_unreviewed()
                          if request.user.is_authenticated()
                          else None)
 
-    # it would be cooler to include these queries with the model
-    # manager, but they are tiled to the presentation logic because
-    # they only get id and name, the necessary fields.
-    annotated_vendor_select = (
-        lambda query_prefix:
-        # TODO: remove string values
-        Vendor.objects.raw(
-            """
-            SELECT V.id, V.name
-            FROM vegancity_vendor V LEFT OUTER JOIN vegancity_review R
-            ON V.id = R.vendor_id
-            WHERE V.approval_status = '%(approved)s'
-            AND R.approval_status='%(approved)s'
-            %(query_prefix)s
-            LIMIT 5
-            """ % {'approved': SF.APPROVED,
-                   'query_prefix': query_prefix}))
-
-    top_5 = annotated_vendor_select(
-        """
-        AND (NOT R.food_rating IS NULL)
-        AND (NOT R.atmosphere_rating IS NULL)
-        GROUP BY V.id, V.name
-        ORDER BY avg(R.food_rating) DESC, avg(R.atmosphere_rating) DESC,
-        count(R.id) DESC, name
-        """)
-
-    recently_active = annotated_vendor_select(
-        """
-        GROUP BY V.id, V.name
-        ORDER BY max(R.created) DESC
-        """)
-
-    recently_added = (vendors.exclude(created=None)
-                      .order_by('-created')[:5])
-
-    most_reviewed = Vendor.objects.approved().with_reviews()[:5]
-
-    neighborhoods = Neighborhood.objects.with_vendors()[:21]
-
-    cuisine_tags = CuisineTag.objects.with_vendors()[:21]
-
-    feature_tags = FeatureTag.objects.with_vendors()[:21]
+    boards = leaderboards.get_lazy_boards()
 
     ctx = {
-        'top_5': top_5,
-        'most_reviewed': most_reviewed,
-        'recently_added': recently_added,
-        'recently_active': recently_active,
-        'neighborhoods': neighborhoods,
-        'cuisine_tags': cuisine_tags,
-        'feature_tags': feature_tags,
+        'top_5': boards['top_rated'],
+        'most_reviewed': boards['most_reviewed'],
+        'recently_added': boards['recently_added'],
+        'recently_active': boards['recently_active'],
+        'neighborhoods': boards['neighborhoods'],
+        'cuisine_tags': boards['cuisine_tags'],
+        'feature_tags': boards['feature_tags'],
         'random_unreviewed': random_unreviewed,
+        'fragment_versions': leaderboards.get_versions(),
+        'fragment_ttl': settings.HOME_FRAGMENT_TTL,
     }
 
     return ctx
 
 
+@page_cache.cache_anonymous
 def home(request):
+    page_cache.tag(request, 'home')
     return render_to_response("vegancity/home.html",
                               _get_home_context(request),
                               context_instance=RequestContext(request))
@@ -125,63 +85,118 @@ def user_profile(request, username):
             context_instance=RequestContext(request))
 
 
-def vendors(request):
-    has_get_params = len(request.GET) > 0
-    center_latitude, center_longitude = settings.DEFAULT_CENTER
-    current_query = request.GET.get('current_query', None)
-    previous_query = request.GET.get('previous_query', None)
-    selected_neighborhood_id = request.GET.get('neighborhood', '')
-    selected_cuisine_tag_id = request.GET.get('cuisine_tag', '')
-    selected_feature_tag_id = request.GET.get('feature_tag', '')
-    checked_feature_filters = [f for f
-                               in FeatureTag.objects.with_vendors()
-                               if request.GET.get(f.name) or
-                               selected_feature_tag_id == str(f.id)]
+def _search_log_fields(request, filters, search_stats):
+    fields = {
+        'request_user': request.user or None,
+        'request_ip': request.META.get('REMOTE_ADDR', None),
+        'previous_query': request.GET.get('previous_query', None),
+        'current_query': filters['current_query'],
+        'selected_neighborhood_id': filters['neighborhood_id'],
+        'selected_cuisine_tag_id': filters['cuisine_tag_id'],
+        'checked_feature_filters': filters['feature_tags'],
+    }
+    fields.update(search_stats)
+    return fields
 
-    vendors = Vendor.objects.approved().select_related('veg_level').all()
 
-    if selected_neighborhood_id:
-        vendors = vendors.filter(neighborhood__id=selected_neighborhood_id)
+def vendors(request):
+    """
+    the vendors page. Searches are logged here, outside the page cache,
+    so that searches served from it are logged too.
+    """
+    response = _vendors_page(request)
+    if request.GET:
+        fields = getattr(request, '_search_log_fields', None)
+        if fields is None:
+            # the page came from the cache, and so did its results.
+            fields = _search_log_fields(
+                request, search.get_filters(request.GET),
+                {'address_lookup': 'cached', 'geocode_time_saved': None,
+                 'geocoder_breaker': None})
+        search_logger.info('USER_SEARCH', extra=fields)
+    return response
 
-    if selected_cuisine_tag_id:
-        vendors = vendors.filter(cuisine_tags__id=selected_cuisine_tag_id)
 
-    if selected_feature_tag_id:
-        vendors = vendors.filter(feature_tags__id=selected_feature_tag_id)
+@page_cache.cache_anonymous
+def _vendors_page(request):
+    has_get_params = len(request.GET) > 0
+    center_latitude, center_longitude = settings.DEFAULT_CENTER
+    previous_query = request.GET.get('previous_query', None)
+    search_stats = {'address_lookup': None, 'geocode_time_saved': None,
+                    'geocoder_breaker': None}
+    next_page_url = None
 
-    for f in checked_feature_filters:
-        vendors = vendors.filter(feature_tags__id__exact=f.id)
+    vendor_ids, filters = search.filter_vendor_ids(request.GET,
+                                                   stats=search_stats)
+    current_query = filters['current_query']
 
     if current_query:
-        vendors = search.master_search(current_query, vendors)
+        page_ids, next_after = search.paginate_ids(
+            vendor_ids, after=search.get_int_param(request.GET, 'after'))
+        if next_after is not None:
+            next_page_params = request.GET.copy()
+            next_page_params['after'] = next_after
+            next_page_url = "%s?%s" % (reverse('vendors'),
+                                       next_page_params.urlencode())
+    else:
+        page_ids = vendor_ids
+
+    vendors = search.vendors_in_order(
+        page_ids, Vendor.objects.approved().select_related('veg_level'))
+    for vendor in vendors:
+        vendor.distance = filters['distances'].get(vendor.pk)
+    page_cache.tag(request, 'listings',
+                   *[page_cache.vendor_tag(pk) for pk in page_ids])
 
     ctx = {
         'cuisine_tags': CuisineTag.objects.all(),
         'feature_tags': FeatureTag.objects.all().order_by('description'),
         'neighborhoods': Neighborhood.objects.with_vendors().order_by('name'),
-        'vendor_count': len(vendors),
+        'vendor_count': len(vendor_ids),
+        'more_vendors': filters['more'],
         'vendors': vendors,
+        'geojson_url': "%s?%s" % (
+            reverse('api_get_geojson', kwargs={'api_name': 'v1',
+                                               'resource_name': 'vendors'}),
+            request.GET.urlencode()),
+        'next_page_url': next_page_url,
         'request_user': request.user or None,
         'request_ip': request.META.get('REMOTE_ADDR', None),
         'previous_query': previous_query,
         'current_query': current_query,
-        'selected_neighborhood_id': (int(selected_neighborhood_id)
-                                     if selected_neighborhood_id else None),
-        'selected_cuisine_tag_id': (int(selected_cuisine_tag_id)
-                                    if selected_cuisine_tag_id else None),
-        'checked_feature_filters': checked_feature_filters,
+        'selected_neighborhood_id': filters['neighborhood_id'],
+        'selected_cuisine_tag_id': filters['cuisine_tag_id'],
+        'checked_feature_filters': filters['feature_tags'],
         'has_get_params': has_get_params,
         'center_latitude': center_latitude,
         'center_longitude': center_longitude,
     }
-
-    if has_get_params:
-        search_logger.info('USER_SEARCH', extra=ctx)
+    ctx.update(search_stats)
+    request._search_log_fields = _search_log_fields(request, filters,
+                                                    search_stats)
 
     return render_to_response('vegancity/vendors.html', ctx,
                               context_instance=RequestContext(request))
 
 
+def vendor_tile(request, zoom, x, y):
+    zoom, x, y = int(zoom), int(x), int(y)
+    if zoom not in vector_tiles.zooms() or max(x, y) >= 2 ** zoom:
+        raise Http404
+    return HttpResponse(vector_tiles.get_tile(zoom, x, y),
+                        content_type='application/json')
+
+
+def geocoder_status(request):
+    """
+    the geocoder's circuit breaker, as JSON, for monitoring: the state
+    this process sees, and what every process has published.
+    """
+    status = geocode.breaker.metrics()
+    status['process_state'] = geocode.breaker.state
+    return HttpResponse(json.dumps(status), content_type='application/json')
+
+
 ###########################
 ## data entry views
 ###########################
@@ -340,8 +355,10 @@ def account_edit(request):
                               context_instance=RequestContext(request))
 
 
+@page_cache.cache_anonymous
 def vendor_detail(request, pk):
     vendor = get_object_or_404(Vendor.objects.approved(), pk=pk)
+    page_cache.tag(request, page_cache.vendor_tag(vendor.pk))
     approved_reviews = vendor.approved_reviews()
     return render_to_response('vegancity/vendor_detail.html',
                               {'vendor': vendor,